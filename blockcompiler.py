@@ -0,0 +1,345 @@
+import interpreter
+
+## Basic block compiler
+# Optional execution engine which splits the compiled program into basic blocks
+# and turns each block into a single python function, generated from source
+# with every instruction inlined. Blocks are compiled lazily, the first time the
+# pc lands on their first line, and are stored in the cpu's block table
+# (cpu.blocks), indexed by line number. Since any line can be the start of a
+# block, register branches and interrupt returns into the middle of a block
+# just compile (or reuse) a block starting at that line.
+
+# A block function returns a tuple with the next pc and the number of
+# instructions retired. The next pc is interpreter.THREAD_HALT if an instruction
+# halted the CPU, in which case cpu.pc is the line of that instruction. A block
+# exits early if an instruction pushed an IRQ, so that the run loop can start
+# the interrupt service routine as if the instructions had been stepped
+
+# Maximum number of instructions in a block
+BLOCK_MAX = 64
+
+# Kinds of instruction template
+PLAIN    = 0 # Only changes registers or memory
+RAISES   = 1 # May push an IRQ, so the block checks for pending IRQs afterwards
+COMPARE  = 2 # Sets the flags. Also keeps them in the locals z and s
+FCOMPARE = 3 # May push an IRQ and sets the flags, but not the locals
+BRANCH   = 4 # Ends the block
+CBRANCH  = 5 # Compare and branch. Sets the flags and locals like COMPARE, then
+             # ends the block with a branch (see compare_conditions)
+
+# Instruction templates
+# Syntax:
+# "instruction function name": (native source, reference source, kind),
+# The native source is used with the native ALU backend and the reference
+# source with any other backend. If the reference source is None, the native
+# source is used for both. Sources are formatted with the compiled line's
+# operands ({1}, {2}, ...) and the following fields:
+# {mask}   - Word mask
+# {wl}     - Word length in bits
+# {intMax} - Signed integer maximum
+# {sbm}    - Float sign bit mask
+# {zero}   - Expression for the zero flag
+# {sign}   - Expression for the sign flag
+# {next}   - Line after the instruction
+# {k}      - Number of instructions retired, counting this one
+templates = {
+    "op_ldr":     ("reg[{1}] = ldr(cpu, {2})", None, RAISES),
+    "eop_ldr_r":  ("reg[{1}] = ldr(cpu, reg[{2}])", None, RAISES),
+    "op_str":     ("str_(cpu, {2}, reg[{1}])", None, RAISES),
+    "eop_str_da": ("str_(cpu, {2}, {1})", None, RAISES),
+    "eop_str_rr": ("str_(cpu, reg[{2}], reg[{1}])", None, RAISES),
+    "eop_str_dr": ("str_(cpu, reg[{2}], {1})", None, RAISES),
+    "eop_ldr_rd": ("reg[{1}] = ldr(cpu, (reg[{2}] + {3}) & {mask})",
+                   "reg[{1}] = ldr(cpu, add(cpu, reg[{2}], {3}, {wl}))", RAISES),
+    "eop_ldr_rr": ("reg[{1}] = ldr(cpu, (reg[{2}] + reg[{3}]) & {mask})",
+                   "reg[{1}] = ldr(cpu, add(cpu, reg[{2}], reg[{3}], {wl}))", RAISES),
+    "eop_str_rrd": ("str_(cpu, (reg[{2}] + {3}) & {mask}, reg[{1}])",
+                    "str_(cpu, add(cpu, reg[{2}], {3}, {wl}), reg[{1}])", RAISES),
+    "eop_str_drd": ("str_(cpu, (reg[{2}] + {3}) & {mask}, {1})",
+                    "str_(cpu, add(cpu, reg[{2}], {3}, {wl}), {1})", RAISES),
+    "eop_str_rrr": ("str_(cpu, (reg[{2}] + reg[{3}]) & {mask}, reg[{1}])",
+                    "str_(cpu, add(cpu, reg[{2}], reg[{3}], {wl}), reg[{1}])", RAISES),
+    "eop_str_drr": ("str_(cpu, (reg[{2}] + reg[{3}]) & {mask}, {1})",
+                    "str_(cpu, add(cpu, reg[{2}], reg[{3}], {wl}), {1})", RAISES),
+    "eop_ldrp_d": ("t = reg[{2}]\nreg[{2}] = (t + {3}) & {mask}\nreg[{1}] = ldr(cpu, t)",
+                   "t = reg[{2}]\nreg[{2}] = add(cpu, t, {3}, {wl})\nreg[{1}] = ldr(cpu, t)", RAISES),
+    "eop_ldrp_r": ("t = reg[{2}]\nreg[{2}] = (t + reg[{3}]) & {mask}\nreg[{1}] = ldr(cpu, t)",
+                   "t = reg[{2}]\nreg[{2}] = add(cpu, t, reg[{3}], {wl})\nreg[{1}] = ldr(cpu, t)", RAISES),
+    "eop_strp_rd": ("str_(cpu, reg[{2}], reg[{1}])\nreg[{2}] = (reg[{2}] + {3}) & {mask}",
+                    "str_(cpu, reg[{2}], reg[{1}])\nreg[{2}] = add(cpu, reg[{2}], {3}, {wl})", RAISES),
+    "eop_strp_dd": ("str_(cpu, reg[{2}], {1})\nreg[{2}] = (reg[{2}] + {3}) & {mask}",
+                    "str_(cpu, reg[{2}], {1})\nreg[{2}] = add(cpu, reg[{2}], {3}, {wl})", RAISES),
+    "eop_strp_rr": ("str_(cpu, reg[{2}], reg[{1}])\nreg[{2}] = (reg[{2}] + reg[{3}]) & {mask}",
+                    "str_(cpu, reg[{2}], reg[{1}])\nreg[{2}] = add(cpu, reg[{2}], reg[{3}], {wl})", RAISES),
+    "eop_strp_dr": ("str_(cpu, reg[{2}], {1})\nreg[{2}] = (reg[{2}] + reg[{3}]) & {mask}",
+                    "str_(cpu, reg[{2}], {1})\nreg[{2}] = add(cpu, reg[{2}], reg[{3}], {wl})", RAISES),
+    "op_add_d":   ("reg[{1}] = (reg[{2}] + {3}) & {mask}",
+                   "reg[{1}] = add(cpu, reg[{2}], {3}, {wl})", PLAIN),
+    "op_add_r":   ("reg[{1}] = (reg[{2}] + reg[{3}]) & {mask}",
+                   "reg[{1}] = add(cpu, reg[{2}], reg[{3}], {wl})", PLAIN),
+    "op_sub_d":   ("reg[{1}] = (reg[{2}] - {3}) & {mask}",
+                   "reg[{1}] = sub(cpu, reg[{2}], {3}, {wl})", PLAIN),
+    "op_sub_r":   ("reg[{1}] = (reg[{2}] - reg[{3}]) & {mask}",
+                   "reg[{1}] = sub(cpu, reg[{2}], reg[{3}], {wl})", PLAIN),
+    "eop_mul_d":  ("reg[{1}] = (reg[{2}] * {3}) & {mask}",
+                   "reg[{1}] = mul(cpu, reg[{2}], {3}, {wl})", PLAIN),
+    "eop_mul_r":  ("reg[{1}] = (reg[{2}] * reg[{3}]) & {mask}",
+                   "reg[{1}] = mul(cpu, reg[{2}], reg[{3}], {wl})", PLAIN),
+    "eop_div_d":  ("reg[{1}] = div(cpu, reg[{2}], {3}, {wl})[0]", None, RAISES),
+    "eop_div_r":  ("reg[{1}] = div(cpu, reg[{2}], reg[{3}], {wl})[0]", None, RAISES),
+    "eop_rem_d":  ("reg[{1}] = div(cpu, reg[{2}], {3}, {wl})[1]", None, RAISES),
+    "eop_rem_r":  ("reg[{1}] = div(cpu, reg[{2}], reg[{3}], {wl})[1]", None, RAISES),
+    "eop_qadd_d": ("reg[{1}] = qadd(cpu, reg[{2}], {3}, {wl})", None, PLAIN),
+    "eop_qadd_r": ("reg[{1}] = qadd(cpu, reg[{2}], reg[{3}], {wl})", None, PLAIN),
+    "eop_qsub_d": ("reg[{1}] = qsub(cpu, reg[{2}], {3}, {wl})", None, PLAIN),
+    "eop_qsub_r": ("reg[{1}] = qsub(cpu, reg[{2}], reg[{3}], {wl})", None, PLAIN),
+    "eop_qmul_d": ("reg[{1}] = qmul(cpu, reg[{2}], {3}, {wl})", None, PLAIN),
+    "eop_qmul_r": ("reg[{1}] = qmul(cpu, reg[{2}], reg[{3}], {wl})", None, PLAIN),
+    "eop_qdiv_d": ("reg[{1}] = qdiv(cpu, reg[{2}], {3}, {wl})", None, RAISES),
+    "eop_qdiv_r": ("reg[{1}] = qdiv(cpu, reg[{2}], reg[{3}], {wl})", None, RAISES),
+    "op_lsl_d":   ("reg[{1}] = (reg[{2}] << {3}) & {mask}",
+                   "reg[{1}] = shl(cpu, reg[{2}], {3}, {wl})", PLAIN),
+    "op_lsl_r":   ("reg[{1}] = (reg[{2}] << reg[{3}]) & {mask}",
+                   "reg[{1}] = shl(cpu, reg[{2}], reg[{3}], {wl})", PLAIN),
+    "op_lsr_d":   ("reg[{1}] = (reg[{2}] >> {3}) & {mask}",
+                   "reg[{1}] = shr(cpu, reg[{2}], {3}, {wl})", PLAIN),
+    "op_lsr_r":   ("reg[{1}] = (reg[{2}] >> reg[{3}]) & {mask}",
+                   "reg[{1}] = shr(cpu, reg[{2}], reg[{3}], {wl})", PLAIN),
+    "op_mov_d":   ("reg[{1}] = {2}", None, PLAIN),
+    "op_mov_r":   ("reg[{1}] = reg[{2}]", None, PLAIN),
+    "eop_mov_f":  ("reg[{1}] = {2}", None, PLAIN),
+    "op_cmp_d":   ("t = (reg[{1}] - {2}) & {mask}\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}",
+                   "t = sub(cpu, reg[{1}], {2}, {wl})\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}", COMPARE),
+    "op_cmp_r":   ("t = (reg[{1}] - reg[{2}]) & {mask}\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}",
+                   "t = sub(cpu, reg[{1}], reg[{2}], {wl})\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}", COMPARE),
+    "op_b_l":     ("return ({1}, {k})", None, BRANCH),
+    "op_beq_l":   ("if {zero}:\n    return ({1}, {k})", None, BRANCH),
+    "op_bne_l":   ("if not {zero}:\n    return ({1}, {k})", None, BRANCH),
+    "op_bgt_l":   ("if not {sign} and not {zero}:\n    return ({1}, {k})", None, BRANCH),
+    "op_blt_l":   ("if {sign}:\n    return ({1}, {k})", None, BRANCH),
+    "op_and_d":   ("reg[{1}] = reg[{2}] & {3}", None, PLAIN),
+    "op_and_r":   ("reg[{1}] = reg[{2}] & reg[{3}]", None, PLAIN),
+    "op_orr_d":   ("reg[{1}] = reg[{2}] | {3}", None, PLAIN),
+    "op_orr_r":   ("reg[{1}] = reg[{2}] | reg[{3}]", None, PLAIN),
+    "op_eor_d":   ("reg[{1}] = reg[{2}] ^ {3}", None, PLAIN),
+    "op_eor_r":   ("reg[{1}] = reg[{2}] ^ reg[{3}]", None, PLAIN),
+    "op_halt":    ("cpu.halt = True\ncpu.pc = {pc}\nreturn ({halt}, {k})", None, BRANCH),
+    "eop_fadd_f": ("reg[{1}] = fadd(cpu, reg[{2}], {3})", None, PLAIN),
+    "eop_fadd_r": ("reg[{1}] = fadd(cpu, reg[{2}], reg[{3}])", None, PLAIN),
+    "eop_fsub_f": ("reg[{1}] = fadd(cpu, reg[{2}], {3} ^ {sbm})", None, PLAIN),
+    "eop_fsub_r": ("reg[{1}] = fadd(cpu, reg[{2}], reg[{3}] ^ {sbm})", None, PLAIN),
+    "eop_fmul_f": ("reg[{1}] = fmul(cpu, reg[{2}], {3})", None, PLAIN),
+    "eop_fmul_r": ("reg[{1}] = fmul(cpu, reg[{2}], reg[{3}])", None, PLAIN),
+    "eop_fdiv_f": ("reg[{1}] = fdiv(cpu, reg[{2}], {3})", None, PLAIN),
+    "eop_fdiv_r": ("reg[{1}] = fdiv(cpu, reg[{2}], reg[{3}])", None, PLAIN),
+    "eop_fcmp_f": ("fcmp(cpu, reg[{1}], {2})", None, FCOMPARE),
+    "eop_fcmp_r": ("fcmp(cpu, reg[{1}], reg[{2}])", None, FCOMPARE),
+    "eop_inc":    ("reg[{1}] = (reg[{1}] + 1) & {mask}",
+                   "reg[{1}] = add(cpu, reg[{1}], 1, {wl})", PLAIN),
+    "eop_dec":    ("reg[{1}] = (reg[{1}] - 1) & {mask}",
+                   "reg[{1}] = sub(cpu, reg[{1}], 1, {wl})", PLAIN),
+    "eop_cbeq_d": ("t = (reg[{1}] - {2}) & {mask}\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}",
+                   "t = sub(cpu, reg[{1}], {2}, {wl})\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}", CBRANCH),
+    "eop_cbeq_r": ("t = (reg[{1}] - reg[{2}]) & {mask}\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}",
+                   "t = sub(cpu, reg[{1}], reg[{2}], {wl})\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}", CBRANCH),
+    "eop_cbne_d": ("t = (reg[{1}] - {2}) & {mask}\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}",
+                   "t = sub(cpu, reg[{1}], {2}, {wl})\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}", CBRANCH),
+    "eop_cbne_r": ("t = (reg[{1}] - reg[{2}]) & {mask}\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}",
+                   "t = sub(cpu, reg[{1}], reg[{2}], {wl})\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}", CBRANCH),
+    "eop_cblt_d": ("t = (reg[{1}] - {2}) & {mask}\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}",
+                   "t = sub(cpu, reg[{1}], {2}, {wl})\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}", CBRANCH),
+    "eop_cblt_r": ("t = (reg[{1}] - reg[{2}]) & {mask}\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}",
+                   "t = sub(cpu, reg[{1}], reg[{2}], {wl})\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}", CBRANCH),
+    "eop_cbgt_d": ("t = (reg[{1}] - {2}) & {mask}\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}",
+                   "t = sub(cpu, reg[{1}], {2}, {wl})\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}", CBRANCH),
+    "eop_cbgt_r": ("t = (reg[{1}] - reg[{2}]) & {mask}\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}",
+                   "t = sub(cpu, reg[{1}], reg[{2}], {wl})\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}", CBRANCH),
+    "eop_dbnz":   ("reg[{1}] = t = (reg[{1}] - 1) & {mask}\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}",
+                   "reg[{1}] = t = sub(cpu, reg[{1}], 1, {wl})\ncpu.zero = z = t == 0\ncpu.sign = s = t > {intMax}", CBRANCH)
+}
+
+# Templates used instead of the above when the word size has float binary
+# operation tables. Same syntax, but without a reference source
+table_templates = {
+    "eop_fadd_f": ("reg[{1}] = fadd_t[(reg[{2}] << {wl}) | {3}]", PLAIN),
+    "eop_fadd_r": ("reg[{1}] = fadd_t[(reg[{2}] << {wl}) | reg[{3}]]", PLAIN),
+    "eop_fsub_f": ("reg[{1}] = fadd_t[(reg[{2}] << {wl}) | ({3} ^ {sbm})]", PLAIN),
+    "eop_fsub_r": ("reg[{1}] = fadd_t[(reg[{2}] << {wl}) | (reg[{3}] ^ {sbm})]", PLAIN),
+    "eop_fmul_f": ("reg[{1}] = fmul_t[(reg[{2}] << {wl}) | {3}]", PLAIN),
+    "eop_fmul_r": ("reg[{1}] = fmul_t[(reg[{2}] << {wl}) | reg[{3}]]", PLAIN),
+    "eop_fdiv_f": ("reg[{1}] = fdiv_t[(reg[{2}] << {wl}) | {3}]", PLAIN),
+    "eop_fdiv_r": ("reg[{1}] = fdiv_t[(reg[{2}] << {wl}) | reg[{3}]]", PLAIN)
+}
+
+# Source for instructions without a template. Runs the instruction's threaded
+# closure and exits the block if it didn't continue to the next line
+generic_template = "n = t{pc}()\nif n != {next}:\n    return (n, {k})"
+
+# Source appended after instructions which may push an IRQ
+irq_check = "if irq.flag and not cpu.intc:\n    return ({next}, {k})"
+
+# Index of the label operand of instructions which branch to a label. The lines
+# they point to are block leaders, so blocks end right before them
+label_operands = {
+    "op_b_l":   1,
+    "op_beq_l": 1,
+    "op_bne_l": 1,
+    "op_bgt_l": 1,
+    "op_blt_l": 1,
+    "eop_mivt": 2,
+    "eop_bl":   1,
+    "eop_cbeq_d": 3,
+    "eop_cbeq_r": 3,
+    "eop_cbne_d": 3,
+    "eop_cbne_r": 3,
+    "eop_cblt_d": 3,
+    "eop_cblt_r": 3,
+    "eop_cbgt_d": 3,
+    "eop_cbgt_r": 3,
+    "eop_dbnz":   2
+}
+
+# Branch conditions of the compare and branch instructions, in template syntax.
+# They branch to the label operand, the second to last one, if the condition
+# holds, else to the fall through line in the last operand
+compare_conditions = {
+    "eop_cbeq_d": "{zero}",
+    "eop_cbeq_r": "{zero}",
+    "eop_cbne_d": "not {zero}",
+    "eop_cbne_r": "not {zero}",
+    "eop_cblt_d": "{sign}",
+    "eop_cblt_r": "{sign}",
+    "eop_cbgt_d": "not {sign} and not {zero}",
+    "eop_cbgt_r": "not {sign} and not {zero}",
+    "eop_dbnz":   "not {zero}"
+}
+
+def block_leaders(compiled):
+    # Returns the set of lines which are the target of a label branch
+    leaders = set()
+    for line in compiled:
+        if line != None and line[0].__name__ in label_operands:
+            leaders.add(line[label_operands[line[0].__name__]])
+    return leaders
+
+def block_fields(cpu):
+    # Returns the source fields which only depend on the cpu's configuration
+    return {
+        "mask":   cpu.uintMax,
+        "wl":     cpu.wordLength,
+        "intMax": cpu.intMax,
+        "sbm":    cpu.signBitMask,
+        "halt":   interpreter.THREAD_HALT
+    }
+
+def block_template(cpu, name):
+    # Returns the source and kind of the template for an instruction function
+    # name, picking the source for the cpu's ALU backend
+    if name in table_templates and cpu.floatTable != None and cpu.floatTable.add != None:
+        return table_templates[name]
+    nativeSource, referenceSource, kind = templates[name]
+    if cpu.alu == "native" or referenceSource == None:
+        return nativeSource, kind
+    return referenceSource, kind
+
+def block_namespace(cpu, lines):
+    # Returns the names used by generated source, including the threaded
+    # closures of the given lines without a template, as t<line>
+    namespace = {
+        "cpu":  cpu,
+        "reg":  cpu.reg,
+        "irq":  cpu.irq,
+        "ldr":  interpreter.oputil_ldr,
+        "str_": interpreter.oputil_str,
+        "add":  cpu.add_twos,
+        "sub":  cpu.sub_twos,
+        "mul":  cpu.mul_twos,
+        "div":  cpu.div_twos,
+        "shl":  cpu.shift_left,
+        "shr":  cpu.shift_right,
+        "qadd": interpreter.oputil_fixed_add,
+        "qsub": interpreter.oputil_fixed_sub,
+        "qmul": interpreter.oputil_fixed_mul,
+        "qdiv": interpreter.oputil_fixed_div,
+        "fadd": cpu.float_add,
+        "fmul": cpu.float_mul,
+        "fdiv": cpu.float_div,
+        "fcmp": cpu.float_cmp
+    }
+    if cpu.floatTable != None and cpu.floatTable.add != None:
+        namespace["fadd_t"] = cpu.floatTable.add
+        namespace["fmul_t"] = cpu.floatTable.mul
+        namespace["fdiv_t"] = cpu.floatTable.div
+    for l in lines:
+        line = cpu.compiled[l]
+        if line != None and line[0].__name__ not in templates:
+            namespace["t{:d}".format(l)] = cpu.threaded[l]
+    return namespace
+
+def block_function(name, args, body, namespace, filename):
+    # Compiles a function from a list of statements. Every name in the
+    # namespace is bound as a default argument, so that it is a local
+    source = "def {:s}({:s}):\n".format(name, ", ".join(args + [n + "=" + n for n in namespace]))
+    for statement in body:
+        for sourceLine in statement.split("\n"):
+            source += "    " + sourceLine + "\n"
+    exec(compile(source, filename, "exec"), namespace)
+    return namespace[name]
+
+def block_compile(cpu, start):
+    # Compiles the block starting at line start. Returns the block function and
+    # the number of instructions in it
+    fields = block_fields(cpu)
+    body = []
+    # Whether the flags are known to be in the locals z and s
+    flagsLocal = False
+    pc = start
+    k = 0
+    while pc < len(cpu.compiled) and k < BLOCK_MAX:
+        # Stop before label branch targets, except at the start
+        if pc != start and pc in cpu.blockLeaders:
+            break
+        line = cpu.compiled[pc]
+        k += 1
+        fields["next"] = pc + 1
+        fields["k"] = k
+        fields["pc"] = pc
+        fields["zero"] = "z" if flagsLocal else "cpu.zero"
+        fields["sign"] = "s" if flagsLocal else "cpu.sign"
+
+        # Empty lines don't need any source
+        if line == None:
+            pc += 1
+            continue
+
+        name = line[0].__name__
+        if name in templates:
+            source, kind = block_template(cpu, name)
+            body.append(source.format(*line, **fields))
+            if kind == RAISES or kind == FCOMPARE:
+                body.append(irq_check.format(**fields))
+            if kind == COMPARE:
+                flagsLocal = True
+            elif kind == FCOMPARE:
+                flagsLocal = False
+            elif kind == BRANCH:
+                pc += 1
+                break
+            elif kind == CBRANCH:
+                condition = compare_conditions[name].format(zero = "z", sign = "s")
+                body.append("if {:s}:\n    return ({:d}, {:d})".format(condition, line[-2], k))
+                body.append("return ({:d}, {:d})".format(line[-1], k))
+                pc += 1
+                break
+        else:
+            # The closure may change anything, including the flags
+            body.append(generic_template.format(**fields))
+            body.append(irq_check.format(**fields))
+            flagsLocal = False
+        pc += 1
+
+    # Fall through to the line after the block
+    body.append("return ({:d}, {:d})".format(pc, k))
+
+    namespace = block_namespace(cpu, range(start, pc))
+    return block_function("block", [], body, namespace, "<block {:d}>".format(start)), k
@@ -1,4 +1,6 @@
 from enum import Enum
+from fractions import Fraction
+from math import floor
 import interpreter
 import time
 import re
@@ -20,9 +22,15 @@ class token(Enum):
     whitespace = 9
     error      = 10
 
+# Ends the operand list of opcodes whose last operand can be repeated, like
+# the register lists of PUSH and POP
+OPERANDS_REPEAT = "..."
+# Token type matching a missing operand, for optional last operands
+OPERAND_NONE = None
+
 ## Validation regexes
 # Valid code line regex
-valid_regex = re.compile("^([a-zA-Z_-]+:)?(\t+[a-zA-Z]+(\s+(#(-?[0-9]+(\.[0-9]+)?|-?inf|nan)|[rR][0-9]+|[0-9]+|[a-zA-Z_-]+)(\s*,\s*(#(-?[0-9]+(\.[0-9]+)?|-?inf|nan)|[rR][0-9]+|[0-9]+|[a-zA-Z_-]+))*)?)?\s*(;.*)?$")
+valid_regex = re.compile("^([a-zA-Z_-]+:)?(\t+[a-zA-Z]+(\s+(#(-?[0-9]+(\.[0-9]+)?[qQ]?|-?inf|nan)|[rR][0-9]+|[0-9]+|[a-zA-Z_-]+)(\s*,\s*(#(-?[0-9]+(\.[0-9]+)?[qQ]?|-?inf|nan)|[rR][0-9]+|[0-9]+|[a-zA-Z_-]+))*)?)?\s*(;.*)?$")
 # Error regexes
 symbol_regex = re.compile("^[ \ta-zA-Z0-9#,\.:_-]*(;.*)?$")
 spaces_regex = re.compile("^ ")
@@ -35,6 +43,8 @@ split_regex = re.compile("(,)|(\s+)|(;.*$)")
 # Regex for each token type. Note that separators (commas) dont need regexes
 decimal_regex    = re.compile("^#-?[0-9]+$")
 floating_regex   = re.compile("^#(-?[0-9]+\.[0-9]+|nan|-?inf)$")
+# Fixed point numbers, encoded as decimals
+fixed_regex      = re.compile("^#-?[0-9]+(\.[0-9]+)?[qQ]$")
 # Registers can be more than 12 here. Handle registers higher than 12 later
 register_regex   = re.compile("^[rR][0-9]+$")
 address_regex    = re.compile("^[0-9]+$")
@@ -79,10 +89,13 @@ def compiler_validation(line):
             raise ValueError("Generic syntax error: Invalid syntax")
 
 # Lexically analyse line
-def compiler_lexical_analysis(line, wordMin, wordMax, addrMax, bytesPerWord, extensionsEnabled):
+def compiler_lexical_analysis(line, wordMin, wordMax, addrMax, bytesPerWord, extensionsEnabled, fixedFraction = None):
     # Calculate floating point bits
     exponentLen = 3 * bytesPerWord
     fractionLen = 5 * bytesPerWord - 1
+    # Fixed point fraction bits. Half the word by default
+    if fixedFraction == None:
+        fixedFraction = bytesPerWord * 4
 
     # Split into fields
     line = list(filter(None, split_regex.split(line)))
@@ -127,13 +140,35 @@ def compiler_lexical_analysis(line, wordMin, wordMax, addrMax, bytesPerWord, ext
             else:
                 errors.append("Architecture error: Floating point numbers need extensions enabled")
                 positions.append((offset, token.error))
+        elif fixed_regex.match(field):
+            if extensionsEnabled:
+                # Rounded to the nearest fixed point number, with exact
+                # arithmetic so the encoding doesn't depend on float rounding
+                fixedVal = floor(Fraction(field[1:-1]) * 2 ** fixedFraction + Fraction(1, 2))
+                if wordMin != None and fixedVal < wordMin:
+                    errors.append("Architecture error: Fixed point constant " + field[1:]
+                                  + " below word minimum of " + str(wordMin / 2 ** fixedFraction))
+                    positions.append((offset, token.error))
+                elif wordMax != None and fixedVal > wordMax:
+                    errors.append("Architecture error: Fixed point constant " + field[1:]
+                                  + " above word maximum of " + str(wordMax / 2 ** fixedFraction))
+                    positions.append((offset, token.error))
+                else:
+                    tokens.append([token.decimal, interpreter.aqasmutil_num2int(fixedVal, bytesPerWord * 8)])
+                    positions.append((offset, token.decimal))
+            else:
+                errors.append("Architecture error: Fixed point numbers need extensions enabled")
+                positions.append((offset, token.error))
         elif register_regex.match(field):
             try:
                 regVal = int(field[1:])
-                if not regVal in range(0, 13):
+                if not regVal in range(0, 14):
                     errors.append("Semantic error: Invalid register number "
                                   + str(regVal))
                     positions.append((offset, token.error))
+                elif regVal == interpreter.REG_SP and not extensionsEnabled:
+                    errors.append("Architecture error: Stack pointer (R13) needs extensions enabled")
+                    positions.append((offset, token.error))
                 else:
                     tokens.append([token.register, regVal])
                     positions.append((offset, token.register))
@@ -261,6 +296,8 @@ def compiler_parsing(tokenized_lines, extensions):
             # Converts a token list in the opcodes format into a string
             tstr = ""
             for ttype in tlist:
+                if ttype[1] == OPERAND_NONE:
+                    continue
                 if tstr != "":
                     tstr += " or "
 
@@ -275,14 +312,34 @@ def compiler_parsing(tokenized_lines, extensions):
         if op not in interpreter.opcodes:
             raise ValueError("Semantic error at line {:d}:\nAttempt to parse undeclared opcode '{:s}'".format(l + 1, op))
 
-        # Check operand count
-        if len(tokens) != len(interpreter.opcodes[op]):
-            raise ValueError("Semantic error at line {:d}:\nExpected {:d} operand(s), got {:d}".format(l + 1, len(interpreter.opcodes[op]) - 1, len(tokens) - 1))
+        # Check operand count. Opcodes with a repeatable last operand take at
+        # least as many operands as they declare, and opcodes with optional
+        # last operands can take less
+        operands = interpreter.opcodes[op]
+        if operands[-1] == OPERANDS_REPEAT:
+            operands = operands[:-1]
+            if len(tokens) < len(operands):
+                raise ValueError("Semantic error at line {:d}:\nExpected at least {:d} operand(s), got {:d}".format(l + 1, len(operands) - 1, len(tokens) - 1))
+        else:
+            required = len(operands)
+            while required > 1 and OPERAND_NONE in [match[1] for match in operands[required - 1]]:
+                required -= 1
+            if len(tokens) < required or len(tokens) > len(operands):
+                if required == len(operands):
+                    raise ValueError("Semantic error at line {:d}:\nExpected {:d} operand(s), got {:d}".format(l + 1, len(operands) - 1, len(tokens) - 1))
+                raise ValueError("Semantic error at line {:d}:\nExpected {:d} to {:d} operand(s), got {:d}".format(l + 1, required - 1, len(operands) - 1, len(tokens) - 1))
 
         # Parse overload
         overload = 0
-        for t in range(1, len(tokens)):
-            for match in interpreter.opcodes[op][t]:
+        for t in range(1, max(len(tokens), len(operands))):
+            matches = operands[min(t, len(operands) - 1)]
+            # Missing optional operand
+            if t >= len(tokens):
+                for match in matches:
+                    if match[1] == OPERAND_NONE:
+                        overload += match[0]
+                continue
+            for match in matches:
                 match_token = match[1]
                 if match_token == token.labelid:
                     match_token = token.identifier
@@ -298,7 +355,7 @@ def compiler_parsing(tokenized_lines, extensions):
 
                     break
             else:
-                raise ValueError("Semantic error at line {:d}:\nExpected a {:s}, got a {:s} in operand number {:d}".format(l + 1, tokenListStr(interpreter.opcodes[op][t]), tokenStr(tokens[t][0]), t))
+                raise ValueError("Semantic error at line {:d}:\nExpected a {:s}, got a {:s} in operand number {:d}".format(l + 1, tokenListStr(matches), tokenStr(tokens[t][0]), t))
 
         return overload
 
@@ -311,6 +368,8 @@ def compiler_parsing(tokenized_lines, extensions):
         # Check opcode operands and get overload
         overload = checkOperands(tokenized_lines[l], l)
         op_name = tokenized_lines[l][0][1].lower()
+        if overload not in interpreter.opcodes[op_name][0]:
+            raise ValueError("Semantic error at line {:d}:\nInvalid combination of operands for opcode '{:s}'".format(l + 1, op_name))
         if interpreter.opcodes[op_name][0][overload][1] and not extensions:
             raise ValueError("Architecture error at line {:d}: Attempt to use extension without language extensions enabled".format(l + 1))
         thisop = [interpreter.opcodes[op_name][0][overload][0]]
@@ -319,13 +378,41 @@ def compiler_parsing(tokenized_lines, extensions):
         for operand in range(1, len(tokenized_lines[l])):
             thisop.append(tokenized_lines[l][operand][1])
 
+        # Compare and branch instructions continue at the next line if their
+        # branch isn't taken
+        if thisop[0] in interpreter.compare_branches:
+            thisop.append(l + 1)
+
         # Append to opcode list
         ops.append(thisop)
 
     return ops
 
+# Fuse branch idioms into compare and branch instructions
+def compiler_fusion(ops):
+    # The first line of each idiom is replaced. Its other lines are kept, and
+    # the fused instruction continues after them if its branch isn't taken
+    def opAt(l):
+        # Instruction function at a line, or None if empty or past the end
+        if l < len(ops) and ops[l] != None:
+            return ops[l][0]
+        return None
+
+    for l in range(len(ops)):
+        op = opAt(l)
+        # CMP followed by a label branch
+        if op in interpreter.compare_fusions and opAt(l + 1) in interpreter.compare_fusions[op]:
+            fused = interpreter.compare_fusions[op][opAt(l + 1)]
+            ops[l] = [fused, ops[l][1], ops[l][2], ops[l + 1][1], l + 2]
+        # DEC Rn, CMP Rn, #0 and BNE
+        elif op == interpreter.eop_dec and opAt(l + 1) == interpreter.op_cmp_d and opAt(l + 2) == interpreter.op_bne_l:
+            if ops[l + 1][1] == ops[l][1] and ops[l + 1][2] == 0:
+                ops[l] = [interpreter.eop_dbnz, ops[l][1], ops[l + 2][1], l + 3]
+
+    return ops
+
 # Process all code
-def compile_asm(code, extensions, wordMin, wordMax, addrMax, bytesPerWord):
+def compile_asm(code, extensions, wordMin, wordMax, addrMax, bytesPerWord, fuse = False, fixedFraction = None):
     # Times dictionary. For monitoring performance. Is returned alongside code
     times = {"validation": 0, "lexical_analysis": 0, "parsing": 0}
 
@@ -341,7 +428,7 @@ def compile_asm(code, extensions, wordMin, wordMax, addrMax, bytesPerWord):
 
         # Analyse lexically
         start_time = time.time()
-        code[l], _, errors = compiler_lexical_analysis(code[l], wordMin, wordMax, addrMax, bytesPerWord, extensions)
+        code[l], _, errors = compiler_lexical_analysis(code[l], wordMin, wordMax, addrMax, bytesPerWord, extensions, fixedFraction)
         if errors:
             error_str = "{:s} at line {:d}:\n".format("Multiple errors" if len(errors) > 1 else "Error", l + 1)
             for e in errors:
@@ -354,4 +441,10 @@ def compile_asm(code, extensions, wordMin, wordMax, addrMax, bytesPerWord):
     code = compiler_parsing(code, extensions)
     times["parsing"] = time.time() - start_time
 
+    # Optimize
+    if fuse:
+        start_time = time.time()
+        code = compiler_fusion(code)
+        times["fusion"] = time.time() - start_time
+
     return code, times
@@ -0,0 +1,129 @@
+import interpreter
+from math import factorial, frexp, ldexp, log, sqrt
+
+## Soft float lookup tables
+# Small word sizes have few enough float bit patterns to precompute the results
+# of the soft float routines for all of them. Tables are built once per word
+# size, by running the routines on a scratch machine with the same float
+# format, so their results are bit identical to the routines'. They are cached
+# for the lifetime of the process and shared by every machine with that word
+# size
+
+# Largest word size, in bytes, with decode and classification tables
+TABLE_DECODE_MAX = 2
+
+# Largest word size, in bytes, with binary operation tables. Binary tables
+# have one entry per pair of operands, indexed by (a << wordLength) | b
+TABLE_BINARY_MAX = 1
+
+class floattable:
+    def __init__(self, bytesPerWord):
+        # Scratch machine, which must not use tables itself, running the
+        # reference float utilities
+        cpu = interpreter.aqasm("", False, bytesPerWord, 0, floatTables = False, fpu = "reference")
+        patterns = range(2 ** cpu.wordLength)
+
+        # Decoded python float of every bit pattern
+        self.decode = [interpreter.aqasmutil_parse_float(cpu, a) for a in patterns]
+        # Classification of every bit pattern
+        self.nan = [interpreter.oputil_is_float_nan(cpu, a) for a in patterns]
+        self.denormal = [interpreter.oputil_is_float_denormal(cpu, a) for a in patterns]
+        self.inf = [a == cpu.posInf or a == cpu.negInf for a in patterns]
+
+        # Binary operation results, or None if the word size is too big
+        self.add = None
+        self.mul = None
+        self.div = None
+        self.cmp = None
+        if bytesPerWord <= TABLE_BINARY_MAX:
+            self.add = [interpreter.oputil_float_add(cpu, a, b) for a in patterns for b in patterns]
+            self.mul = [interpreter.oputil_float_mul(cpu, a, b) for a in patterns for b in patterns]
+            self.div = [interpreter.oputil_float_div(cpu, a, b) for a in patterns for b in patterns]
+            # Comparison results are the (zero, sign) flags, or None if the
+            # comparison raises an invalid arithmetic IRQ
+            self.cmp = []
+            for a in patterns:
+                for b in patterns:
+                    cpu.irq.clear()
+                    interpreter.oputil_float_cmp(cpu, a, b)
+                    if cpu.irq.flag:
+                        self.cmp.append(None)
+                    else:
+                        self.cmp.append((cpu.zero, cpu.sign))
+
+# Built tables, by number of bytes per word
+tables = {}
+
+def float_table(bytesPerWord):
+    # Returns the tables for a word size, building them if needed, or None if
+    # the word size is too big to have tables
+    if bytesPerWord > TABLE_DECODE_MAX:
+        return None
+    if bytesPerWord not in tables:
+        tables[bytesPerWord] = floattable(bytesPerWord)
+    return tables[bytesPerWord]
+
+## Series constants
+# FEXP and FLOG evaluate their power series with Horner's method, using one
+# coefficient per term. The coefficients are computed with python floats and
+# rounded to the nearest float of the format once, instead of being rebuilt
+# from soft float multiplies and divides on every instruction. Arguments are
+# range reduced first, so only enough terms for the fraction length are kept
+
+# Largest magnitude of x * ln2 in the FEXP series, 2 ^ x = e ^ (x * ln2), after
+# reducing x to -0.5 <= x <= 0.5
+SERIES_EXP_MAX = log(2) / 2
+
+# Largest magnitude of y in the FLOG series, log2(m) = 2 / ln2 * atanh(y) with
+# y = (m - 1) / (m + 1), after reducing m to sqrt(1/2) <= m <= sqrt(2)
+SERIES_LOG_MAX = (sqrt(2) - 1) / (sqrt(2) + 1)
+
+def series_encode(val, exponentLen, fractionLen):
+    # Encodes a positive python float, rounded to the nearest float of the
+    # format. Coefficients are never big enough to overflow
+    bias = 2 ** (exponentLen - 1) - 1
+    fraction, exponent = frexp(val)
+    exponent += bias - 1
+    if exponent <= 0:
+        # Denormal. Rounding up to the smallest normal gives its encoding too
+        return round(ldexp(val, bias - 1 + fractionLen))
+    mantissa = round(ldexp(fraction, fractionLen + 1))
+    if mantissa >> (fractionLen + 1):
+        mantissa >>= 1
+        exponent += 1
+    return (exponent << fractionLen) | (mantissa & (2 ** fractionLen - 1))
+
+class floatseries:
+    def __init__(self, exponentLen, fractionLen):
+        # Terms are dropped once they can't change the result, which is once
+        # they are smaller than a quarter of the last fraction bit of one
+        error = 2.0 ** -(fractionLen + 2)
+
+        # One, as a float
+        self.one = (2 ** (exponentLen - 1) - 1) << fractionLen
+        # Mantissa of sqrt(2), with the hidden bit, for FLOG range reduction
+        self.sqrtTwo = int(ldexp(sqrt(2), fractionLen))
+
+        # FEXP coefficients, (ln2 ^ r) / r!, for the series in x
+        self.exp = []
+        r = 0
+        while r == 0 or SERIES_EXP_MAX ** r / factorial(r) >= error:
+            self.exp.append(series_encode(log(2) ** r / factorial(r), exponentLen, fractionLen))
+            r += 1
+
+        # FLOG coefficients, 2 / (ln2 * r) for odd r, for the series in y ^ 2.
+        # The result is multiplied by y once at the end
+        self.log = []
+        r = 1
+        while r == 1 or 2 / (log(2) * r) * SERIES_LOG_MAX ** r >= error:
+            self.log.append(series_encode(2 / (log(2) * r), exponentLen, fractionLen))
+            r += 2
+
+# Built series constants, by float format (exponent and fraction length)
+series = {}
+
+def float_series(exponentLen, fractionLen):
+    # Returns the series constants for a float format, building them if needed
+    if (exponentLen, fractionLen) not in series:
+        series[(exponentLen, fractionLen)] = floatseries(exponentLen, fractionLen)
+    return series[(exponentLen, fractionLen)]
@@ -19,6 +19,8 @@ class AQASMFrame(Frame):
     CPUUpdateEvent, EVT_CPU_UPDATE = wxNE.NewEvent()
     CPUStopEvent, EVT_CPU_STOP = wxNE.NewEvent()
     CPULogEvent, EVT_CPU_LOG = wxNE.NewEvent()
+    # Length of each batch of instructions run by the CPU thread, in seconds
+    SLICE_TIME = 0.05
 
     def __init__(self, font, gllock, size = DefaultSize, bytesPerWord = 1, memWords = 256, filename = None):
         super(AQASMFrame, self).__init__(None, size = size)
@@ -26,13 +28,14 @@ class AQASMFrame(Frame):
         # Internals
         # Initialize interpreter
         self.cpu = aqasm("", False, bytesPerWord, memWords)
+        # Whether branch idioms are fused when compiling
+        self.fuse = False
         # Mutex locks
         self.cpuLock = thread.allocate_lock()
         # Is code running
         self.runningCode = False
-        # Clock speed variables
+        # Maximum clock speed, in Hz
         self.clockspeed = 1000
-        self.cycletime = 1 / self.clockspeed
 
         # Initialize and setup widgets
         # Splitter window
@@ -67,6 +70,7 @@ class AQASMFrame(Frame):
         optmenu = Menu()
         self.syntaxhitem = optmenu.Append(ID_ANY, "Syntax highlighting", kind=ITEM_CHECK)
         self.langextitem = optmenu.Append(ID_ANY, "Language extensions", kind=ITEM_CHECK)
+        self.fuseitem = optmenu.Append(ID_ANY, "Branch fusion", kind=ITEM_CHECK)
         bytesperworditem = optmenu.Append(ID_ANY, "Change bytes per words...")
         memwordsitem = optmenu.Append(ID_ANY, "Change memory size...")
         optmenu.Check(self.syntaxhitem.GetId(), True)
@@ -152,6 +156,7 @@ class AQASMFrame(Frame):
         self.Bind(EVT_MENU, self.onSelAll, selallitem)
         self.Bind(EVT_MENU, self.toggleSyntaxH, self.syntaxhitem)
         self.Bind(EVT_MENU, self.toggleLangExt, self.langextitem)
+        self.Bind(EVT_MENU, self.toggleFuse, self.fuseitem)
         self.Bind(EVT_MENU, self.onChangeBytesPerWord, bytesperworditem)
         self.Bind(EVT_MENU, self.onChangeMemWords, memwordsitem)
         self.Bind(EVT_MENU, self.showMemViewer, memwinitem)
@@ -291,7 +296,7 @@ class AQASMFrame(Frame):
                 tstart = time()
                 self.cpuLock.acquire()
                 try:
-                    self.cpu.compile_code(self.gleditor.filebuffer.tobytes().decode('ascii'), self.gleditor.langext, self.cpu.bytesPerWord, self.cpu.memWords)
+                    self.cpu.compile_code(self.gleditor.filebuffer.tobytes().decode('ascii'), self.gleditor.langext, self.cpu.bytesPerWord, self.cpu.memWords, self.fuse)
                 except Exception as e:
                     self.log(e)
                     self.gleditor.recompile = True
@@ -308,34 +313,43 @@ class AQASMFrame(Frame):
     def runCodeLoop(self):
         self.cpuThreadRunning = True
         usingLock = False
-        lastCycleTime = time()
+        # Fractional number of instructions owed by the clock. Lets clock
+        # speeds below one instruction per time slice work
+        stepCredit = 0
         try:
             PostEvent(self, self.CPULogEvent(msg = ("CPU started", )))
             while self.runningCode:
-                # Run CPU instruction cycle
-                self.cpuLock.acquire()
-                usingLock = True
-                self.cpu.step()
-                self.cpuLock.release()
-                usingLock = False
-
-                # Sleep to simulate clock speed. Does not lock CPU
-                sleep(self.cycletime)
+                # Run a time slice's worth of instructions in one batch. The
+                # batch is limited by the clock speed and by the end of the
+                # slice, so that the UI keeps getting updates
+                sliceEnd = time() + self.SLICE_TIME
+                stepCredit += self.clockspeed * self.SLICE_TIME
+                steps = int(stepCredit)
+                stepCredit -= steps
+                if steps > 0:
+                    self.cpuLock.acquire()
+                    usingLock = True
+                    self.cpu.run(steps, sliceEnd)
+                    self.cpuLock.release()
+                    usingLock = False
 
                 # Stop CPU when halted
                 if self.cpu.halt:
                     break
 
-                # Send a CPU update event to change the UI 20 times a second.
-                # If CPU update events are set too often, the UI freezes
-                cycleTime = time()
-                if cycleTime - lastCycleTime >= 0.05:
-                    lastCycleTime = cycleTime
-                    self.cpuLock.acquire()
-                    usingLock = True
-                    PostEvent(self, self.CPUUpdateEvent(zero = self.cpu.zero, sign = self.cpu.sign, halt = self.cpu.halt, pc = self.cpu.pc))
-                    self.cpuLock.release()
-                    usingLock = False
+                # Sleep for the rest of the slice to simulate clock speed. Does
+                # not lock CPU
+                remaining = sliceEnd - time()
+                if remaining > 0:
+                    sleep(remaining)
+
+                # Send a CPU update event to change the UI once per slice. If
+                # CPU update events are set too often, the UI freezes
+                self.cpuLock.acquire()
+                usingLock = True
+                PostEvent(self, self.CPUUpdateEvent(zero = self.cpu.zero, sign = self.cpu.sign, halt = self.cpu.halt, pc = self.cpu.pc))
+                self.cpuLock.release()
+                usingLock = False
         except Exception as e:
             PostEvent(self, self.CPULogEvent(msg = ("An exception occured while running:\n", e)))
         else:
@@ -374,6 +388,8 @@ class AQASMFrame(Frame):
                     self.log(self.cpu.code[self.cpu.pc])
                     try:
                         self.cpu.step()
+                        # Deliver buffered output, like run does
+                        self.cpu.ioFlush()
                     except Exception as e:
                         PostEvent(self, self.CPULogEvent(msg = ("An exception occured while running:\n", e)))
                     self.zerocheck.SetValue(self.cpu.zero)
@@ -416,7 +432,6 @@ class AQASMFrame(Frame):
             newclockspeed = int(self.clockspeedentry.GetValue())
             if newclockspeed > 0:
                 self.clockspeed = newclockspeed
-                self.cycletime = 1 / newclockspeed
                 self.log("Updated max clock speed to ", self.clockspeed, "Hz")
                 return
         except:
@@ -434,8 +449,12 @@ class AQASMFrame(Frame):
         self.gleditor.updateAllTokens()
         self.Refresh()
 
+    def toggleFuse(self, event):
+        self.gleditor.recompile = True
+        self.fuse = self.fuseitem.IsChecked()
+
     def onChangeBytesPerWord(self, event):
-        newBytesPerWord = GetNumberFromUser("Enter new word length:", "Bytes", "Change word length...", self.cpu.bytesPerWord, 1, 4, self)
+        newBytesPerWord = GetNumberFromUser("Enter new word length:", "Bytes", "Change word length...", self.cpu.bytesPerWord, 1, BYTES_PER_WORD_MAX, self)
         if newBytesPerWord != -1:
             # Truncate number of words for memory if they become unnaddressable
             newMemWords = self.cpu.memWords
@@ -454,16 +473,19 @@ class AQASMFrame(Frame):
             self.cpuLock.release()
 
     def onChangeMemWords(self, event):
-        # Limit memory size to 64 MiB (67108864 bytes)
-        memMax = self.cpu.uintMax + 1
-        phyMax = 67108864 // self.cpu.bytesPerWord
-        if memMax > phyMax:
-            memMax = phyMax
+        # Memory sizes over 64 MiB (67108864 bytes) use paged memory, so that
+        # only the pages written to are allocated. Sizes are limited to 2 ^ 32
+        # words, since 8-byte words can address more than wx can take
+        memMax = min(self.cpu.uintMax + 1, 2 ** 32)
         newMemWords = GetNumberFromUser("Enter new memory size:", "Words", "Change memory size...", self.cpu.memWords, 1, memMax, self)
         if newMemWords != -1:
             self.cpuLock.acquire()
             self.runningCode = False
             self.gleditor.recompile = True
+            if newMemWords * self.cpu.bytesPerWord > 67108864:
+                self.cpu.memorySelect("paged")
+            else:
+                self.cpu.memorySelect("flat")
             self.cpu.reset()
             self.cpu.compile_code("", self.gleditor.langext, self.cpu.bytesPerWord, newMemWords)
             self.memviewer.resizeCanvas()
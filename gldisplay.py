@@ -9,6 +9,8 @@ class GLDisplay(GLSubWindow):
     IO_PORT_DISPLAY  = 1
     # IRQ number used by the keyboard
     IRQ_PORT_INPUT = 127
+    # Maximum number of pixels drawn per batch
+    DRAW_BATCH = 256
 
     def __init__(self, parent, cpu, gllock, size = DefaultSize):
         super(GLDisplay, self).__init__(parent, "Display", gllock, size)
@@ -18,7 +20,9 @@ class GLDisplay(GLSubWindow):
 
         # Register I/O port
         self.cpu.ioRegister(self.IO_PORT_KEYBOARD, None)
-        self.cpu.ioRegister(self.IO_PORT_DISPLAY, self.drawPixel)
+        # The display is buffered, so that pixels are queued and refreshed in
+        # batches instead of one at a time
+        self.cpu.ioRegisterBuffered(self.IO_PORT_DISPLAY, self.drawPixels, self.DRAW_BATCH, self.capturePixel)
 
         # Screen OpenGL framebuffer object and rendertexture
         self.fbo = None
@@ -85,7 +89,7 @@ class GLDisplay(GLSubWindow):
         # Push data to keyboard device if the key could be processed
         if data != None:
             self.cpu.ioInputPush(self.IO_PORT_KEYBOARD, data)
-            self.cpu.irq.append(self.IRQ_PORT_INPUT)
+            self.cpu.raise_irq(self.IRQ_PORT_INPUT)
 
     def clearFBO(self):
         # Bind framebuffer
@@ -128,11 +132,12 @@ class GLDisplay(GLSubWindow):
             # Enable texturing
             glEnable(GL_TEXTURE_2D)
 
-    def drawPixel(self, addr):
-        # Get arguments from memory (x,y,r,g,b)
+    def capturePixel(self, addr):
+        # Get arguments from memory (x,y,r,g,b) when the pixel is output, since
+        # the memory may change before the pixel is drawn
         if addr + 5 > self.cpu.memWords:
-            self.cpu.irq.append(IRQ_GENERAL_PROTECTION_FAULT)
-            return
+            self.cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
+            return None
 
         # Position
         x = oputil_ldr(self.cpu, addr)
@@ -140,16 +145,19 @@ class GLDisplay(GLSubWindow):
 
         # Don't render if off-screen
         if x >= self.resolution[0] or y >= self.resolution[1]:
-            return
+            return None
 
         # Colour value (truncate to 8 bit value)
         r = oputil_ldr(self.cpu, addr + 2) % 256
         g = oputil_ldr(self.cpu, addr + 3) % 256
         b = oputil_ldr(self.cpu, addr + 4) % 256
 
-        # Push pixel to queue
+        return (x, y, r, g, b)
+
+    def drawPixels(self, pixels):
+        # Push pixels captured by capturePixel to queue
         self.pixelLock.acquire()
-        self.drawQueue.append((x, y, r, g, b))
+        self.drawQueue.extend(pixels)
         self.pixelLock.release()
 
         # Add to render queue if the context can't be set to current
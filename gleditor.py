@@ -136,7 +136,7 @@ class GLEditor(GLDefaultCanvas):
     def updateTokens(self, l):
         lstart = self.lines[l]
         lend = self.lineEnd(l)
-        self.tokens[l] = compiler.compiler_lexical_analysis(self.filebuffer[lstart:lend].tobytes().decode("ascii"), self.cpu.intMin, self.cpu.intMax, self.cpu.memWords - 1, self.cpu.bytesPerWord, self.langext)[1]
+        self.tokens[l] = compiler.compiler_lexical_analysis(self.filebuffer[lstart:lend].tobytes().decode("ascii"), self.cpu.intMin, self.cpu.intMax, self.cpu.memWords - 1, self.cpu.bytesPerWord, self.langext, self.cpu.fixedFraction)[1]
 
     def updateAllTokens(self):
         for l in range(len(self.lines)):
@@ -832,9 +832,9 @@ class GLEditor(GLDefaultCanvas):
                 # Parse file for newlines and save their positions
                 for i in range(self.buffersize):
                     if self.filebuffer[i] == ord('\n'):
-                        self.tokens.append(compiler.compiler_lexical_analysis(self.filebuffer[self.lines[-1]:i].tobytes().decode("ascii"), self.cpu.intMin, self.cpu.intMax, self.cpu.memWords - 1, self.cpu.bytesPerWord, self.langext)[1])
+                        self.tokens.append(compiler.compiler_lexical_analysis(self.filebuffer[self.lines[-1]:i].tobytes().decode("ascii"), self.cpu.intMin, self.cpu.intMax, self.cpu.memWords - 1, self.cpu.bytesPerWord, self.langext, self.cpu.fixedFraction)[1])
                         self.lines.append(i + 1)
-                self.tokens.append(compiler.compiler_lexical_analysis(self.filebuffer[self.lines[-1]:self.buffersize].tobytes().decode("ascii"), self.cpu.intMin, self.cpu.intMax, self.cpu.memWords - 1, self.cpu.bytesPerWord, self.langext)[1])
+                self.tokens.append(compiler.compiler_lexical_analysis(self.filebuffer[self.lines[-1]:self.buffersize].tobytes().decode("ascii"), self.cpu.intMin, self.cpu.intMax, self.cpu.memWords - 1, self.cpu.bytesPerWord, self.langext, self.cpu.fixedFraction)[1])
         self.resetEditor()
         self.updatePaneSize()
         self.Refresh()
@@ -58,7 +58,7 @@ class GLMemViewer(GLSubWindow):
             if self.showStatus:
                 self.registerValueWidth = 5 + self.addrLen
                 self.registersPerRow = floor(self.cols / self.registerValueWidth)
-                self.registerRows = ceil(13 / self.registersPerRow)
+                self.registerRows = ceil(len(self.cpu.reg) / self.registersPerRow)
                 self.rows = self.rows - 4 - self.registerRows
                 self.statusOffset = self.rows * 16
             self.recalcColOffsets()
@@ -148,7 +148,7 @@ class GLMemViewer(GLSubWindow):
             row = (y - self.statusOffset) // 16 - 4
             col = (x // self.font.width) // self.registerValueWidth
             reg = row * self.registersPerRow + col
-            if reg < 13:
+            if reg < len(self.cpu.reg):
                 self.selRegister = reg
                 # Also redraw viewer
                 self.Refresh()
@@ -343,7 +343,7 @@ class GLMemViewer(GLSubWindow):
 
             # Draw register values
             regX = regY = 0
-            for r in range(0, 13):
+            for r in range(0, len(self.cpu.reg)):
                 # Render register and hex value
                 self.font.drawString('R{:02d}:'.format(r), regX * self.registerValueWidth, 4 + regY, 0, self.statusOffset)
                 self.drawWord(self.cpu.reg[r], 4 + regX * self.registerValueWidth, 4 + regY, 0, self.statusOffset)
@@ -1,7 +1,14 @@
 import compiler
-from collections import deque
-from numpy import zeros, uint8
-from math import inf, nan, floor, isnan
+import memory
+import blockcompiler
+import tracecompiler
+import floattables
+import interrupts
+import ioports
+from math import inf, nan, floor, isnan, frexp, ldexp, log10
+from sys import float_info
+import numpy
+from time import time
 
 ## Reserved IRQ numbers
 IRQ_DIVISION_BY_ZERO         = 0
@@ -11,6 +18,21 @@ IRQ_BREAKPOINT               = 3
 IRQ_OVERFLOW                 = 4
 IRQ_IO_EXCEPTION             = 5
 IRQ_INVALID_ARITHMETIC       = 6
+IRQ_STACK_FAULT              = 7
+
+## Stack pointer
+# R13 is the stack pointer, only available with extensions. The stack grows
+# down from the top of the stack region and SP points at the word on top of
+# the stack, so SP is the region's limit while the stack is empty
+REG_SP = 13
+
+## Task contexts
+# SAVECTX and LOADCTX move a task's context to and from a block of memory, with
+# the registers (R0 to R13), then the flags (bit 0 is zero, bit 1 is sign) and
+# then the pc to resume at. Inside an ISR, the context is the interrupted one,
+# which IRET resumes, so a scheduler's ISR can switch tasks with a SAVECTX of
+# the current task and a LOADCTX of the next one before its IRET
+CONTEXT_WORDS = REG_SP + 3
 
 ## Utilities used for interpreting CPU data
 def aqasmutil_num2int(val, n):
@@ -40,9 +62,14 @@ def aqasmutil_num2int(val, n):
 
 def aqasmutil_num2float(val, en, fn):
     # Parses a python decimal number into a twos complement float with an en-bit
-    # exponent and an fn-bit fraction.
+    # exponent and an fn-bit fraction. Also accepts numpy arrays, returning a
+    # uint64 array.
     # Note that this does not throw exceptions, giving approximations of the
     # number to be converted. Numbers too big will become infinity, etc...
+    # Numbers are truncated towards zero. Numbers from 1 up to (but excluding)
+    # 2 ^ (fn - 1) keep one fraction bit less than the format has
+    if isinstance(val, numpy.ndarray):
+        return aqasmutil_num2float_array(val, en, fn)
 
     # Special cases for zero, infinities, not a number and tiny numbers
     if isnan(val):
@@ -60,49 +87,74 @@ def aqasmutil_num2float(val, en, fn):
     if signBit:
         val = -val
 
-    # Separate value into whole and fraction parts
-    wholeRaw = floor(val)
-    fractionRaw = val - wholeRaw
-
-    # Convert value's whole part
-    # i is the length of the whole part
-    whole = 0
-    i = 0
-    while wholeRaw != 0:
-        whole |= (wholeRaw % 2) << i
-        wholeRaw //= 2
-        i += 1
-
-    # Convert value's fractional part
-    # j is the length of the fractional part and, therefore, the initial binary
-    # point's location
-    # k is the distance from 0 to the first set bit in the fractional part
-    fraction = 0
-    j = 0
-    k = -i
-    while fractionRaw != 0:
-        fraction <<= 1
-        fractionRaw *= 2
-        j += 1
-        if fractionRaw >= 1:
-            fractionRaw -= 1
-            fraction |= 1
-            if k == 0:
-                k = j
-        if k != 0 and j - k == fn:
-            break
+    # Unbiased exponent of the most significant set bit. Integers are handled
+    # exactly, even if they don't fit in a python float
+    bias = 2 ** (en - 1) - 1
+    if isinstance(val, int):
+        exponent = val.bit_length() - 1
+    else:
+        exponent = frexp(val)[1] - 1
 
-    # Marge fraction and whole part into mantissa
-    mantissa = (whole << j) | fraction
+    if exponent <= -bias:
+        # Denormal, truncated to the smallest denormal
+        return oputil_float_construct(signBit, aqasmutil_scale_floor(val, fn + bias - 1), 0, fn, en)
 
-    # Normalize mantissa
-    tempExponentZero = 2 ** (en - 1) - 1
-    tempExponentMax  = 2 ** en - 1
-    tempFractionMask = 2 ** fn - 1
-    finalFraction, exponent = oputil_float_normalize(mantissa, tempExponentZero, i, j, fn, tempExponentMax, tempFractionMask)
+    # Truncate to fn bits after the most significant set bit
+    if 0 <= exponent < fn - 1:
+        mantissa = aqasmutil_scale_floor(val, fn - exponent - 1) << 1
+    else:
+        mantissa = aqasmutil_scale_floor(val, fn - exponent)
 
     # Done, construct float
-    return oputil_float_construct(signBit, finalFraction, exponent, fn, en)
+    return oputil_float_construct(signBit, mantissa & (2 ** fn - 1), exponent + bias, fn, en)
+
+def aqasmutil_scale_floor(val, s):
+    # Returns floor(val * 2 ^ s) for a non-negative int or python float
+    if isinstance(val, int):
+        if s >= 0:
+            return val << s
+        return val >> -s
+    return int(ldexp(val, s))
+
+def aqasmutil_num2float_array(val, en, fn):
+    # Array version of aqasmutil_num2float, for numpy arrays of numbers. The
+    # numbers are converted to python floats (float64) first
+    val = numpy.asarray(val, dtype=numpy.float64)
+    bias = 2 ** (en - 1) - 1
+    magnitude = numpy.abs(val)
+    negative = val < 0
+    result = numpy.zeros(val.shape, dtype=numpy.uint64)
+
+    # Limits. The largest float may not fit in a python float, and the
+    # smallest denormal may underflow to zero, like in the scalar version
+    try:
+        largest = ldexp(2 ** (fn + 1) - 1, bias - fn)
+    except OverflowError:
+        largest = inf
+    smallest = 2 ** (2 - fn -(2 ** (en - 1)))
+
+    # Special cases
+    nans = numpy.isnan(val)
+    infs = ~nans & ((magnitude > largest) | numpy.isinf(val))
+    zeros = ~nans & ~infs & ((val == 0) | (magnitude < smallest))
+    regular = ~(nans | infs | zeros)
+    result[nans] = 1 | ((2 ** en - 1) << fn)
+    result[infs & (val > 0)] = (2 ** en - 1) << fn
+    result[infs & ~(val > 0)] = (1 << (en + fn)) | ((2 ** en - 1) << fn)
+
+    # Regular numbers, computed on a copy with the special cases replaced by 1
+    # to avoid invalid values
+    magnitude = numpy.where(regular, magnitude, 1.0)
+    exponent = numpy.frexp(magnitude)[1].astype(numpy.int64) - 1
+    denormal = exponent <= -bias
+    shortened = (exponent >= 0) & (exponent < fn - 1)
+    scale = numpy.where(denormal, fn + bias - 1, fn - exponent - shortened)
+    mantissa = numpy.floor(numpy.ldexp(magnitude, scale)).astype(numpy.uint64) << shortened.astype(numpy.uint64)
+    fraction = numpy.where(denormal, mantissa, mantissa & numpy.uint64(2 ** fn - 1))
+    biased = numpy.where(denormal, 0, exponent + bias).astype(numpy.uint64)
+    regularResult = (biased << numpy.uint64(fn)) | fraction | (negative.astype(numpy.uint64) << numpy.uint64(en + fn))
+    result[regular] = regularResult[regular]
+    return result
 
 def aqasmutil_parse_bin(val, n):
     # Parses an n-bit unsigned number into a python number
@@ -127,9 +179,18 @@ def aqasmutil_parse_twos(val, n):
     return accum
 
 def aqasmutil_parse_int(cpu, val):
-    return aqasmutil_parse_twos(val, cpu.bytesPerWord * 8)
+    return cpu.parse_twos(val, cpu.bytesPerWord * 8)
 
 def aqasmutil_parse_float(cpu, val):
+    # Parses a float into a python float. Also accepts numpy arrays, returning
+    # a float64 array
+    if isinstance(val, numpy.ndarray):
+        return aqasmutil_parse_float_array(cpu, val)
+
+    # Look the value up if there is a table for the word size
+    if cpu.floatTable != None:
+        return cpu.floatTable.decode[val]
+
     # Extract raw sign, fraction and exponent
     fraction = val & cpu.fractionMask
     negate = (val & cpu.signBitMask) != 0
@@ -147,21 +208,28 @@ def aqasmutil_parse_float(cpu, val):
     elif exponent == cpu.exponentMax:
         return nan
 
-    # Parse the fraction
-    accum = 0
-    for b in range(0, cpu.fractionLen):
-        if (fraction >> b) & 0x1 == 0x1:
-            accum += 2 ** (b - cpu.fractionLen)
+    # Values too big for a python float, which 8-byte words can hold, are
+    # returned as an exact integer
+    if exponent - cpu.exponentBias >= float_info.max_exp:
+        accum = (fraction | (1 << cpu.fractionLen)) << (exponent - cpu.exponentBias - cpu.fractionLen)
+        if negate:
+            return -accum
+        return accum
+
+    # Parse the fraction. A zero fraction stays an integer, so that huge
+    # exponents give an exact integer
+    if fraction != 0:
+        accum = ldexp(fraction, -cpu.fractionLen)
+    else:
+        accum = 0
 
     # Multiply by exponent
-    if oputil_is_float_denormal(cpu,val):
+    if exponent == 0:
+        # Denormal
         accum *= 2 ** (1 - cpu.exponentBias)
     else:
-        # Parse exponent
-        parsedExponent = aqasmutil_parse_bin(exponent, cpu.exponentLen) - cpu.exponentBias
-
         accum += 1
-        accum *= 2 ** parsedExponent
+        accum *= 2 ** (exponent - cpu.exponentBias)
 
     # Return final value
     if negate:
@@ -169,16 +237,62 @@ def aqasmutil_parse_float(cpu, val):
     else:
         return accum
 
+def aqasmutil_parse_float_array(cpu, val):
+    # Array version of aqasmutil_parse_float, for numpy arrays of floats.
+    # Raises OverflowError for values too big for a python float
+    val = numpy.asarray(val).astype(numpy.uint64)
+    fraction = (val & numpy.uint64(cpu.fractionMask)).astype(numpy.float64)
+    exponent = ((val & numpy.uint64(cpu.exponentMask)) >> numpy.uint64(cpu.fractionLen)).astype(numpy.int64)
+    negative = (val & numpy.uint64(cpu.signBitMask)) != 0
+    denormal = exponent == 0
+
+    # Power of 2 the fraction (with its hidden one, if normal) is multiplied by
+    power = numpy.where(denormal, 1, exponent) - cpu.exponentBias
+    if numpy.any((power > 1023) & (exponent != cpu.exponentMax)):
+        raise OverflowError("Float too big for a python float")
+    mantissa = numpy.where(denormal, fraction, fraction + 2 ** cpu.fractionLen)
+    # Powers too small for a python float make the result zero, like in the
+    # scalar version
+    result = numpy.where(power < -1074, 0.0, numpy.ldexp(mantissa, numpy.maximum(power, -1074) - cpu.fractionLen))
+
+    # Special values
+    special = exponent == cpu.exponentMax
+    result = numpy.where(special & (fraction == 0), inf, result)
+    result = numpy.where(special & (fraction != 0), nan, result)
+    return numpy.where(negative & ~(special & (fraction != 0)), -result, result)
+
 def aqasmutil_int2str(cpu, val):
     # Convert to string
     return str(aqasmutil_parse_int(cpu, val))
 
+def aqasmutil_huge2str(val):
+    # Formats an integer too big for a python float like '{:g}' would. The
+    # digits come from the logarithm, since converting the whole integer to a
+    # string would be too slow
+    l = log10(abs(val))
+    e = floor(l)
+    m = '{:g}'.format(10 ** (l - e))
+    if m == '10':
+        m = '1'
+        e += 1
+    if val < 0:
+        m = '-' + m
+    return '{:s}e+{:d}'.format(m, e)
+
 def aqasmutil_float2str(cpu, val):
     # Convert to string. Also show if denormal or negative zero
     if val == cpu.negZero:
         return '-0'
-    s = '{:g}'.format(aqasmutil_parse_float(cpu, val))
-    if oputil_is_float_denormal(cpu, val):
+    fval = aqasmutil_parse_float(cpu, val)
+    if isinstance(fval, int) and abs(fval) >> float_info.max_exp:
+        s = aqasmutil_huge2str(fval)
+    else:
+        s = '{:g}'.format(fval)
+    if cpu.floatTable != None:
+        denormal = cpu.floatTable.denormal[val]
+    else:
+        denormal = oputil_is_float_denormal(cpu, val)
+    if denormal:
         s += ' (denormal)'
     return s
 
@@ -187,29 +301,59 @@ def oputil_ldr(cpu, addr):
     # Loads a big endian word from memory and returns it
     # Convert the number to its unsigned bitwise equivalent
     if addr < 0:
-        addr += 2 ** cpu.wordLength
+        addr += cpu.uintMax + 1
     if addr >= cpu.memWords:
-        cpu.irq.append(IRQ_PAGE_FAULT)
+        cpu.irq.raise_irq(IRQ_PAGE_FAULT)
         return 0
     assert addr >= 0
-    # Get real value by bit shifting
-    fetchVal = 0
-    for b in range(0, cpu.bytesPerWord):
-        fetchVal += cpu.mem[addr * cpu.bytesPerWord + b] << ((cpu.bytesPerWord - b - 1) * 8)
-    return fetchVal
+    return cpu.memory.load(addr)
 
 def oputil_str(cpu, addr, val):
     # Stores a big endian word to memory
     # Convert the number to its unsigned bitwise equivalent
     if addr < 0:
-        addr += 2 ** cpu.wordLength
+        addr += cpu.uintMax + 1
     if addr >= cpu.memWords:
-        cpu.irq.append(IRQ_PAGE_FAULT)
+        cpu.irq.raise_irq(IRQ_PAGE_FAULT)
         return 0
     assert addr >= 0
-    # Set big endian value by bit shifting
-    for b in range(0, cpu.bytesPerWord):
-        cpu.mem[addr * cpu.bytesPerWord + b] = (val >> ((cpu.bytesPerWord - b - 1) * 8)) & 0xff
+    # Truncate to the word length, as storing byte by byte would
+    cpu.memory.store(addr, val & cpu.uintMax)
+
+def oputil_push(cpu, values):
+    # Pushes a list of words onto the stack, the first one on top. Raises a
+    # stack fault instead if SP is outside the stack region or the words don't
+    # fit. Returns whether the words were pushed
+    sp = cpu.reg[REG_SP]
+    if sp > cpu.stackLimit or sp - len(values) < cpu.stackBase:
+        cpu.irq.raise_irq(IRQ_STACK_FAULT)
+        return False
+    sp -= len(values)
+    for i in range(len(values)):
+        cpu.memory.store(sp + i, values[i] & cpu.uintMax)
+    cpu.reg[REG_SP] = sp
+    return True
+
+def oputil_pop(cpu, n):
+    # Pops n words off the stack and returns them as a list, the one on top
+    # first. Raises a stack fault instead and returns None if SP is outside the
+    # stack region or there are less than n words on the stack
+    sp = cpu.reg[REG_SP]
+    if sp < cpu.stackBase or sp + n > cpu.stackLimit:
+        cpu.irq.raise_irq(IRQ_STACK_FAULT)
+        return None
+    cpu.reg[REG_SP] = sp + n
+    return [cpu.memory.load(sp + i) for i in range(n)]
+
+def oputil_compare_branch(cpu, taken, label):
+    # Ends a compare and branch instruction. Branches to the label operand if
+    # taken, else to the line in the operand after it (see compare_branches)
+    line = cpu.compiled[cpu.pc]
+    if taken:
+        cpu.pc = line[label]
+    else:
+        cpu.pc = line[label + 1]
+    cpu.blast = True
 
 def oputil_truncate(cpu, a, n):
     # Truncates a number a to n bits
@@ -259,7 +403,7 @@ def oputil_mul_twos(cpu, a, b, n):
 def oputil_div_twos(cpu, a, b, n):
     # Divides the n-bit numbers a by b and returns the quotient and remainder
     if b == 0:
-        cpu.irq.append(IRQ_DIVISION_BY_ZERO)
+        cpu.irq.raise_irq(IRQ_DIVISION_BY_ZERO)
         return (0, 0)
 
     # Handle negative values
@@ -287,6 +431,175 @@ def oputil_div_twos(cpu, a, b, n):
         r = oputil_negate_twos(cpu, r, n)
     return (q, r)
 
+## Native ALU backend
+# Same two's complement semantics as the utilities above, but using masked
+# python integers instead of emulating the hardware bit by bit
+def aqasmutil_num2int_native(val, n):
+    # Parses a python number into an n-bit twos complement number by masking.
+    # Throws the same exception as aqasmutil_num2int when out of range
+    if val > (1 << (n - 1)) - 1 or val < -(1 << (n - 1)):
+        raise ValueError("Architecture error: Cannot represent number as twos complement")
+
+    # Floor, since the bit seeking version rounds down fractional values
+    return floor(val) & ((1 << n) - 1)
+
+def aqasmutil_parse_bin_native(val, n):
+    # Parses an n-bit unsigned number into a python number
+    return val & ((1 << n) - 1)
+
+def aqasmutil_parse_twos_native(val, n):
+    # Parses an n-bit twos complement number into a python number
+    val &= (1 << n) - 1
+    if val >> (n - 1):
+        return val - (1 << n)
+    return val
+
+def oputil_shift_left_native(cpu, a, t, n):
+    # Shifts an n-bit number a left, t times
+    return (a << t) & ((1 << n) - 1)
+
+def oputil_shift_right_native(cpu, a, t, n):
+    # Shifts an n-bit number a right, t times
+    return (a >> t) & ((1 << n) - 1)
+
+def oputil_negate_twos_native(cpu, a, n):
+    # Negates an n-bit number a, twos complement style
+    return -a & ((1 << n) - 1)
+
+def oputil_add_twos_native(cpu, a, b, n):
+    # Adds the n-bit numbers a and b
+    return (a + b) & ((1 << n) - 1)
+
+def oputil_sub_twos_native(cpu, a, b, n):
+    # Subtracts the n-bit numbers a and b
+    return (a - b) & ((1 << n) - 1)
+
+def oputil_mul_twos_native(cpu, a, b, n):
+    # Multiplies the n-bit numbers a and b. Bits past n are discarded, exactly
+    # like the shift and add version
+    return (a * b) & ((1 << n) - 1)
+
+def oputil_div_twos_native(cpu, a, b, n):
+    # Divides the n-bit numbers a by b and returns the quotient and remainder.
+    # Truncates towards zero and gives the remainder the sign of a
+    if b == 0:
+        cpu.irq.raise_irq(IRQ_DIVISION_BY_ZERO)
+        return (0, 0)
+
+    # Handle negative values by working with magnitudes
+    mask = (1 << n) - 1
+    signBit = 1 << (n - 1)
+    aNegative = (a & signBit) != 0
+    bNegative = (b & signBit) != 0
+    a = (-a if aNegative else a) & mask
+    b = (-b if bNegative else b) & mask
+    # Quotient and remainder. A divisor which only became zero after masking
+    # gives the same result as the long division version
+    if b == 0:
+        q, r = mask, a
+    else:
+        q, r = divmod(a, b)
+    # Final negative handling
+    if aNegative != bNegative:
+        q = -q & mask
+    if aNegative:
+        r = -r & mask
+    return (q, r)
+
+## ALU backends
+# Each backend maps the name of an integer utility to the function implementing
+# it. The backend is selected per aqasm instance (see aqasm.aluSelect), and
+# instruction functions call the utilities through the instance's attributes
+# of the same name, e.g.: cpu.add_twos(cpu, a, b, n)
+# The reference backend emulates the hardware bit by bit, and is kept for
+# checking the native backend against
+alus = {
+    "reference": {
+        "num2int":     aqasmutil_num2int,
+        "parse_bin":   aqasmutil_parse_bin,
+        "parse_twos":  aqasmutil_parse_twos,
+        "shift_left":  oputil_shift_left,
+        "shift_right": oputil_shift_right,
+        "negate_twos": oputil_negate_twos,
+        "add_twos":    oputil_add_twos,
+        "sub_twos":    oputil_sub_twos,
+        "mul_twos":    oputil_mul_twos,
+        "div_twos":    oputil_div_twos
+    },
+    "native": {
+        "num2int":     aqasmutil_num2int_native,
+        "parse_bin":   aqasmutil_parse_bin_native,
+        "parse_twos":  aqasmutil_parse_twos_native,
+        "shift_left":  oputil_shift_left_native,
+        "shift_right": oputil_shift_right_native,
+        "negate_twos": oputil_negate_twos_native,
+        "add_twos":    oputil_add_twos_native,
+        "sub_twos":    oputil_sub_twos_native,
+        "mul_twos":    oputil_mul_twos_native,
+        "div_twos":    oputil_div_twos_native
+    }
+}
+
+## Word size operation sets
+# Native ALU utilities specialized for one word size, with the word mask and
+# sign bit baked in as constants instead of rebuilt from n on every call. They
+# take the same arguments as the utilities they replace, but ignore n, so they
+# can only be used where n is the word length, like in threaded code. Sets are
+# generated once per word size from the source below and shared by every
+# machine with that word size
+
+# Source of the specialized utilities. Formatted with the word mask and sign bit
+wordops_source = """
+def shift_left(cpu, a, t, n):
+    return (a << t) & {mask}
+
+def shift_right(cpu, a, t, n):
+    return (a >> t) & {mask}
+
+def negate_twos(cpu, a, n):
+    return -a & {mask}
+
+def add_twos(cpu, a, b, n):
+    return (a + b) & {mask}
+
+def sub_twos(cpu, a, b, n):
+    return (a - b) & {mask}
+
+def mul_twos(cpu, a, b, n):
+    return (a * b) & {mask}
+
+def div_twos(cpu, a, b, n):
+    if b == 0:
+        cpu.irq.raise_irq(IRQ_DIVISION_BY_ZERO)
+        return (0, 0)
+    aNegative = (a & {signBit}) != 0
+    bNegative = (b & {signBit}) != 0
+    a = (-a if aNegative else a) & {mask}
+    b = (-b if bNegative else b) & {mask}
+    if b == 0:
+        q, r = {mask}, a
+    else:
+        q, r = divmod(a, b)
+    if aNegative != bNegative:
+        q = -q & {mask}
+    if aNegative:
+        r = -r & {mask}
+    return (q, r)
+"""
+
+# Generated sets, by number of bytes per word. Each set maps the native ALU
+# utility to its specialized version
+wordops = {}
+
+def word_ops(bytesPerWord):
+    # Returns the operation set for a word size, generating it if needed
+    if bytesPerWord not in wordops:
+        wordLength = bytesPerWord * 8
+        namespace = {"IRQ_DIVISION_BY_ZERO": IRQ_DIVISION_BY_ZERO}
+        exec(wordops_source.format(mask = hex((1 << wordLength) - 1), signBit = hex(1 << (wordLength - 1))), namespace)
+        wordops[bytesPerWord] = {alus["native"][name]: namespace[name] for name in ("shift_left", "shift_right", "negate_twos", "add_twos", "sub_twos", "mul_twos", "div_twos")}
+    return wordops[bytesPerWord]
+
 def oputil_is_float_nan(cpu, a):
     return ((a & cpu.exponentMask) == cpu.exponentMask) and ((a & cpu.fractionMask) != 0)
 
@@ -383,17 +696,17 @@ def oputil_float_add(cpu, a, b):
 
     # If signed, two's complement
     if aNegative:
-        aMantissa = oputil_negate_twos(cpu, aMantissa, l)
+        aMantissa = cpu.negate_twos(cpu, aMantissa, l)
     if bNegative:
-        bMantissa = oputil_negate_twos(cpu, bMantissa, l)
+        bMantissa = cpu.negate_twos(cpu, bMantissa, l)
 
     # Add fractions
-    cMantissa = oputil_add_twos(cpu, aMantissa, bMantissa, l)
+    cMantissa = cpu.add_twos(cpu, aMantissa, bMantissa, l)
 
     # If result is negative, two's complement the fraction
     cNegative = ((cMantissa >> (l - 1)) == 1)
     if cNegative:
-        cMantissa = oputil_negate_twos(cpu, cMantissa, l)
+        cMantissa = cpu.negate_twos(cpu, cMantissa, l)
 
     # If the resulting fraction is zero, then return 0
     if cMantissa == 0:
@@ -422,7 +735,7 @@ def oputil_float_mul(cpu, a, b):
 
     # Multiply fractions
     l = (cpu.fractionLen + 1) * 2
-    cMantissa = oputil_mul_twos(cpu, aMantissa, bMantissa, l)
+    cMantissa = cpu.mul_twos(cpu, aMantissa, bMantissa, l)
 
     # Add exponents
     cExponent = aExponent + bExponent - cpu.exponentBias
@@ -478,7 +791,7 @@ def oputil_float_round_away(cpu, a):
 
     # If there is a part less than zero, add one after mask
     if a & mask > 0:
-        a = oputil_add_twos(cpu, a, 1 << maskLen, cpu.fractionLen + cpu.exponentLen + 1)
+        a = cpu.add_twos(cpu, a, 1 << maskLen, cpu.fractionLen + cpu.exponentLen + 1)
 
     # Done, return rounded float (by masking it)
     return a & ~mask
@@ -541,7 +854,7 @@ def oputil_float_div(cpu, a, b):
 
     # Divide fractions
     l = (cpu.fractionLen + 1) * 2
-    cMantissa = oputil_div_twos(cpu, aMantissa, bMantissa, l)[0]
+    cMantissa = cpu.div_twos(cpu, aMantissa, bMantissa, l)[0]
 
     # Subtract exponents
     cExponent = aExponent - bExponent + cpu.exponentBias
@@ -552,29 +865,18 @@ def oputil_float_div(cpu, a, b):
     # Done
     return oputil_float_construct(aNegative != bNegative, cFraction, cExponent, cpu.fractionLen, cpu.exponentLen)
 
-def oputil_float_ln1px(cpu, x, n):
-    # Calculate ln(1 + x) with n iterations of a maclaurin series
-    # ln(1 + x) = sigma[r=1 to n]((-1)^(n + 1)*(x^r)/r)
-    result = cpu.posZero
-    # Starting at x^0 which is 1
-    xpown = cpu.exponentBias << cpu.fractionLen
-    for r in range(1, n + 1):
-        # Increase power of x
-        xpown = oputil_float_mul(cpu, xpown, x)
-        # Get r as a parsed float
-        rfloat = aqasmutil_num2float(float(r), cpu.exponentLen, cpu.fractionLen)
-        # Handle division
-        increment = oputil_float_div(cpu, xpown, rfloat)
-        # Make sign negative if iteration is even
-        if r % 2 == 0:
-            increment |= cpu.signBitMask
-        # Add iteration increment to result
-        result = oputil_float_add(cpu, result, increment)
-
-    # Return result
-    return result
+def oputil_float_scale(cpu, a, n):
+    # Multiplies a positive normal float by 2 ^ n by adding n to its exponent.
+    # Results too small for a normal float are truncated to a denormal, like
+    # in the other float utilities
+    exponent = ((a & cpu.exponentMask) >> cpu.fractionLen) + n
+    if exponent >= cpu.exponentMax:
+        return cpu.posInf
+    elif exponent > 0:
+        return (exponent << cpu.fractionLen) | (a & cpu.fractionMask)
+    return ((a & cpu.fractionMask) | (1 << cpu.fractionLen)) >> (1 - exponent)
 
-def oputil_float_exp(cpu, a, n):
+def oputil_float_exp(cpu, a):
     # Handle nans
     if oputil_is_float_nan(cpu, a):
         return cpu.defaultNan
@@ -591,48 +893,33 @@ def oputil_float_exp(cpu, a, n):
             return cpu.posZero
         else:
             return cpu.posInf
+    if negative:
+        value = -value
 
-    # Separate value into whole part and fraction
+    # Separate value into the nearest whole number and a fraction, so that
+    # -0.5 <= fraction <= 0.5
+    # exp = 2^e = 2^whole_e * 2^fraction_e
     whole = int(floor(value))
     fraction = value - whole
-
-    # Calculate result
-    # exp = 2^e = 2^whole_e * 2^fraction_e
-    result = (whole + cpu.exponentBias) << cpu.fractionLen
-    if fraction > 0:
-        # Use maclaurin series for 2^x {0 < x < 1}
+    if fraction > 0.5:
+        whole += 1
+        fraction -= 1
+
+    # Calculate fractional power
+    series = cpu.floatSeries
+    result = series.one
+    if fraction != 0:
+        # Use maclaurin series for 2^x {-0.5 <= x <= 0.5}
         # 2^x = 1 + xln2 + ((x^2)(ln2)^2)/(2!) + ... + ((x^n)(ln2)^n)/(n!)
-        # Fractional part is initially 1, and so is x^0, (ln2)^0 and the divisor
-        fracPart = xpown = lntwopown = divisor = cpu.exponentBias << cpu.fractionLen
         x = aqasmutil_num2float(fraction, cpu.exponentLen, cpu.fractionLen)
+        result = series.exp[-1]
+        for coefficient in reversed(series.exp[:-1]):
+            result = cpu.float_add(cpu, cpu.float_mul(cpu, result, x), coefficient)
 
-        # Doing n iterations
-        for r in range(1, n + 1):
-            # Calculate r
-            rfloat = aqasmutil_num2float(r, cpu.exponentLen, cpu.fractionLen)
-            # Calculate divisor
-            divisor = oputil_float_mul(cpu, rfloat, divisor)
-            # Calculate ln2 power
-            lntwopown = oputil_float_mul(cpu, lntwopown, cpu.lntwo)
-            # Calculate x power
-            xpown = oputil_float_mul(cpu, xpown, x)
-            # Calculate iteration result
-            iterResult = oputil_float_mul(cpu, xpown, lntwopown)
-            iterResult = oputil_float_div(cpu, iterResult, divisor)
-            # Add iteration result to fractional part of result
-            fracPart = oputil_float_add(cpu, fracPart, iterResult)
-
-        # Multiply fractional part of result with result for final power
-        result = oputil_float_mul(cpu, result, fracPart)
-
-    # Calculate reciprocal if exponent is negative
-    if negative:
-        result = oputil_float_div(cpu, cpu.exponentBias << cpu.fractionLen, result)
-
-    # Return final result
-    return result
+    # Multiply fractional power with the whole power
+    return oputil_float_scale(cpu, result, whole)
 
-def oputil_float_log(cpu, a, n):
+def oputil_float_log(cpu, a):
     # Special cases
     if oputil_is_float_nan(cpu, a) or ((a & cpu.signBitMask) > 0):
         return cpu.defaultNan
@@ -644,24 +931,500 @@ def oputil_float_log(cpu, a, n):
     # Get float parts
     negative, exponent, mantissa = oputil_float_split(cpu, a)
 
-    # Get fraction part of mantissa
-    mantissaFrac = mantissa & cpu.fractionMask
+    # Normalize denormals, so that the mantissa is 1.f
+    shift = cpu.fractionLen + 1 - mantissa.bit_length()
+    mantissa <<= shift
+    exponent -= shift
+
+    # Separate into whole exponent and mantissa, halving mantissas above
+    # sqrt(2), so that sqrt(1/2) <= m <= sqrt(2)
+    # log2(m * 2^e) = e + log2(m)
+    series = cpu.floatSeries
+    whole = exponent - cpu.exponentBias
+    m = (cpu.exponentBias << cpu.fractionLen) | (mantissa & cpu.fractionMask)
+    if mantissa > series.sqrtTwo:
+        m -= 1 << cpu.fractionLen
+        whole += 1
 
     # Calculate result
-    # log2(1.f * 2^e) = e + sigma[r=1 to n]((0.f^r) * ((-1)^(r + 1))/r)
-    result = aqasmutil_num2float(exponent - cpu.exponentBias, cpu.exponentLen, cpu.fractionLen)
-    if mantissaFrac != 0:
-        # Note that this is the sigma part of the above formula. This part is
-        # slow and is therefore avoided when not needed
-        mantissaFracVal = mantissaFrac * (2 ** -cpu.fractionLen)
-        fractionFloat = aqasmutil_num2float(mantissaFracVal, cpu.exponentLen, cpu.fractionLen)
-        fractionExponent = oputil_float_ln1px(cpu, fractionFloat, n)
-        fractionExponent = oputil_float_mul(cpu, fractionExponent, cpu.lntwo_rec)
-        result = oputil_float_add(cpu, result, fractionExponent)
+    result = aqasmutil_num2float(whole, cpu.exponentLen, cpu.fractionLen)
+    if m != series.one:
+        # Use the atanh series for log2(m). This part is slow and is therefore
+        # avoided when not needed
+        # log2(m) = 2/ln2 * atanh(y) = sigma[r=1,3,5 to n]((2/(r*ln2)) * y^r)
+        # with y = (m - 1) / (m + 1)
+        y = cpu.float_div(cpu, cpu.float_add(cpu, m, series.one | cpu.signBitMask), cpu.float_add(cpu, m, series.one))
+        ypowtwo = cpu.float_mul(cpu, y, y)
+        fractionExponent = series.log[-1]
+        for coefficient in reversed(series.log[:-1]):
+            fractionExponent = cpu.float_add(cpu, cpu.float_mul(cpu, fractionExponent, ypowtwo), coefficient)
+        fractionExponent = cpu.float_mul(cpu, fractionExponent, y)
+        result = cpu.float_add(cpu, result, fractionExponent)
 
     # Return final result
     return result
 
+def oputil_float_cmp(cpu, a, b):
+    # Compares floats a and b, setting the zero and sign flags like FCMP
+    if oputil_is_float_nan(cpu, a) or oputil_is_float_nan(cpu, b):
+        cpu.irq.raise_irq(IRQ_INVALID_ARITHMETIC)
+    else:
+        if a == cpu.negZero:
+            a = 0
+        if b == cpu.negZero:
+            b = 0
+        aSign = (a & cpu.signBitMask > 0)
+        bSign = (b & cpu.signBitMask > 0)
+        if aSign and not bSign:
+            cpu.zero = False
+            cpu.sign = True
+        elif not aSign and bSign:
+            cpu.zero = False
+            cpu.sign = False
+        else:
+            a &= cpu.signBitMask - 1
+            b &= cpu.signBitMask - 1
+            temp = cpu.sub_twos(cpu, a, b, cpu.wordLength)
+            cpu.zero = (temp == 0)
+            if aSign:
+                cpu.sign = ((temp >> (cpu.exponentLen + cpu.fractionLen)) == 0)
+            else:
+                cpu.sign = ((temp >> (cpu.exponentLen + cpu.fractionLen)) == 1)
+
+## Float table utilities
+# Float utilities which look their results up in the word size's float tables
+def oputil_float_add_table(cpu, a, b):
+    return cpu.floatTable.add[(a << cpu.wordLength) | b]
+
+def oputil_float_mul_table(cpu, a, b):
+    return cpu.floatTable.mul[(a << cpu.wordLength) | b]
+
+def oputil_float_div_table(cpu, a, b):
+    return cpu.floatTable.div[(a << cpu.wordLength) | b]
+
+def oputil_float_cmp_table(cpu, a, b):
+    flags = cpu.floatTable.cmp[(a << cpu.wordLength) | b]
+    if flags == None:
+        cpu.irq.raise_irq(IRQ_INVALID_ARITHMETIC)
+    else:
+        cpu.zero, cpu.sign = flags
+
+## Native FPU backend
+# Float utilities working on sign and magnitude python integers directly,
+# instead of on twos complement mantissas through the ALU utilities. Results
+# are bit identical to the reference utilities above
+def oputil_float_split_native(cpu, a):
+    # Same as oputil_float_split
+    exponent = (a & cpu.exponentMask) >> cpu.fractionLen
+    if exponent == 0:
+        return (a & cpu.signBitMask) != 0, 0, (a & cpu.fractionMask) << 1
+    return (a & cpu.signBitMask) != 0, exponent, (a & cpu.fractionMask) | (1 << cpu.fractionLen)
+
+def oputil_float_normalize_native(m, e, fs, tfs, em, fm):
+    # Same as oputil_float_normalize, finding the most significant set bit with
+    # bit_length. The whole size is not needed
+    if m == 0:
+        t = 0
+    else:
+        t = m.bit_length() - 1
+
+    # Calculate mantissa shift and new exponent
+    shift = fs - t
+    e -= shift
+    if e <= 0:
+        shift += e - 1
+        e = 0
+    shift -= fs - tfs
+
+    # If the new exponent is too big, return infinity
+    if e >= em:
+        return 0, em
+
+    # Shift and truncate mantissa
+    if shift > 0:
+        return (m << shift) & fm, e
+    return (m >> -shift) & fm, e
+
+def oputil_float_add_native(cpu, a, b):
+    # Special cases
+    if oputil_is_float_nan(cpu, a) or oputil_is_float_nan(cpu, b) or (a == cpu.posInf and b == cpu.negInf) or (a == cpu.negInf and b == cpu.posInf):
+        return cpu.defaultNan
+    elif a == cpu.posInf or a == cpu.negInf:
+        return a
+    elif b == cpu.posInf or b == cpu.negInf:
+        return b
+
+    # Get float parts
+    aNegative, aExponent, aMantissa = oputil_float_split_native(cpu, a)
+    bNegative, bExponent, bMantissa = oputil_float_split_native(cpu, b)
+
+    # Match exponents
+    if aExponent > bExponent:
+        minExponent = bExponent
+        aMantissa <<= aExponent - bExponent
+    else:
+        minExponent = aExponent
+        bMantissa <<= bExponent - aExponent
+
+    # Add signed mantissas
+    if aNegative:
+        aMantissa = -aMantissa
+    if bNegative:
+        bMantissa = -bMantissa
+    cMantissa = aMantissa + bMantissa
+
+    # If the resulting mantissa is zero, then return 0
+    if cMantissa == 0:
+        return cpu.posZero
+    cNegative = cMantissa < 0
+    if cNegative:
+        cMantissa = -cMantissa
+
+    # Normalize the result
+    cFraction, cExponent = oputil_float_normalize_native(cMantissa, minExponent, cpu.fractionLen, cpu.fractionLen, cpu.exponentMax, cpu.fractionMask)
+
+    # Done
+    return oputil_float_construct(cNegative, cFraction, cExponent, cpu.fractionLen, cpu.exponentLen)
+
+def oputil_float_mul_native(cpu, a, b):
+    # Special cases
+    aIsZero = (a == cpu.posZero or a == cpu.negZero)
+    bIsZero = (b == cpu.posZero or b == cpu.negZero)
+    aIsInf = (a == cpu.posInf or a == cpu.negInf)
+    bIsInf = (b == cpu.posInf or b == cpu.negInf)
+    if oputil_is_float_nan(cpu, a) or oputil_is_float_nan(cpu, b) or (aIsZero and bIsInf) or (aIsInf and bIsZero):
+        return cpu.defaultNan
+    elif aIsInf and bIsInf:
+        return cpu.posInf | ((a & cpu.signBitMask) ^ (b & cpu.signBitMask))
+
+    # Get float parts
+    aNegative, aExponent, aMantissa = oputil_float_split_native(cpu, a)
+    bNegative, bExponent, bMantissa = oputil_float_split_native(cpu, b)
+
+    # Multiply mantissas and add exponents, then normalize
+    cFraction, cExponent = oputil_float_normalize_native(aMantissa * bMantissa, aExponent + bExponent - cpu.exponentBias, cpu.fractionLen * 2, cpu.fractionLen, cpu.exponentMax, cpu.fractionMask)
+
+    # Done
+    return oputil_float_construct(aNegative != bNegative, cFraction, cExponent, cpu.fractionLen, cpu.exponentLen)
+
+def oputil_float_div_native(cpu, a, b):
+    # Special cases
+    aIsZero = (a == cpu.posZero or a == cpu.negZero)
+    bIsZero = (b == cpu.posZero or b == cpu.negZero)
+    aIsInf = (a == cpu.posInf or a == cpu.negInf)
+    bIsInf = (b == cpu.posInf or b == cpu.negInf)
+    if oputil_is_float_nan(cpu, a) or oputil_is_float_nan(cpu, b) or (aIsInf and bIsInf) or (aIsZero and bIsZero):
+        return cpu.defaultNan
+    elif aIsZero or bIsInf:
+        return (a & cpu.signBitMask) ^ (b & cpu.signBitMask)
+    elif aIsInf or bIsZero:
+        return cpu.posInf | ((a & cpu.signBitMask) ^ (b & cpu.signBitMask))
+
+    # Get float parts
+    aNegative, aExponent, aMantissa = oputil_float_split_native(cpu, a)
+    bNegative, bExponent, bMantissa = oputil_float_split_native(cpu, b)
+
+    # Divide mantissas, with A's shifted left to avoid precision loss, and
+    # subtract exponents, then normalize
+    cFraction, cExponent = oputil_float_normalize_native((aMantissa << cpu.fractionLen) // bMantissa, aExponent - bExponent + cpu.exponentBias, cpu.fractionLen, cpu.fractionLen, cpu.exponentMax, cpu.fractionMask)
+
+    # Done
+    return oputil_float_construct(aNegative != bNegative, cFraction, cExponent, cpu.fractionLen, cpu.exponentLen)
+
+def oputil_float_round_away_native(cpu, a):
+    # If the value is zero or nan, don't round
+    if a == cpu.posZero or a == cpu.negZero or oputil_is_float_nan(cpu, a):
+        return a
+
+    # Get unbiased exponent
+    exponent = ((a & cpu.exponentMask) >> cpu.fractionLen) - cpu.exponentBias
+
+    # If the unbiased exponent is less than zero, then the result is one
+    if exponent < 0:
+        return (a & cpu.signBitMask) | (cpu.exponentBias << cpu.fractionLen)
+
+    # Generate mask
+    maskLen = cpu.fractionLen - exponent
+    if maskLen <= 0:
+        return a
+    mask = (1 << maskLen) - 1
+
+    # If there is a part less than zero, add one after mask
+    if a & mask > 0:
+        a = (a + (1 << maskLen)) & cpu.uintMax
+
+    # Done, return rounded float (by masking it)
+    return a & ~mask
+
+def oputil_float_floor_native(cpu, a):
+    if a & cpu.signBitMask == 0:
+        return oputil_float_truncate(cpu, a)
+    else:
+        return oputil_float_round_away_native(cpu, a)
+
+def oputil_float_ceil_native(cpu, a):
+    if a & cpu.signBitMask == 0:
+        return oputil_float_round_away_native(cpu, a)
+    else:
+        return oputil_float_truncate(cpu, a)
+
+def oputil_float_round_native(cpu, a):
+    # Don't round if nan or infinity
+    if oputil_is_float_nan(cpu, a) or a == cpu.posInf or a == cpu.negInf:
+        return a
+
+    # If the bit for 0.5 is set then round away from zero, else, truncate. If
+    # the half position is less than zero, then the result is already rounded
+    exponent = ((a & cpu.exponentMask) >> cpu.fractionLen) - cpu.exponentBias
+    halfPos = cpu.fractionLen - exponent - 1
+    if halfPos < 0:
+        return a
+    if ((oputil_float_split_native(cpu, a)[2] >> halfPos) & 1) == 1:
+        return oputil_float_round_away_native(cpu, a)
+    else:
+        return oputil_float_truncate(cpu, a)
+
+def oputil_float_cmp_native(cpu, a, b):
+    # Compares floats a and b, setting the zero and sign flags like FCMP
+    if oputil_is_float_nan(cpu, a) or oputil_is_float_nan(cpu, b):
+        cpu.irq.raise_irq(IRQ_INVALID_ARITHMETIC)
+        return
+    if a == cpu.negZero:
+        a = 0
+    if b == cpu.negZero:
+        b = 0
+    aSign = (a & cpu.signBitMask > 0)
+    bSign = (b & cpu.signBitMask > 0)
+    if aSign and not bSign:
+        cpu.zero = False
+        cpu.sign = True
+    elif not aSign and bSign:
+        cpu.zero = False
+        cpu.sign = False
+    else:
+        # Compare magnitudes. Note that equal negative numbers set the sign
+        # flag, like the reference utility does
+        a &= cpu.signBitMask - 1
+        b &= cpu.signBitMask - 1
+        cpu.zero = (a == b)
+        if aSign:
+            cpu.sign = (a >= b)
+        else:
+            cpu.sign = (a < b)
+
+## FPU backends
+# Each backend maps the name of a float utility to the function implementing
+# it. The backend is selected per aqasm instance (see aqasm.fpuSelect). Word
+# sizes with float tables look the results of add, mul, div and cmp up instead
+fpus = {
+    "reference": {
+        "float_add":        oputil_float_add,
+        "float_mul":        oputil_float_mul,
+        "float_div":        oputil_float_div,
+        "float_cmp":        oputil_float_cmp,
+        "float_truncate":   oputil_float_truncate,
+        "float_round_away": oputil_float_round_away,
+        "float_floor":      oputil_float_floor,
+        "float_ceil":       oputil_float_ceil,
+        "float_round":      oputil_float_round
+    },
+    "native": {
+        "float_add":        oputil_float_add_native,
+        "float_mul":        oputil_float_mul_native,
+        "float_div":        oputil_float_div_native,
+        "float_cmp":        oputil_float_cmp_native,
+        "float_truncate":   oputil_float_truncate,
+        "float_round_away": oputil_float_round_away_native,
+        "float_floor":      oputil_float_floor_native,
+        "float_ceil":       oputil_float_ceil_native,
+        "float_round":      oputil_float_round_native
+    }
+}
+
+## Fixed point utilities
+# Q format fixed point numbers are signed words with cpu.fixedFraction fraction
+# bits, so a word holds its value times 2 ^ fixedFraction. They are computed
+# with python integers, so they run at close to integer speed. Results which
+# don't fit in a word saturate to the largest or smallest word instead of
+# wrapping around. Utilities take the word length n like the ALU utilities, so
+# that they can be used where those are
+
+def oputil_fixed_signed(cpu, a, n):
+    # Returns the python integer of an n-bit twos complement word
+    return a - ((a >> (n - 1)) << n)
+
+def oputil_fixed_saturate(cpu, a, n):
+    # Clamps a python integer to the n-bit signed range and returns it as a
+    # word
+    limit = 1 << (n - 1)
+    if a >= limit:
+        return limit - 1
+    if a < -limit:
+        return limit
+    return a & ((limit << 1) - 1)
+
+def oputil_fixed_add(cpu, a, b, n):
+    # Saturating addition of the n-bit fixed point numbers a and b
+    return oputil_fixed_saturate(cpu, oputil_fixed_signed(cpu, a, n) + oputil_fixed_signed(cpu, b, n), n)
+
+def oputil_fixed_sub(cpu, a, b, n):
+    # Saturating subtraction of the n-bit fixed point numbers a and b
+    return oputil_fixed_saturate(cpu, oputil_fixed_signed(cpu, a, n) - oputil_fixed_signed(cpu, b, n), n)
+
+def oputil_fixed_mul(cpu, a, b, n):
+    # Saturating multiplication of the n-bit fixed point numbers a and b,
+    # rounded to nearest (ties up)
+    product = oputil_fixed_signed(cpu, a, n) * oputil_fixed_signed(cpu, b, n)
+    f = cpu.fixedFraction
+    if f > 0:
+        product = (product + (1 << (f - 1))) >> f
+    return oputil_fixed_saturate(cpu, product, n)
+
+def oputil_fixed_div(cpu, a, b, n):
+    # Saturating division of the n-bit fixed point numbers a by b, truncated
+    # towards zero like DIV
+    b = oputil_fixed_signed(cpu, b, n)
+    if b == 0:
+        cpu.irq.raise_irq(IRQ_DIVISION_BY_ZERO)
+        return 0
+    a = oputil_fixed_signed(cpu, a, n) << cpu.fixedFraction
+    quotient = abs(a) // abs(b)
+    if (a < 0) != (b < 0):
+        quotient = -quotient
+    return oputil_fixed_saturate(cpu, quotient, n)
+
+## Vector utilities
+# Used by the vector instructions. Words are numpy uint64 arrays. Integer
+# arithmetic wraps around modulo 2 ^ 64 and is then truncated to the word
+# length, which gives the same results as the two's complement ALU utilities.
+# Float arithmetic works on the float format's fields as int64 arrays and
+# gives results bit identical to the scalar float utilities. Mantissas of
+# word sizes above VECTOR_FLOAT_MAX bytes don't fit, so those word sizes use
+# the scalar float utilities element by element instead
+
+# Largest word size, in bytes, with vectorized float arithmetic
+VECTOR_FLOAT_MAX = 4
+
+def oputil_vfloat_split(cpu, a):
+    # Vector version of oputil_float_split. Returns sign, exponent and
+    # mantissa arrays
+    a = a.astype(numpy.int64)
+    exponent = (a & cpu.exponentMask) >> cpu.fractionLen
+    fraction = a & cpu.fractionMask
+    mantissa = numpy.where(exponent == 0, fraction << 1, fraction | (1 << cpu.fractionLen))
+    return (a & cpu.signBitMask) != 0, exponent, mantissa
+
+def oputil_vfloat_normalize(m, e, fs, tfs, em, fm):
+    # Vector version of oputil_float_normalize_native. Mantissas must be below
+    # 2 ^ 53, so that converting them to python floats is exact
+    t = numpy.frexp(m.astype(numpy.float64))[1] - 1
+    t = numpy.where(m == 0, 0, t)
+
+    # Calculate mantissa shift and new exponent
+    shift = fs - t
+    e = e - shift
+    low = e <= 0
+    shift = numpy.where(low, shift + e - 1, shift)
+    e = numpy.where(low, 0, e)
+    shift -= fs - tfs
+
+    # Shift and truncate mantissa. If the new exponent is too big, the
+    # result is infinity
+    m = numpy.where(shift > 0, m << numpy.clip(shift, 0, 63), m >> numpy.clip(-shift, 0, 63)) & fm
+    over = e >= em
+    return numpy.where(over, 0, m), numpy.where(over, em, e)
+
+def oputil_vfloat_construct(cpu, s, f, e):
+    # Vector version of oputil_float_construct, returning a uint64 array
+    return ((e << cpu.fractionLen) | f | numpy.where(s, cpu.signBitMask, 0)).astype(numpy.uint64)
+
+def oputil_vfloat_nan(cpu, a):
+    return ((a & cpu.exponentMask) == cpu.exponentMask) & ((a & cpu.fractionMask) != 0)
+
+def oputil_vfloat_add(cpu, a, b):
+    # Vector version of oputil_float_add
+    if cpu.bytesPerWord > VECTOR_FLOAT_MAX:
+        return memory.memutil_values([cpu.float_add(cpu, x, y) for x, y in zip(a.tolist(), b.tolist())])
+
+    aNegative, aExponent, aMantissa = oputil_vfloat_split(cpu, a)
+    bNegative, bExponent, bMantissa = oputil_vfloat_split(cpu, b)
+
+    # Match exponents. If they are further apart than limit, the smaller
+    # operand can only affect the truncated result through being non-zero, so
+    # it is replaced by a single bit below the other operand's shifted
+    # mantissa, which keeps mantissas small
+    limit = cpu.fractionLen + 3
+    eDiff = aExponent - bExponent
+    far = numpy.abs(eDiff) > limit
+    aMantissa = numpy.where(far & (eDiff < 0), aMantissa != 0, aMantissa << numpy.clip(eDiff, 0, limit))
+    bMantissa = numpy.where(far & (eDiff > 0), bMantissa != 0, bMantissa << numpy.clip(-eDiff, 0, limit))
+    minExponent = numpy.where(far, numpy.maximum(aExponent, bExponent) - limit, numpy.minimum(aExponent, bExponent))
+
+    # Add signed mantissas, then normalize
+    cMantissa = numpy.where(aNegative, -aMantissa, aMantissa) + numpy.where(bNegative, -bMantissa, bMantissa)
+    cNegative = cMantissa < 0
+    cFraction, cExponent = oputil_vfloat_normalize(numpy.abs(cMantissa), minExponent, cpu.fractionLen, cpu.fractionLen, cpu.exponentMax, cpu.fractionMask)
+    result = oputil_vfloat_construct(cpu, cNegative, cFraction, cExponent)
+    result[cMantissa == 0] = cpu.posZero
+
+    # Special cases
+    a = a.astype(numpy.uint64)
+    b = b.astype(numpy.uint64)
+    aIsInf = (a == cpu.posInf) | (a == cpu.negInf)
+    bIsInf = (b == cpu.posInf) | (b == cpu.negInf)
+    result = numpy.where(bIsInf, b, result)
+    result = numpy.where(aIsInf, a, result)
+    nan = oputil_vfloat_nan(cpu, a) | oputil_vfloat_nan(cpu, b) | (aIsInf & bIsInf & (a != b))
+    result[nan] = cpu.defaultNan
+    return result
+
+def oputil_vfloat_mul(cpu, a, b):
+    # Vector version of oputil_float_mul
+    if cpu.bytesPerWord > VECTOR_FLOAT_MAX:
+        return memory.memutil_values([cpu.float_mul(cpu, x, y) for x, y in zip(a.tolist(), b.tolist())])
+
+    aNegative, aExponent, aMantissa = oputil_vfloat_split(cpu, a)
+    bNegative, bExponent, bMantissa = oputil_vfloat_split(cpu, b)
+
+    # Multiply mantissas and add exponents, then normalize
+    cFraction, cExponent = oputil_vfloat_normalize(aMantissa * bMantissa, aExponent + bExponent - cpu.exponentBias, cpu.fractionLen * 2, cpu.fractionLen, cpu.exponentMax, cpu.fractionMask)
+    result = oputil_vfloat_construct(cpu, aNegative != bNegative, cFraction, cExponent)
+
+    # Special cases
+    a = a.astype(numpy.uint64)
+    b = b.astype(numpy.uint64)
+    aIsZero = (a == cpu.posZero) | (a == cpu.negZero)
+    bIsZero = (b == cpu.posZero) | (b == cpu.negZero)
+    aIsInf = (a == cpu.posInf) | (a == cpu.negInf)
+    bIsInf = (b == cpu.posInf) | (b == cpu.negInf)
+    infinity = (aIsInf & bIsInf)
+    result[infinity] = cpu.posInf | ((a[infinity] ^ b[infinity]) & cpu.signBitMask)
+    nan = oputil_vfloat_nan(cpu, a) | oputil_vfloat_nan(cpu, b) | (aIsZero & bIsInf) | (aIsInf & bIsZero)
+    result[nan] = cpu.defaultNan
+    return result
+
+def oputil_vector_ranges(cpu, n, *addrs):
+    # Whether the n words starting at each address are all in memory. Raises
+    # a page fault if not
+    for addr in addrs:
+        if addr + n > cpu.memWords:
+            cpu.irq.raise_irq(IRQ_PAGE_FAULT)
+            return False
+    return True
+
+def oputil_vector(cpu, func):
+    # Runs a binary vector instruction, Rd, Rn, Rm, Rl:
+    # memory[Rd to Rd + Rl] = func(memory[Rn to Rn + Rl], memory[Rm to Rm + Rl])
+    line = cpu.compiled[cpu.pc]
+    dst = cpu.reg[line[1]]
+    a = cpu.reg[line[2]]
+    b = cpu.reg[line[3]]
+    n = cpu.reg[line[4]]
+    if n > 0 and oputil_vector_ranges(cpu, n, dst, a, b):
+        a = cpu.memory.read_words(a, n)
+        b = cpu.memory.read_words(b, n)
+        cpu.memory.write_words(dst, func(cpu, a, b) & numpy.uint64(cpu.uintMax))
+
 ## Instruction functions
 def op_ldr(cpu):
     # LDR Rd, <memory ref>
@@ -698,55 +1461,185 @@ def eop_str_dr(cpu):
     # memory[Rn] = #n
     oputil_str(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][1])
 
-def op_add_d(cpu):
-    # ADD Rd, Rn, <operand3 [decimal overload]>
-    # Rd = Rn + <operand3>
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_add_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3], cpu.wordLength)
+def eop_ldr_rd(cpu):
+    # LDR Rd, Rn, #off
+    # Rd = memory[Rn + #off]
+    line = cpu.compiled[cpu.pc]
+    cpu.reg[line[1]] = oputil_ldr(cpu, cpu.add_twos(cpu, cpu.reg[line[2]], line[3], cpu.wordLength))
+
+def eop_ldr_rr(cpu):
+    # LDR Rd, Rn, Rm
+    # Rd = memory[Rn + Rm]
+    line = cpu.compiled[cpu.pc]
+    cpu.reg[line[1]] = oputil_ldr(cpu, cpu.add_twos(cpu, cpu.reg[line[2]], cpu.reg[line[3]], cpu.wordLength))
+
+def eop_str_rrd(cpu):
+    # STR Rd, Rn, #off
+    # memory[Rn + #off] = Rd
+    line = cpu.compiled[cpu.pc]
+    oputil_str(cpu, cpu.add_twos(cpu, cpu.reg[line[2]], line[3], cpu.wordLength), cpu.reg[line[1]])
+
+def eop_str_drd(cpu):
+    # STR #n, Rn, #off
+    # memory[Rn + #off] = #n
+    line = cpu.compiled[cpu.pc]
+    oputil_str(cpu, cpu.add_twos(cpu, cpu.reg[line[2]], line[3], cpu.wordLength), line[1])
+
+def eop_str_rrr(cpu):
+    # STR Rd, Rn, Rm
+    # memory[Rn + Rm] = Rd
+    line = cpu.compiled[cpu.pc]
+    oputil_str(cpu, cpu.add_twos(cpu, cpu.reg[line[2]], cpu.reg[line[3]], cpu.wordLength), cpu.reg[line[1]])
+
+def eop_str_drr(cpu):
+    # STR #n, Rn, Rm
+    # memory[Rn + Rm] = #n
+    line = cpu.compiled[cpu.pc]
+    oputil_str(cpu, cpu.add_twos(cpu, cpu.reg[line[2]], cpu.reg[line[3]], cpu.wordLength), line[1])
+
+def eop_ldrp_d(cpu):
+    # LDRP Rd, Rn, #inc
+    # addr = Rn
+    # Rn = Rn + #inc
+    # Rd = memory[addr]
+    # Rn is incremented even if the load page faults
+    line = cpu.compiled[cpu.pc]
+    addr = cpu.reg[line[2]]
+    cpu.reg[line[2]] = cpu.add_twos(cpu, addr, line[3], cpu.wordLength)
+    cpu.reg[line[1]] = oputil_ldr(cpu, addr)
+
+def eop_ldrp_r(cpu):
+    # LDRP Rd, Rn, Rm
+    # addr = Rn
+    # Rn = Rn + Rm
+    # Rd = memory[addr]
+    line = cpu.compiled[cpu.pc]
+    addr = cpu.reg[line[2]]
+    cpu.reg[line[2]] = cpu.add_twos(cpu, addr, cpu.reg[line[3]], cpu.wordLength)
+    cpu.reg[line[1]] = oputil_ldr(cpu, addr)
+
+def eop_strp_rd(cpu):
+    # STRP Rd, Rn, #inc
+    # memory[Rn] = Rd
+    # Rn = Rn + #inc
+    # Rn is incremented even if the store page faults
+    line = cpu.compiled[cpu.pc]
+    oputil_str(cpu, cpu.reg[line[2]], cpu.reg[line[1]])
+    cpu.reg[line[2]] = cpu.add_twos(cpu, cpu.reg[line[2]], line[3], cpu.wordLength)
+
+def eop_strp_dd(cpu):
+    # STRP #n, Rn, #inc
+    # memory[Rn] = #n
+    # Rn = Rn + #inc
+    line = cpu.compiled[cpu.pc]
+    oputil_str(cpu, cpu.reg[line[2]], line[1])
+    cpu.reg[line[2]] = cpu.add_twos(cpu, cpu.reg[line[2]], line[3], cpu.wordLength)
+
+def eop_strp_rr(cpu):
+    # STRP Rd, Rn, Rm
+    # memory[Rn] = Rd
+    # Rn = Rn + Rm
+    line = cpu.compiled[cpu.pc]
+    oputil_str(cpu, cpu.reg[line[2]], cpu.reg[line[1]])
+    cpu.reg[line[2]] = cpu.add_twos(cpu, cpu.reg[line[2]], cpu.reg[line[3]], cpu.wordLength)
+
+def eop_strp_dr(cpu):
+    # STRP #n, Rn, Rm
+    # memory[Rn] = #n
+    # Rn = Rn + Rm
+    line = cpu.compiled[cpu.pc]
+    oputil_str(cpu, cpu.reg[line[2]], line[1])
+    cpu.reg[line[2]] = cpu.add_twos(cpu, cpu.reg[line[2]], cpu.reg[line[3]], cpu.wordLength)
+
+def op_add_d(cpu):
+    # ADD Rd, Rn, <operand3 [decimal overload]>
+    # Rd = Rn + <operand3>
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.add_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3], cpu.wordLength)
 
 def op_add_r(cpu):
     # ADD Rd, Rn, <operand3 [register overload]>
     # Rd = Rn + <operand3>
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_add_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]], cpu.wordLength)
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.add_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]], cpu.wordLength)
 
 def op_sub_d(cpu):
     # SUB Rd, Rn, <operand3 [decimal overload]>
     # Rd = Rn - <operand3>
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_sub_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3], cpu.wordLength)
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.sub_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3], cpu.wordLength)
 
 def op_sub_r(cpu):
     # SUB Rd, Rn, <operand3 [register overload]>
     # Rd = Rn - <operand3>
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_sub_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]], cpu.wordLength)
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.sub_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]], cpu.wordLength)
 
 def eop_mul_d(cpu):
     # MUL Rd, Rn, <operand3 [decimal overload]>
     # Rd = Rn * <operand3>
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_mul_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3], cpu.wordLength)
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.mul_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3], cpu.wordLength)
 
 def eop_mul_r(cpu):
     # MUL Rd, Rn, <operand3 [register overload]>
     # Rd = Rn * <operand3>
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_mul_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]], cpu.wordLength)
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.mul_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]], cpu.wordLength)
 
 def eop_div_d(cpu):
     # DIV Rd, Rn, <operand3 [decimal overload]>
     # Rd = Rn // <operand3>
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_div_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3], cpu.wordLength)[0]
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.div_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3], cpu.wordLength)[0]
 
 def eop_div_r(cpu):
     # DIV Rd, Rn, <operand3 [register overload]>
     # Rd = Rn // <operand3>
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_div_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]], cpu.wordLength)[0]
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.div_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]], cpu.wordLength)[0]
 
 def eop_rem_d(cpu):
     # REM Rd, Rn, <operand3 [decimal overload]>
     # Rd = Rn % <operand3>
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_div_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3], cpu.wordLength)[1]
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.div_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3], cpu.wordLength)[1]
 
 def eop_rem_r(cpu):
     # REM Rd, Rn, <operand3 [register overload]>
     # Rd = Rn % <operand3>
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_div_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]], cpu.wordLength)[1]
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.div_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]], cpu.wordLength)[1]
+
+def eop_qadd_d(cpu):
+    # QADD Rd, Rn, <operand3 [decimal overload]>
+    # Rdq = Rnq + <operand3>q, saturating
+    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_fixed_add(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3], cpu.wordLength)
+
+def eop_qadd_r(cpu):
+    # QADD Rd, Rn, <operand3 [register overload]>
+    # Rdq = Rnq + <operand3>q, saturating
+    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_fixed_add(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]], cpu.wordLength)
+
+def eop_qsub_d(cpu):
+    # QSUB Rd, Rn, <operand3 [decimal overload]>
+    # Rdq = Rnq - <operand3>q, saturating
+    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_fixed_sub(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3], cpu.wordLength)
+
+def eop_qsub_r(cpu):
+    # QSUB Rd, Rn, <operand3 [register overload]>
+    # Rdq = Rnq - <operand3>q, saturating
+    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_fixed_sub(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]], cpu.wordLength)
+
+def eop_qmul_d(cpu):
+    # QMUL Rd, Rn, <operand3 [decimal overload]>
+    # Rdq = Rnq * <operand3>q, rounded and saturating
+    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_fixed_mul(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3], cpu.wordLength)
+
+def eop_qmul_r(cpu):
+    # QMUL Rd, Rn, <operand3 [register overload]>
+    # Rdq = Rnq * <operand3>q, rounded and saturating
+    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_fixed_mul(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]], cpu.wordLength)
+
+def eop_qdiv_d(cpu):
+    # QDIV Rd, Rn, <operand3 [decimal overload]>
+    # Rdq = Rnq / <operand3>q, truncated and saturating
+    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_fixed_div(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3], cpu.wordLength)
+
+def eop_qdiv_r(cpu):
+    # QDIV Rd, Rn, <operand3 [register overload]>
+    # Rdq = Rnq / <operand3>q, truncated and saturating
+    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_fixed_div(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]], cpu.wordLength)
 
 def op_mov_d(cpu):
     # MOV Rd, <operand2 [decimal overload]>
@@ -768,7 +1661,7 @@ def op_cmp_d(cpu):
     # temp = Rn - <operand2>
     # if temp is 0 then set zero flag
     # if temp is negative then set sign flag
-    temp = oputil_sub_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], cpu.compiled[cpu.pc][2], cpu.wordLength)
+    temp = cpu.sub_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], cpu.compiled[cpu.pc][2], cpu.wordLength)
     cpu.zero = (temp == 0)
     # If MSB is set, then the result is negative, therefore, if the result is
     # greater than the signed integer max, then the MSB is set and the result
@@ -780,7 +1673,7 @@ def op_cmp_r(cpu):
     # temp = Rn - <operand2>
     # if temp is 0 then set zero flag
     # if temp is negative then set sign flag
-    temp = oputil_sub_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], cpu.reg[cpu.compiled[cpu.pc][2]], cpu.wordLength)
+    temp = cpu.sub_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], cpu.reg[cpu.compiled[cpu.pc][2]], cpu.wordLength)
     cpu.zero = (temp == 0)
     cpu.sign = (temp > cpu.intMax)
 
@@ -801,7 +1694,7 @@ def eop_b_r(cpu):
     #   set blast flag
     newpc = cpu.reg[cpu.compiled[cpu.pc][1]]
     if newpc > cpu.intMax or newpc > (len(cpu.compiled) - 1):
-        cpu.irq.append(IRQ_GENERAL_PROTECTION_FAULT)
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
     else:
         cpu.pc = newpc
         cpu.blast = True
@@ -825,7 +1718,7 @@ def eop_beq_r(cpu):
     #   set blast flag
     newpc = cpu.reg[cpu.compiled[cpu.pc][1]]
     if newpc > cpu.intMax or newpc > (len(cpu.compiled) - 1):
-        cpu.irq.append(IRQ_GENERAL_PROTECTION_FAULT)
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
     elif cpu.zero:
         cpu.pc = newpc
         cpu.blast = True
@@ -849,7 +1742,7 @@ def eop_bne_r(cpu):
     #   set blast flag
     newpc = cpu.reg[cpu.compiled[cpu.pc][1]]
     if newpc > cpu.intMax or newpc > (len(cpu.compiled) - 1):
-        cpu.irq.append(IRQ_GENERAL_PROTECTION_FAULT)
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
     elif not cpu.zero:
         cpu.pc = newpc
         cpu.blast = True
@@ -873,7 +1766,7 @@ def eop_bgt_r(cpu):
     #   set blast flag
     newpc = cpu.reg[cpu.compiled[cpu.pc][1]]
     if newpc > cpu.intMax or newpc > (len(cpu.compiled) - 1):
-        cpu.irq.append(IRQ_GENERAL_PROTECTION_FAULT)
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
     elif not cpu.sign and not cpu.zero:
         cpu.pc = newpc
         cpu.blast = True
@@ -897,7 +1790,7 @@ def eop_blt_r(cpu):
     #   set blast flag
     newpc = cpu.reg[cpu.compiled[cpu.pc][1]]
     if newpc > cpu.intMax or newpc > (len(cpu.compiled) - 1):
-        cpu.irq.append(IRQ_GENERAL_PROTECTION_FAULT)
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
     elif cpu.sign:
         cpu.pc = newpc
         cpu.blast = True
@@ -945,22 +1838,22 @@ def op_mvn_r(cpu):
 def op_lsl_d(cpu):
     # LSL Rd, Rn, <operand3 [decimal overload]>
     # Rd = Rn << <operand3>
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_shift_left(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3], cpu.wordLength)
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.shift_left(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3], cpu.wordLength)
 
 def op_lsl_r(cpu):
     # LSL Rd, Rn, <operand3 [register overload]>
     # Rd = Rn << <operand3>
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_shift_left(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]], cpu.wordLength)
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.shift_left(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]], cpu.wordLength)
 
 def op_lsr_d(cpu):
     # LSR Rd, Rn, <operand3 [decimal overload]>
     # Rd = Rn >> <operand3>
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_shift_right(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3], cpu.wordLength)
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.shift_right(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3], cpu.wordLength)
 
 def op_lsr_r(cpu):
     # LSR Rd, Rn, <operand3 [register overload]>
     # Rd = Rn >> <operand3>
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_shift_right(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]], cpu.wordLength)
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.shift_right(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]], cpu.wordLength)
 
 def op_halt(cpu):
     # HALT
@@ -973,9 +1866,9 @@ def eop_int(cpu):
     # else push IRQ number to IRQ
     irq = cpu.compiled[cpu.pc][1]
     if irq > 127 or irq < 0:
-        cpu.irq.append(IRQ_GENERAL_PROTECTION_FAULT)
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
     else:
-        cpu.irq.append(irq)
+        cpu.irq.raise_irq(irq)
 
 def eop_iret(cpu):
     # IRET
@@ -991,7 +1884,7 @@ def eop_iret(cpu):
         cpu.zero = cpu.intzero
         cpu.sign = cpu.intsign
     else:
-        cpu.irq.append(IRQ_GENERAL_PROTECTION_FAULT)
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
 
 def eop_mivt(cpu):
     # MIVT <operand1 [register overload only]>, <label>
@@ -999,10 +1892,57 @@ def eop_mivt(cpu):
     # else IVT[<operand1>] = line number corresponding to label
     irq = cpu.compiled[cpu.pc][1]
     if irq > 127 or irq < 0:
-        cpu.irq.append(IRQ_GENERAL_PROTECTION_FAULT)
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
     else:
         cpu.ivt[cpu.compiled[cpu.pc][1]] = cpu.compiled[cpu.pc][2]
 
+def eop_savectx(cpu):
+    # SAVECTX Rn
+    # if Rn + CONTEXT_WORDS > memory size then push page fault to IRQ
+    # elif pc to resume at > uintMax then push GP fault to IRQ
+    # else memory[Rn...] = registers, flags, pc to resume at
+    # The pc to resume at is the next line, or the interrupted one in an ISR.
+    # It must fit in a word, else it would be truncated
+    addr = cpu.reg[cpu.compiled[cpu.pc][1]]
+    if addr + CONTEXT_WORDS > cpu.memWords:
+        cpu.irq.raise_irq(IRQ_PAGE_FAULT)
+        return
+    if cpu.intc:
+        zero, sign, pc = cpu.intzero, cpu.intsign, cpu.intpc
+    else:
+        zero, sign, pc = cpu.zero, cpu.sign, cpu.pc + 1
+    if pc > cpu.uintMax:
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
+        return
+    values = memory.memutil_values(cpu.reg + [int(zero) | (int(sign) << 1), pc])
+    cpu.memory.write_words(addr, values & cpu.uintMax)
+
+def eop_loadctx(cpu):
+    # LOADCTX Rn
+    # if Rn + CONTEXT_WORDS > memory size then push page fault to IRQ
+    # elif saved pc > PCmax + 1 then push GP fault to IRQ
+    # else
+    #   registers, flags, pc to resume at = memory[Rn...]
+    #   set blast flag, unless in an ISR, where IRET resumes the context
+    addr = cpu.reg[cpu.compiled[cpu.pc][1]]
+    if addr + CONTEXT_WORDS > cpu.memWords:
+        cpu.irq.raise_irq(IRQ_PAGE_FAULT)
+        return
+    values = cpu.memory.read_words(addr, CONTEXT_WORDS).tolist()
+    pc = values[-1]
+    if pc > len(cpu.compiled):
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
+        return
+    # In place, since threaded code is bound to the register list
+    cpu.reg[:] = values[:-2]
+    zero = (values[-2] & 1) == 1
+    sign = (values[-2] & 2) == 2
+    if cpu.intc:
+        cpu.intzero, cpu.intsign, cpu.intpc = zero, sign, pc
+    else:
+        cpu.zero, cpu.sign, cpu.pc = zero, sign, pc
+        cpu.blast = True
+
 def eop_in_d(cpu):
     # IN Rd, <operand2 [decimal overload]>
     # if <operand2> > 127 or <operand2> < 0 or ioConfig[<operand2>] invalid
@@ -1013,11 +1953,11 @@ def eop_in_d(cpu):
     #   Rd = dequeue ioInput[<operand2>]
     port = cpu.compiled[cpu.pc][2]
     if port > 127 or port < 0 or cpu.ioConfig[port][1] == False:
-        cpu.irq.append(IRQ_GENERAL_PROTECTION_FAULT)
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
     elif len(cpu.ioInput[port]) == 0:
-        cpu.irq.append(IRQ_IO_EXCEPTION)
+        cpu.irq.raise_irq(IRQ_IO_EXCEPTION)
     else:
-        cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.ioInput[port].pop(0)
+        cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.ioInput[port].pop()
 
 def eop_in_r(cpu):
     # IN Rd, <operand2 [register overload]>
@@ -1029,11 +1969,11 @@ def eop_in_r(cpu):
     #   Rd = dequeue ioInput[<operand2>]
     port = cpu.reg[cpu.compiled[cpu.pc][2]]
     if port > 127 or port < 0 or cpu.ioConfig[port][1] == False:
-        cpu.irq.append(IRQ_GENERAL_PROTECTION_FAULT)
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
     elif len(cpu.ioInput[port]) == 0:
-        cpu.irq.append(IRQ_IO_EXCEPTION)
+        cpu.irq.raise_irq(IRQ_IO_EXCEPTION)
     else:
-        cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.ioInput[port].pop(0)
+        cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.ioInput[port].pop()
 
 def eop_out_rd(cpu):
     # OUT <operand1 [register overload]>, <operand2 [decimal overload]>
@@ -1043,7 +1983,7 @@ def eop_out_rd(cpu):
     #   send <operand1> to I/O port <operand2>
     port = cpu.compiled[cpu.pc][2]
     if port > 127 or port < 0 or cpu.ioConfig[port][1] == False:
-        cpu.irq.append(IRQ_GENERAL_PROTECTION_FAULT)
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
     else:
         cpu.ioOutput(port, cpu.reg[cpu.compiled[cpu.pc][1]])
 
@@ -1055,7 +1995,7 @@ def eop_out_rr(cpu):
     #   send <operand1> to I/O port <operand2>
     port = cpu.reg[cpu.compiled[cpu.pc][2]]
     if port > 127 or port < 0 or cpu.ioConfig[port][1] == False:
-        cpu.irq.append(IRQ_GENERAL_PROTECTION_FAULT)
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
     else:
         cpu.ioOutput(port, cpu.reg[cpu.compiled[cpu.pc][1]])
 
@@ -1067,7 +2007,7 @@ def eop_out_dd(cpu):
     #   send <operand1> to I/O port <operand2>
     port = cpu.compiled[cpu.pc][2]
     if port > 127 or port < 0 or cpu.ioConfig[port][1] == False:
-        cpu.irq.append(IRQ_GENERAL_PROTECTION_FAULT)
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
     else:
         cpu.ioOutput(port, cpu.compiled[cpu.pc][1])
 
@@ -1079,29 +2019,184 @@ def eop_out_dr(cpu):
     #   send <operand1> to I/O port <operand2>
     port = cpu.reg[cpu.compiled[cpu.pc][2]]
     if port > 127 or port < 0 or cpu.ioConfig[port][1] == False:
-        cpu.irq.append(IRQ_GENERAL_PROTECTION_FAULT)
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
     else:
         cpu.ioOutput(port, cpu.compiled[cpu.pc][1])
 
+def oputil_in_block(cpu, addr, n, port):
+    # Moves n values from the input queue of port into memory, starting at
+    # address addr. Nothing is moved if there are less than n values queued
+    if port > 127 or port < 0 or cpu.ioConfig[port][1] == False:
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
+    elif addr + n > cpu.memWords:
+        cpu.irq.raise_irq(IRQ_PAGE_FAULT)
+    elif n > 0:
+        values = cpu.ioInput[port].pop_many(n)
+        if values == None:
+            cpu.irq.raise_irq(IRQ_IO_EXCEPTION)
+        else:
+            cpu.memory.write_words(addr, memory.memutil_values([value & cpu.uintMax for value in values]))
+
+def oputil_out_block(cpu, addr, n, port):
+    # Sends the n words starting at address addr to port, as a numpy array
+    if port > 127 or port < 0 or cpu.ioConfig[port][1] == False:
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
+    elif addr + n > cpu.memWords:
+        cpu.irq.raise_irq(IRQ_PAGE_FAULT)
+    elif n > 0:
+        cpu.ioOutputBlock(port, cpu.memory.read_words(addr, n))
+
+def eop_inb_d(cpu):
+    # INB Rd, Rn, <operand3 [decimal overload]>
+    # if <operand3> > 127 or <operand3> < 0 or ioConfig[<operand3>] invalid
+    #   push GP fault to IRQ
+    # elif Rd + Rn > memory size
+    #   push page fault to IRQ
+    # elif less than Rn values in ioInput[<operand3>]
+    #   push IO exception to IRQ
+    # else
+    #   memory[Rd to Rd + Rn] = dequeue Rn values from ioInput[<operand3>]
+    oputil_in_block(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3])
+
+def eop_inb_r(cpu):
+    # INB Rd, Rn, <operand3 [register overload]>
+    # Same as the decimal overload
+    oputil_in_block(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]])
+
+def eop_outb_d(cpu):
+    # OUTB Rd, Rn, <operand3 [decimal overload]>
+    # if <operand3> > 127 or <operand3> < 0 or ioConfig[<operand3>] invalid
+    #   push GP fault to IRQ
+    # elif Rd + Rn > memory size
+    #   push page fault to IRQ
+    # else
+    #   send memory[Rd to Rd + Rn] to I/O port <operand3>
+    oputil_out_block(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3])
+
+def eop_outb_r(cpu):
+    # OUTB Rd, Rn, <operand3 [register overload]>
+    # Same as the decimal overload
+    oputil_out_block(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]])
+
+def oputil_memcpy(cpu, dst, src, n):
+    # Copies n words from address src to address dst. Overlapping ranges are
+    # copied as if through a temporary buffer
+    n &= cpu.uintMax
+    if dst + n > cpu.memWords or src + n > cpu.memWords:
+        cpu.irq.raise_irq(IRQ_PAGE_FAULT)
+    elif n > 0:
+        cpu.memory.copy_words(dst, src, n)
+
+def oputil_memset(cpu, dst, val, n):
+    # Stores val in the n words starting at address dst
+    n &= cpu.uintMax
+    if dst + n > cpu.memWords:
+        cpu.irq.raise_irq(IRQ_PAGE_FAULT)
+    elif n > 0:
+        cpu.memory.fill_words(dst, val & cpu.uintMax, n)
+
+def eop_memcpy_d(cpu):
+    # MEMCPY Rd, Rn, <operand3 [decimal overload]>
+    # if Rd + <operand3> > memory size or Rn + <operand3> > memory size
+    #   push page fault to IRQ
+    # else
+    #   memory[Rd to Rd + <operand3>] = memory[Rn to Rn + <operand3>]
+    oputil_memcpy(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3])
+
+def eop_memcpy_r(cpu):
+    # MEMCPY Rd, Rn, <operand3 [register overload]>
+    # Same as the decimal overload
+    oputil_memcpy(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]])
+
+def eop_memset_rd(cpu):
+    # MEMSET Rd, <operand2 [register overload]>, <operand3 [decimal overload]>
+    # if Rd + <operand3> > memory size
+    #   push page fault to IRQ
+    # else
+    #   memory[Rd to Rd + <operand3>] = <operand2>
+    oputil_memset(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3])
+
+def eop_memset_dd(cpu):
+    # MEMSET Rd, <operand2 [decimal overload]>, <operand3 [decimal overload]>
+    # Same as the register, decimal overload
+    oputil_memset(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], cpu.compiled[cpu.pc][2], cpu.compiled[cpu.pc][3])
+
+def eop_memset_rr(cpu):
+    # MEMSET Rd, <operand2 [register overload]>, <operand3 [register overload]>
+    # Same as the register, decimal overload
+    oputil_memset(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]])
+
+def eop_memset_dr(cpu):
+    # MEMSET Rd, <operand2 [decimal overload]>, <operand3 [register overload]>
+    # Same as the register, decimal overload
+    oputil_memset(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], cpu.compiled[cpu.pc][2], cpu.reg[cpu.compiled[cpu.pc][3]])
+
+def eop_vadd(cpu):
+    # VADD Rd, Rn, Rm, Rl
+    # if any of the Rl words at Rd, Rn or Rm is past the memory size
+    #   push page fault to IRQ
+    # else
+    #   memory[Rd + i] = memory[Rn + i] + memory[Rm + i] for i = 0 to Rl - 1
+    oputil_vector(cpu, lambda cpu, a, b: a + b)
+
+def eop_vsub(cpu):
+    # VSUB Rd, Rn, Rm, Rl
+    # Same as VADD, with memory[Rd + i] = memory[Rn + i] - memory[Rm + i]
+    oputil_vector(cpu, lambda cpu, a, b: a - b)
+
+def eop_vmul(cpu):
+    # VMUL Rd, Rn, Rm, Rl
+    # Same as VADD, with memory[Rd + i] = memory[Rn + i] * memory[Rm + i]
+    oputil_vector(cpu, lambda cpu, a, b: a * b)
+
+def eop_vand(cpu):
+    # VAND Rd, Rn, Rm, Rl
+    # Same as VADD, with memory[Rd + i] = memory[Rn + i] AND memory[Rm + i]
+    oputil_vector(cpu, lambda cpu, a, b: a & b)
+
+def eop_vfadd(cpu):
+    # VFADD Rd, Rn, Rm, Rl
+    # Same as VADD, with memory[Rd + i]f = memory[Rn + i]f + memory[Rm + i]f
+    oputil_vector(cpu, oputil_vfloat_add)
+
+def eop_vfmul(cpu):
+    # VFMUL Rd, Rn, Rm, Rl
+    # Same as VADD, with memory[Rd + i]f = memory[Rn + i]f * memory[Rm + i]f
+    oputil_vector(cpu, oputil_vfloat_mul)
+
+def eop_vsum(cpu):
+    # VSUM Rd, Rn, Rl
+    # if any of the Rl words at Rn is past the memory size
+    #   push page fault to IRQ
+    # else
+    #   Rd = memory[Rn] + memory[Rn + 1] + ... + memory[Rn + Rl - 1]
+    src = cpu.reg[cpu.compiled[cpu.pc][2]]
+    n = cpu.reg[cpu.compiled[cpu.pc][3]]
+    if n == 0:
+        cpu.reg[cpu.compiled[cpu.pc][1]] = 0
+    elif oputil_vector_ranges(cpu, n, src):
+        total = cpu.memory.read_words(src, n).sum(dtype=numpy.uint64)
+        cpu.reg[cpu.compiled[cpu.pc][1]] = int(total) & cpu.uintMax
+
 def eop_fadd_f(cpu):
     # FADD Rd, Rn, <operand3 [floating overload]>
     # Rdf = Rnf + <operand3>f
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_float_add(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3])
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.float_add(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3])
 
 def eop_fadd_r(cpu):
     # FADD Rd, Rn, <operand3 [register overload]>
     # Rdf = Rnf + <operand3>f
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_float_add(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]])
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.float_add(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]])
 
 def eop_fsub_f(cpu):
     # FSUB Rd, Rn, <operand3 [floating overload]>
     # Rdf = Rnf - <operand3>f
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_float_add(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3] ^ cpu.signBitMask)
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.float_add(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3] ^ cpu.signBitMask)
 
 def eop_fsub_r(cpu):
     # FSUB Rd, Rn, <operand3 [register overload]>
     # Rdf = Rnf - <operand3>f
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_float_add(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]] ^ cpu.signBitMask)
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.float_add(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]] ^ cpu.signBitMask)
 
 def eop_fcmp_f(cpu):
     # FCMP Rn, <operand2 [floating overload]>
@@ -1127,32 +2222,7 @@ def eop_fcmp_f(cpu):
     #       if temp is positive then set sign flag
     #     else:
     #       if temp is negative then set sign flag
-    a = cpu.reg[cpu.compiled[cpu.pc][1]]
-    b = cpu.compiled[cpu.pc][2]
-    if oputil_is_float_nan(cpu, a) or oputil_is_float_nan(cpu, b):
-        cpu.irq.append(IRQ_INVALID_ARITHMETIC)
-    else:
-        if a == cpu.negZero:
-            a = 0
-        if b == cpu.negZero:
-            b = 0
-        aSign = (a & cpu.signBitMask > 0)
-        bSign = (b & cpu.signBitMask > 0)
-        if aSign and not bSign:
-            cpu.zero = False
-            cpu.sign = True
-        elif not aSign and bSign:
-            cpu.zero = False
-            cpu.sign = False
-        else:
-            a &= cpu.signBitMask - 1
-            b &= cpu.signBitMask - 1
-            temp = oputil_sub_twos(cpu, a, b, cpu.wordLength)
-            cpu.zero = (temp == 0)
-            if aSign:
-                cpu.sign = ((temp >> (cpu.exponentLen + cpu.fractionLen)) == 0)
-            else:
-                cpu.sign = ((temp >> (cpu.exponentLen + cpu.fractionLen)) == 1)
+    cpu.float_cmp(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], cpu.compiled[cpu.pc][2])
 
 def eop_fcmp_r(cpu):
     # FCMP Rn, <operand2 [register overload]>
@@ -1178,87 +2248,62 @@ def eop_fcmp_r(cpu):
     #       if temp is positive then set sign flag
     #     else:
     #       if temp is negative then set sign flag
-    a = cpu.reg[cpu.compiled[cpu.pc][1]]
-    b = cpu.reg[cpu.compiled[cpu.pc][2]]
-    if oputil_is_float_nan(cpu, a) or oputil_is_float_nan(cpu, b):
-        cpu.irq.append(IRQ_INVALID_ARITHMETIC)
-    else:
-        if a == cpu.negZero:
-            a = 0
-        if b == cpu.negZero:
-            b = 0
-        aSign = (a & cpu.signBitMask > 0)
-        bSign = (b & cpu.signBitMask > 0)
-        if aSign and not bSign:
-            cpu.zero = False
-            cpu.sign = True
-        elif not aSign and bSign:
-            cpu.zero = False
-            cpu.sign = False
-        else:
-            a &= cpu.signBitMask - 1
-            b &= cpu.signBitMask - 1
-            temp = oputil_sub_twos(cpu, a, b, cpu.wordLength)
-            cpu.zero = (temp == 0)
-            if aSign:
-                cpu.sign = ((temp >> (cpu.exponentLen + cpu.fractionLen)) == 0)
-            else:
-                cpu.sign = ((temp >> (cpu.exponentLen + cpu.fractionLen)) == 1)
+    cpu.float_cmp(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], cpu.reg[cpu.compiled[cpu.pc][2]])
 
 def eop_fmul_f(cpu):
     # FMUL Rd, Rn, <operand3 [floating overload]>
     # Rdf = Rnf * <operand3>f
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_float_mul(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3])
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.float_mul(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3])
 
 def eop_fmul_r(cpu):
     # FMUL Rd, Rn, <operand3 [register overload]>
     # Rdf = Rnf * <operand3>f
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_float_mul(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]])
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.float_mul(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]])
 
 def eop_ftrunc(cpu):
     # FTRUNC Rd, Rn
     # Rdf = truncate(Rnf)
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_float_truncate(cpu, cpu.reg[cpu.compiled[cpu.pc][2]])
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.float_truncate(cpu, cpu.reg[cpu.compiled[cpu.pc][2]])
 
 def eop_fraway(cpu):
     # FRAWAY Rd, Rn
     # Rdf = round_away_from_zero(Rnf)
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_float_round_away(cpu, cpu.reg[cpu.compiled[cpu.pc][2]])
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.float_round_away(cpu, cpu.reg[cpu.compiled[cpu.pc][2]])
 
 def eop_ffloor(cpu):
     # FFLOOR Rd, Rn
     # Rdf = floor(Rnf)
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_float_floor(cpu, cpu.reg[cpu.compiled[cpu.pc][2]])
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.float_floor(cpu, cpu.reg[cpu.compiled[cpu.pc][2]])
 
 def eop_fceil(cpu):
     # FCEIL Rd, Rn
     # Rdf = floor(Rnf)
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_float_ceil(cpu, cpu.reg[cpu.compiled[cpu.pc][2]])
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.float_ceil(cpu, cpu.reg[cpu.compiled[cpu.pc][2]])
 
 def eop_fround(cpu):
     # FROUND Rd, Rn
     # Rdf = round(Rnf)
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_float_round(cpu, cpu.reg[cpu.compiled[cpu.pc][2]])
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.float_round(cpu, cpu.reg[cpu.compiled[cpu.pc][2]])
 
 def eop_fdiv_f(cpu):
     # FDIV Rd, Rn, <operand3 [floating overload]>
     # Rdf = Rnf / <operand3>f
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_float_div(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3])
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.float_div(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.compiled[cpu.pc][3])
 
 def eop_fdiv_r(cpu):
     # FDIV Rd, Rn, <operand3 [register overload]>
     # Rdf = Rnf / <operand3>f
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_float_div(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]])
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.float_div(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], cpu.reg[cpu.compiled[cpu.pc][3]])
 
 def eop_fexp(cpu):
     # FEXP Rd, Rn
     # Rdf = 2f ^ Rnf
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_float_exp(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], 25)
+    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_float_exp(cpu, cpu.reg[cpu.compiled[cpu.pc][2]])
 
 def eop_flog(cpu):
     # FLOG Rd, Rn
     # Rdf = log2(Rnf)
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_float_log(cpu, cpu.reg[cpu.compiled[cpu.pc][2]], 50)
+    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_float_log(cpu, cpu.reg[cpu.compiled[cpu.pc][2]])
 
 def eop_ftoi(cpu):
     # FTOI Rd, Rn
@@ -1270,19 +2315,19 @@ def eop_ftoi(cpu):
 
     # Handle nan and infinities
     if oputil_is_float_nan(cpu, a) or a == cpu.posInf or a == cpu.negInf:
-        cpu.irq.append(IRQ_INVALID_ARITHMETIC)
+        cpu.irq.raise_irq(IRQ_INVALID_ARITHMETIC)
         return
 
     # Parse float and truncate it
-    fval = aqasmutil_parse_float(cpu, oputil_float_truncate(cpu, a))
+    fval = aqasmutil_parse_float(cpu, cpu.float_truncate(cpu, a))
 
     # Handle overflow
     if fval > cpu.intMax or fval < cpu.intMin:
-        cpu.irq.append(IRQ_INVALID_ARITHMETIC)
+        cpu.irq.raise_irq(IRQ_INVALID_ARITHMETIC)
         return
 
     # Convert
-    cpu.reg[cpu.compiled[cpu.pc][1]] = aqasmutil_num2int(fval, cpu.wordLength)
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.num2int(fval, cpu.wordLength)
 
 def eop_itof(cpu):
     # ITOF Rd, Rn
@@ -1292,17 +2337,130 @@ def eop_itof(cpu):
 def eop_inc(cpu):
     # INC Rd
     # Rd = Rd + 1
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_add_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], 1, cpu.wordLength)
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.add_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], 1, cpu.wordLength)
 
 def eop_dec(cpu):
     # DEC Rd
     # Rd = Rd - 1
-    cpu.reg[cpu.compiled[cpu.pc][1]] = oputil_sub_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], 1, cpu.wordLength)
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.sub_twos(cpu, cpu.reg[cpu.compiled[cpu.pc][1]], 1, cpu.wordLength)
 
 def eop_ldpc(cpu):
     # LDPC Rd
     # Rd = PC
-    cpu.reg[cpu.compiled[cpu.pc][1]] = aqasmutil_num2int(cpu.pc, cpu.wordLength)
+    cpu.reg[cpu.compiled[cpu.pc][1]] = cpu.num2int(cpu.pc, cpu.wordLength)
+
+def eop_bl(cpu):
+    # BL <label>
+    # if PC + 1 > uintMax then push GP fault to IRQ
+    # else
+    #   push PC + 1 to stack
+    #   pc = <label>
+    #   set blast flag
+    # Call sites must fit in a word, else the return address would be truncated
+    if cpu.pc + 1 > cpu.uintMax:
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
+    elif oputil_push(cpu, [cpu.pc + 1]):
+        cpu.pc = cpu.compiled[cpu.pc][1]
+        cpu.blast = True
+
+def eop_ret(cpu):
+    # RET
+    # pop return address from stack
+    # if return address > PCmax + 1:
+    #   push GP to IRQ
+    # else:
+    #   pc = return address
+    #   set blast flag
+    # Returning past the last line halts, like running past it
+    values = oputil_pop(cpu, 1)
+    if values == None:
+        return
+    if values[0] > len(cpu.compiled):
+        cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
+    else:
+        cpu.pc = values[0]
+        cpu.blast = True
+
+def eop_push(cpu):
+    # PUSH Rn{, Rm}
+    # push Rn, Rm, ... to stack, with Rn on top
+    oputil_push(cpu, [cpu.reg[r] for r in cpu.compiled[cpu.pc][1:]])
+
+def eop_pop(cpu):
+    # POP Rd{, Re}
+    # pop Rd, Re, ... from stack, with Rd from the top
+    regs = cpu.compiled[cpu.pc][1:]
+    values = oputil_pop(cpu, len(regs))
+    if values != None:
+        for r, val in zip(regs, values):
+            cpu.reg[r] = val
+
+def eop_cbeq_d(cpu):
+    # CBEQ Rn, <operand2 [decimal overload]>, <label>
+    # CMP Rn, <operand2>
+    # BEQ <label>
+    op_cmp_d(cpu)
+    oputil_compare_branch(cpu, cpu.zero, 3)
+
+def eop_cbeq_r(cpu):
+    # CBEQ Rn, <operand2 [register overload]>, <label>
+    # CMP Rn, <operand2>
+    # BEQ <label>
+    op_cmp_r(cpu)
+    oputil_compare_branch(cpu, cpu.zero, 3)
+
+def eop_cbne_d(cpu):
+    # CBNE Rn, <operand2 [decimal overload]>, <label>
+    # CMP Rn, <operand2>
+    # BNE <label>
+    op_cmp_d(cpu)
+    oputil_compare_branch(cpu, not cpu.zero, 3)
+
+def eop_cbne_r(cpu):
+    # CBNE Rn, <operand2 [register overload]>, <label>
+    # CMP Rn, <operand2>
+    # BNE <label>
+    op_cmp_r(cpu)
+    oputil_compare_branch(cpu, not cpu.zero, 3)
+
+def eop_cblt_d(cpu):
+    # CBLT Rn, <operand2 [decimal overload]>, <label>
+    # CMP Rn, <operand2>
+    # BLT <label>
+    op_cmp_d(cpu)
+    oputil_compare_branch(cpu, cpu.sign, 3)
+
+def eop_cblt_r(cpu):
+    # CBLT Rn, <operand2 [register overload]>, <label>
+    # CMP Rn, <operand2>
+    # BLT <label>
+    op_cmp_r(cpu)
+    oputil_compare_branch(cpu, cpu.sign, 3)
+
+def eop_cbgt_d(cpu):
+    # CBGT Rn, <operand2 [decimal overload]>, <label>
+    # CMP Rn, <operand2>
+    # BGT <label>
+    op_cmp_d(cpu)
+    oputil_compare_branch(cpu, not cpu.sign and not cpu.zero, 3)
+
+def eop_cbgt_r(cpu):
+    # CBGT Rn, <operand2 [register overload]>, <label>
+    # CMP Rn, <operand2>
+    # BGT <label>
+    op_cmp_r(cpu)
+    oputil_compare_branch(cpu, not cpu.sign and not cpu.zero, 3)
+
+def eop_dbnz(cpu):
+    # DBNZ Rn, <label>
+    # Rn = Rn - 1
+    # CMP Rn, #0
+    # BNE <label>
+    n = cpu.compiled[cpu.pc][1]
+    cpu.reg[n] = cpu.sub_twos(cpu, cpu.reg[n], 1, cpu.wordLength)
+    cpu.zero = (cpu.reg[n] == 0)
+    cpu.sign = (cpu.reg[n] > cpu.intMax)
+    oputil_compare_branch(cpu, not cpu.zero, 2)
 
 ## Instruction definitions for compiler
 # Each token match has a value to add to a sum. Each sum represents which
@@ -1327,19 +2485,41 @@ def eop_ldpc(cpu):
 #            ((addval, TOKEN_TYPE2), (addval, ALT_TOKEN_TYPE2), ...),
 #            ...),
 # "opcode": ...
+# Opcodes taking a list of operands end with compiler.OPERANDS_REPEAT, which
+# makes their last operand repeatable. Every repeat is added to the sum
+# Operands can be left out if they have a compiler.OPERAND_NONE match, which
+# is what they match when missing. Only the last operands can be left out
 
 # Note: a common mistake is to forget to add a comma in the end of a 1D tuple.
 # BE CAREFUL
 opcodes = {
-    "ldr": ({0: (op_ldr, False), 1: (eop_ldr_r, True)},
+    "ldr": ({0: (op_ldr, False), 1: (eop_ldr_r, True),
+             3: (eop_ldr_rd, True), 5: (eop_ldr_rr, True)},
             ((0, compiler.token.register),),
-            ((0, compiler.token.address), (1, compiler.token.register))
+            ((0, compiler.token.address), (1, compiler.token.register)),
+            ((0, compiler.OPERAND_NONE), (2, compiler.token.decimal), (4, compiler.token.register))
            ),
     "str": (
             {0: (op_str, False), 1: (eop_str_da, True),
-             2: (eop_str_rr, True), 3: (eop_str_dr, True)},
+             2: (eop_str_rr, True), 3: (eop_str_dr, True),
+             6: (eop_str_rrd, True), 7: (eop_str_drd, True),
+             10: (eop_str_rrr, True), 11: (eop_str_drr, True)},
+            ((0, compiler.token.register), (1, compiler.token.decimal)),
+            ((0, compiler.token.address), (2, compiler.token.register)),
+            ((0, compiler.OPERAND_NONE), (4, compiler.token.decimal), (8, compiler.token.register))
+           ),
+    "ldrp":(
+            {0: (eop_ldrp_d, True), 1: (eop_ldrp_r, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.decimal), (1, compiler.token.register))
+           ),
+    "strp":(
+            {0: (eop_strp_rd, True), 1: (eop_strp_dd, True),
+             2: (eop_strp_rr, True), 3: (eop_strp_dr, True)},
             ((0, compiler.token.register), (1, compiler.token.decimal)),
-            ((0, compiler.token.address), (2, compiler.token.register))
+            ((0, compiler.token.register),),
+            ((0, compiler.token.decimal), (2, compiler.token.register))
            ),
     "add": (
             {0: (op_add_d, False), 1: (op_add_r, False)},
@@ -1439,6 +2619,30 @@ opcodes = {
             ((0, compiler.token.register),),
             ((0, compiler.token.decimal), (1, compiler.token.register))
            ),
+    "qadd":(
+            {0: (eop_qadd_d, True), 1: (eop_qadd_r, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.decimal), (1, compiler.token.register))
+           ),
+    "qsub":(
+            {0: (eop_qsub_d, True), 1: (eop_qsub_r, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.decimal), (1, compiler.token.register))
+           ),
+    "qmul":(
+            {0: (eop_qmul_d, True), 1: (eop_qmul_r, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.decimal), (1, compiler.token.register))
+           ),
+    "qdiv":(
+            {0: (eop_qdiv_d, True), 1: (eop_qdiv_r, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.decimal), (1, compiler.token.register))
+           ),
     "int": (
             {0: (eop_int, True)},
             ((0, compiler.token.decimal),)
@@ -1446,6 +2650,14 @@ opcodes = {
     "iret":(
             {0: (eop_iret, True)},
            ),
+    "savectx":(
+            {0: (eop_savectx, True)},
+            ((0, compiler.token.register),)
+           ),
+    "loadctx":(
+            {0: (eop_loadctx, True)},
+            ((0, compiler.token.register),)
+           ),
     "mivt":(
             {0: (eop_mivt, True)},
             ((0, compiler.token.decimal),),
@@ -1462,6 +2674,79 @@ opcodes = {
             ((0, compiler.token.register), (1, compiler.token.decimal)),
             ((0, compiler.token.decimal), (2, compiler.token.register))
            ),
+    "inb": (
+            {0: (eop_inb_d, True), 1: (eop_inb_r, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.decimal), (1, compiler.token.register))
+           ),
+    "outb":(
+            {0: (eop_outb_d, True), 1: (eop_outb_r, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.decimal), (1, compiler.token.register))
+           ),
+    "memcpy":(
+            {0: (eop_memcpy_d, True), 1: (eop_memcpy_r, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.decimal), (1, compiler.token.register))
+           ),
+    "memset":(
+            {0: (eop_memset_rd, True), 1: (eop_memset_dd, True),
+             2: (eop_memset_rr, True), 3: (eop_memset_dr, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register), (1, compiler.token.decimal)),
+            ((0, compiler.token.decimal), (2, compiler.token.register))
+           ),
+    "vadd":(
+            {0: (eop_vadd, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),)
+           ),
+    "vsub":(
+            {0: (eop_vsub, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),)
+           ),
+    "vmul":(
+            {0: (eop_vmul, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),)
+           ),
+    "vand":(
+            {0: (eop_vand, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),)
+           ),
+    "vfadd":(
+            {0: (eop_vfadd, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),)
+           ),
+    "vfmul":(
+            {0: (eop_vfmul, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),)
+           ),
+    "vsum":(
+            {0: (eop_vsum, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),),
+            ((0, compiler.token.register),)
+           ),
     "fadd":(
             {0: (eop_fadd_f, True), 1: (eop_fadd_r, True)},
             ((0, compiler.token.register),),
@@ -1547,26 +2832,1185 @@ opcodes = {
     "ldpc":(
             {0: (eop_ldpc, True)},
             ((0, compiler.token.register),)
+           ),
+    "bl":  (
+            {0: (eop_bl, True)},
+            ((0, compiler.token.labelid),)
+           ),
+    "ret": (
+            {0: (eop_ret, True)},
+           ),
+    "push":(
+            {0: (eop_push, True)},
+            ((0, compiler.token.register),),
+            compiler.OPERANDS_REPEAT
+           ),
+    "pop": (
+            {0: (eop_pop, True)},
+            ((0, compiler.token.register),),
+            compiler.OPERANDS_REPEAT
+           ),
+    "cbeq":(
+            {0: (eop_cbeq_d, True), 1: (eop_cbeq_r, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.decimal), (1, compiler.token.register)),
+            ((0, compiler.token.labelid),)
+           ),
+    "cbne":(
+            {0: (eop_cbne_d, True), 1: (eop_cbne_r, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.decimal), (1, compiler.token.register)),
+            ((0, compiler.token.labelid),)
+           ),
+    "cblt":(
+            {0: (eop_cblt_d, True), 1: (eop_cblt_r, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.decimal), (1, compiler.token.register)),
+            ((0, compiler.token.labelid),)
+           ),
+    "cbgt":(
+            {0: (eop_cbgt_d, True), 1: (eop_cbgt_r, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.decimal), (1, compiler.token.register)),
+            ((0, compiler.token.labelid),)
+           ),
+    "dbnz":(
+            {0: (eop_dbnz, True)},
+            ((0, compiler.token.register),),
+            ((0, compiler.token.labelid),)
            )
 }
 
+## Compare and branch instructions
+# Compiled compare and branch lines have one more operand than in assembly, the
+# line to continue at if the branch isn't taken. It is the next line, unless
+# the compiler fused the instruction from a branch idiom, in which case it is
+# the line after the idiom. The idiom's own lines are kept, so code branching
+# into the middle of the idiom still runs it
+compare_branches = {
+    eop_cbeq_d, eop_cbeq_r, eop_cbne_d, eop_cbne_r,
+    eop_cblt_d, eop_cblt_r, eop_cbgt_d, eop_cbgt_r,
+    eop_dbnz
+}
+
+# Compare and branch instructions fused from CMP followed by a label branch, by
+# CMP overload and branch instruction function. DEC Rn followed by CMP Rn, #0
+# and BNE is fused into DBNZ
+compare_fusions = {
+    op_cmp_d: {op_beq_l: eop_cbeq_d, op_bne_l: eop_cbne_d,
+               op_blt_l: eop_cblt_d, op_bgt_l: eop_cbgt_d},
+    op_cmp_r: {op_beq_l: eop_cbeq_r, op_bne_l: eop_cbne_r,
+               op_blt_l: eop_cblt_r, op_bgt_l: eop_cbgt_r}
+}
+
+## Threaded code
+# Each compiled line is turned into a closure with its operands, registers and
+# ALU utilities bound as locals. Calling the closure runs the instruction and
+# returns the next pc directly, so the interpreter never has to re-index
+# cpu.compiled[cpu.pc] for every operand. Closures are rebuilt on reset, since
+# they capture the register list
+
+# Value returned by a closure whose instruction halted the CPU
+THREAD_HALT = -1
+
+# Builder naming convention:
+# thread_name
+# name - Instruction function name, without the [e]op_ prefix
+# Builders take the cpu, the compiled line and the line number and return the
+# closure. Instructions without a builder fall back to thread_generic, which
+# runs the instruction function like step() used to
+
+def thread_noop(cpu, line, pc):
+    # Empty line
+    nextpc = pc + 1
+    def run():
+        return nextpc
+    return run
+
+def thread_generic(cpu, line, pc):
+    # Any instruction function. Since instruction functions fetch their
+    # operands through the pc, it has to be updated first
+    op = line[0]
+    nextpc = pc + 1
+    def run():
+        cpu.pc = pc
+        op(cpu)
+        if cpu.halt:
+            return THREAD_HALT
+        if cpu.blast:
+            cpu.blast = False
+            return cpu.pc
+        return nextpc
+    return run
+
+def threadutil_word(cpu, func):
+    # The word size's specialized version of an ALU utility, if it has one
+    # (see word_ops), for closures which always pass the word length as n
+    return cpu.wordOps.get(func, func)
+
+def threadutil_alu_d(cpu, line, pc, func):
+    # Rd = func(Rn, <operand3 [decimal overload]>), for n-bit ALU utilities
+    reg = cpu.reg
+    func = threadutil_word(cpu, func)
+    d, n, v = line[1], line[2], line[3]
+    wl = cpu.wordLength
+    nextpc = pc + 1
+    def run():
+        reg[d] = func(cpu, reg[n], v, wl)
+        return nextpc
+    return run
+
+def threadutil_alu_r(cpu, line, pc, func):
+    # Rd = func(Rn, <operand3 [register overload]>), for n-bit ALU utilities
+    reg = cpu.reg
+    func = threadutil_word(cpu, func)
+    d, n, m = line[1], line[2], line[3]
+    wl = cpu.wordLength
+    nextpc = pc + 1
+    def run():
+        reg[d] = func(cpu, reg[n], reg[m], wl)
+        return nextpc
+    return run
+
+def threadutil_div_d(cpu, line, pc, result):
+    # Rd = div_twos(Rn, <operand3 [decimal overload]>)[result]
+    reg = cpu.reg
+    d, n, v = line[1], line[2], line[3]
+    wl = cpu.wordLength
+    div = threadutil_word(cpu, cpu.div_twos)
+    nextpc = pc + 1
+    def run():
+        reg[d] = div(cpu, reg[n], v, wl)[result]
+        return nextpc
+    return run
+
+def threadutil_div_r(cpu, line, pc, result):
+    # Rd = div_twos(Rn, <operand3 [register overload]>)[result]
+    reg = cpu.reg
+    d, n, m = line[1], line[2], line[3]
+    wl = cpu.wordLength
+    div = threadutil_word(cpu, cpu.div_twos)
+    nextpc = pc + 1
+    def run():
+        reg[d] = div(cpu, reg[n], reg[m], wl)[result]
+        return nextpc
+    return run
+
+def threadutil_float_f(cpu, line, pc, op):
+    # Rdf = op(Rnf, <operand3 [floating overload]>f), where op is the name of a
+    # float utility (add, mul or div). Looks the result up if there is a table
+    reg = cpu.reg
+    d, n, v = line[1], line[2], line[3]
+    nextpc = pc + 1
+    if cpu.floatTable != None and getattr(cpu.floatTable, op) != None:
+        table = getattr(cpu.floatTable, op)
+        shift = cpu.wordLength
+        def run():
+            reg[d] = table[(reg[n] << shift) | v]
+            return nextpc
+    else:
+        func = getattr(cpu, "float_" + op)
+        def run():
+            reg[d] = func(cpu, reg[n], v)
+            return nextpc
+    return run
+
+def threadutil_float_r(cpu, line, pc, op, negate = 0):
+    # Rdf = op(Rnf, <operand3 [register overload]>f ^ negate), where op is the
+    # name of a float utility (add, mul or div). Looks the result up if there
+    # is a table
+    reg = cpu.reg
+    d, n, m = line[1], line[2], line[3]
+    nextpc = pc + 1
+    if cpu.floatTable != None and getattr(cpu.floatTable, op) != None:
+        table = getattr(cpu.floatTable, op)
+        shift = cpu.wordLength
+        def run():
+            reg[d] = table[(reg[n] << shift) | (reg[m] ^ negate)]
+            return nextpc
+    else:
+        func = getattr(cpu, "float_" + op)
+        def run():
+            reg[d] = func(cpu, reg[n], reg[m] ^ negate)
+            return nextpc
+    return run
+
+def thread_ldr(cpu, line, pc):
+    # LDR Rd, <memory ref>
+    reg = cpu.reg
+    d, addr = line[1], line[2]
+    nextpc = pc + 1
+    def run():
+        reg[d] = oputil_ldr(cpu, addr)
+        return nextpc
+    return run
+
+def thread_ldr_r(cpu, line, pc):
+    # LDR Rd, Rn
+    reg = cpu.reg
+    d, n = line[1], line[2]
+    nextpc = pc + 1
+    def run():
+        reg[d] = oputil_ldr(cpu, reg[n])
+        return nextpc
+    return run
+
+def thread_str(cpu, line, pc):
+    # STR Rd, <memory ref>
+    reg = cpu.reg
+    d, addr = line[1], line[2]
+    nextpc = pc + 1
+    def run():
+        oputil_str(cpu, addr, reg[d])
+        return nextpc
+    return run
+
+def thread_str_da(cpu, line, pc):
+    # STR #n, <memory ref>
+    v, addr = line[1], line[2]
+    nextpc = pc + 1
+    def run():
+        oputil_str(cpu, addr, v)
+        return nextpc
+    return run
+
+def thread_str_rr(cpu, line, pc):
+    # STR Rd, Rn
+    reg = cpu.reg
+    d, n = line[1], line[2]
+    nextpc = pc + 1
+    def run():
+        oputil_str(cpu, reg[n], reg[d])
+        return nextpc
+    return run
+
+def thread_str_dr(cpu, line, pc):
+    # STR #n, Rn
+    reg = cpu.reg
+    v, n = line[1], line[2]
+    nextpc = pc + 1
+    def run():
+        oputil_str(cpu, reg[n], v)
+        return nextpc
+    return run
+
+def thread_ldr_rd(cpu, line, pc):
+    # LDR Rd, Rn, #off
+    reg = cpu.reg
+    d, n, v = line[1], line[2], line[3]
+    wl = cpu.wordLength
+    add = threadutil_word(cpu, cpu.add_twos)
+    nextpc = pc + 1
+    def run():
+        reg[d] = oputil_ldr(cpu, add(cpu, reg[n], v, wl))
+        return nextpc
+    return run
+
+def thread_ldr_rr(cpu, line, pc):
+    # LDR Rd, Rn, Rm
+    reg = cpu.reg
+    d, n, m = line[1], line[2], line[3]
+    wl = cpu.wordLength
+    add = threadutil_word(cpu, cpu.add_twos)
+    nextpc = pc + 1
+    def run():
+        reg[d] = oputil_ldr(cpu, add(cpu, reg[n], reg[m], wl))
+        return nextpc
+    return run
+
+def thread_str_rrd(cpu, line, pc):
+    # STR Rd, Rn, #off
+    reg = cpu.reg
+    d, n, o = line[1], line[2], line[3]
+    wl = cpu.wordLength
+    add = threadutil_word(cpu, cpu.add_twos)
+    nextpc = pc + 1
+    def run():
+        oputil_str(cpu, add(cpu, reg[n], o, wl), reg[d])
+        return nextpc
+    return run
+
+def thread_str_rrr(cpu, line, pc):
+    # STR Rd, Rn, Rm
+    reg = cpu.reg
+    d, n, m = line[1], line[2], line[3]
+    wl = cpu.wordLength
+    add = threadutil_word(cpu, cpu.add_twos)
+    nextpc = pc + 1
+    def run():
+        oputil_str(cpu, add(cpu, reg[n], reg[m], wl), reg[d])
+        return nextpc
+    return run
+
+def thread_str_drd(cpu, line, pc):
+    # STR #n, Rn, #off
+    reg = cpu.reg
+    v, n, o = line[1], line[2], line[3]
+    wl = cpu.wordLength
+    add = threadutil_word(cpu, cpu.add_twos)
+    nextpc = pc + 1
+    def run():
+        oputil_str(cpu, add(cpu, reg[n], o, wl), v)
+        return nextpc
+    return run
+
+def thread_str_drr(cpu, line, pc):
+    # STR #n, Rn, Rm
+    reg = cpu.reg
+    v, n, m = line[1], line[2], line[3]
+    wl = cpu.wordLength
+    add = threadutil_word(cpu, cpu.add_twos)
+    nextpc = pc + 1
+    def run():
+        oputil_str(cpu, add(cpu, reg[n], reg[m], wl), v)
+        return nextpc
+    return run
+
+def thread_ldrp_d(cpu, line, pc):
+    # LDRP Rd, Rn, #inc
+    reg = cpu.reg
+    d, n, v = line[1], line[2], line[3]
+    wl = cpu.wordLength
+    add = threadutil_word(cpu, cpu.add_twos)
+    nextpc = pc + 1
+    def run():
+        addr = reg[n]
+        reg[n] = add(cpu, addr, v, wl)
+        reg[d] = oputil_ldr(cpu, addr)
+        return nextpc
+    return run
+
+def thread_ldrp_r(cpu, line, pc):
+    # LDRP Rd, Rn, Rm
+    reg = cpu.reg
+    d, n, m = line[1], line[2], line[3]
+    wl = cpu.wordLength
+    add = threadutil_word(cpu, cpu.add_twos)
+    nextpc = pc + 1
+    def run():
+        addr = reg[n]
+        reg[n] = add(cpu, addr, reg[m], wl)
+        reg[d] = oputil_ldr(cpu, addr)
+        return nextpc
+    return run
+
+def thread_strp_rd(cpu, line, pc):
+    # STRP Rd, Rn, #inc
+    reg = cpu.reg
+    d, n, i = line[1], line[2], line[3]
+    wl = cpu.wordLength
+    add = threadutil_word(cpu, cpu.add_twos)
+    nextpc = pc + 1
+    def run():
+        oputil_str(cpu, reg[n], reg[d])
+        reg[n] = add(cpu, reg[n], i, wl)
+        return nextpc
+    return run
+
+def thread_strp_rr(cpu, line, pc):
+    # STRP Rd, Rn, Rm
+    reg = cpu.reg
+    d, n, m = line[1], line[2], line[3]
+    wl = cpu.wordLength
+    add = threadutil_word(cpu, cpu.add_twos)
+    nextpc = pc + 1
+    def run():
+        oputil_str(cpu, reg[n], reg[d])
+        reg[n] = add(cpu, reg[n], reg[m], wl)
+        return nextpc
+    return run
+
+def thread_strp_dd(cpu, line, pc):
+    # STRP #n, Rn, #inc
+    reg = cpu.reg
+    v, n, i = line[1], line[2], line[3]
+    wl = cpu.wordLength
+    add = threadutil_word(cpu, cpu.add_twos)
+    nextpc = pc + 1
+    def run():
+        oputil_str(cpu, reg[n], v)
+        reg[n] = add(cpu, reg[n], i, wl)
+        return nextpc
+    return run
+
+def thread_strp_dr(cpu, line, pc):
+    # STRP #n, Rn, Rm
+    reg = cpu.reg
+    v, n, m = line[1], line[2], line[3]
+    wl = cpu.wordLength
+    add = threadutil_word(cpu, cpu.add_twos)
+    nextpc = pc + 1
+    def run():
+        oputil_str(cpu, reg[n], v)
+        reg[n] = add(cpu, reg[n], reg[m], wl)
+        return nextpc
+    return run
+
+def thread_add_d(cpu, line, pc):
+    # ADD Rd, Rn, <operand3 [decimal overload]>
+    return threadutil_alu_d(cpu, line, pc, cpu.add_twos)
+
+def thread_add_r(cpu, line, pc):
+    # ADD Rd, Rn, <operand3 [register overload]>
+    return threadutil_alu_r(cpu, line, pc, cpu.add_twos)
+
+def thread_sub_d(cpu, line, pc):
+    # SUB Rd, Rn, <operand3 [decimal overload]>
+    return threadutil_alu_d(cpu, line, pc, cpu.sub_twos)
+
+def thread_sub_r(cpu, line, pc):
+    # SUB Rd, Rn, <operand3 [register overload]>
+    return threadutil_alu_r(cpu, line, pc, cpu.sub_twos)
+
+def thread_mul_d(cpu, line, pc):
+    # MUL Rd, Rn, <operand3 [decimal overload]>
+    return threadutil_alu_d(cpu, line, pc, cpu.mul_twos)
+
+def thread_mul_r(cpu, line, pc):
+    # MUL Rd, Rn, <operand3 [register overload]>
+    return threadutil_alu_r(cpu, line, pc, cpu.mul_twos)
+
+def thread_div_d(cpu, line, pc):
+    # DIV Rd, Rn, <operand3 [decimal overload]>
+    return threadutil_div_d(cpu, line, pc, 0)
+
+def thread_div_r(cpu, line, pc):
+    # DIV Rd, Rn, <operand3 [register overload]>
+    return threadutil_div_r(cpu, line, pc, 0)
+
+def thread_rem_d(cpu, line, pc):
+    # REM Rd, Rn, <operand3 [decimal overload]>
+    return threadutil_div_d(cpu, line, pc, 1)
+
+def thread_rem_r(cpu, line, pc):
+    # REM Rd, Rn, <operand3 [register overload]>
+    return threadutil_div_r(cpu, line, pc, 1)
+
+def thread_qadd_d(cpu, line, pc):
+    # QADD Rd, Rn, <operand3 [decimal overload]>
+    return threadutil_alu_d(cpu, line, pc, oputil_fixed_add)
+
+def thread_qadd_r(cpu, line, pc):
+    # QADD Rd, Rn, <operand3 [register overload]>
+    return threadutil_alu_r(cpu, line, pc, oputil_fixed_add)
+
+def thread_qsub_d(cpu, line, pc):
+    # QSUB Rd, Rn, <operand3 [decimal overload]>
+    return threadutil_alu_d(cpu, line, pc, oputil_fixed_sub)
+
+def thread_qsub_r(cpu, line, pc):
+    # QSUB Rd, Rn, <operand3 [register overload]>
+    return threadutil_alu_r(cpu, line, pc, oputil_fixed_sub)
+
+def thread_qmul_d(cpu, line, pc):
+    # QMUL Rd, Rn, <operand3 [decimal overload]>
+    return threadutil_alu_d(cpu, line, pc, oputil_fixed_mul)
+
+def thread_qmul_r(cpu, line, pc):
+    # QMUL Rd, Rn, <operand3 [register overload]>
+    return threadutil_alu_r(cpu, line, pc, oputil_fixed_mul)
+
+def thread_qdiv_d(cpu, line, pc):
+    # QDIV Rd, Rn, <operand3 [decimal overload]>
+    return threadutil_alu_d(cpu, line, pc, oputil_fixed_div)
+
+def thread_qdiv_r(cpu, line, pc):
+    # QDIV Rd, Rn, <operand3 [register overload]>
+    return threadutil_alu_r(cpu, line, pc, oputil_fixed_div)
+
+def thread_lsl_d(cpu, line, pc):
+    # LSL Rd, Rn, <operand3 [decimal overload]>
+    return threadutil_alu_d(cpu, line, pc, cpu.shift_left)
+
+def thread_lsl_r(cpu, line, pc):
+    # LSL Rd, Rn, <operand3 [register overload]>
+    return threadutil_alu_r(cpu, line, pc, cpu.shift_left)
+
+def thread_lsr_d(cpu, line, pc):
+    # LSR Rd, Rn, <operand3 [decimal overload]>
+    return threadutil_alu_d(cpu, line, pc, cpu.shift_right)
+
+def thread_lsr_r(cpu, line, pc):
+    # LSR Rd, Rn, <operand3 [register overload]>
+    return threadutil_alu_r(cpu, line, pc, cpu.shift_right)
+
+def thread_mov_d(cpu, line, pc):
+    # MOV Rd, <operand2 [decimal overload]>
+    # Also used for the floating overload, since floats are compiled to words
+    reg = cpu.reg
+    d, v = line[1], line[2]
+    nextpc = pc + 1
+    def run():
+        reg[d] = v
+        return nextpc
+    return run
+
+def thread_mov_r(cpu, line, pc):
+    # MOV Rd, <operand2 [register overload]>
+    reg = cpu.reg
+    d, n = line[1], line[2]
+    nextpc = pc + 1
+    def run():
+        reg[d] = reg[n]
+        return nextpc
+    return run
+
+def thread_cmp_d(cpu, line, pc):
+    # CMP Rn, <operand2 [decimal overload]>
+    reg = cpu.reg
+    n, v = line[1], line[2]
+    wl = cpu.wordLength
+    intMax = cpu.intMax
+    sub = threadutil_word(cpu, cpu.sub_twos)
+    nextpc = pc + 1
+    def run():
+        temp = sub(cpu, reg[n], v, wl)
+        cpu.zero = (temp == 0)
+        cpu.sign = (temp > intMax)
+        return nextpc
+    return run
+
+def thread_cmp_r(cpu, line, pc):
+    # CMP Rn, <operand2 [register overload]>
+    reg = cpu.reg
+    n, m = line[1], line[2]
+    wl = cpu.wordLength
+    intMax = cpu.intMax
+    sub = threadutil_word(cpu, cpu.sub_twos)
+    nextpc = pc + 1
+    def run():
+        temp = sub(cpu, reg[n], reg[m], wl)
+        cpu.zero = (temp == 0)
+        cpu.sign = (temp > intMax)
+        return nextpc
+    return run
+
+def thread_b_l(cpu, line, pc):
+    # B <label>
+    target = line[1]
+    def run():
+        return target
+    return run
+
+def thread_beq_l(cpu, line, pc):
+    # BEQ <label>
+    target = line[1]
+    nextpc = pc + 1
+    def run():
+        if cpu.zero:
+            return target
+        return nextpc
+    return run
+
+def thread_bne_l(cpu, line, pc):
+    # BNE <label>
+    target = line[1]
+    nextpc = pc + 1
+    def run():
+        if not cpu.zero:
+            return target
+        return nextpc
+    return run
+
+def thread_bgt_l(cpu, line, pc):
+    # BGT <label>
+    target = line[1]
+    nextpc = pc + 1
+    def run():
+        if not cpu.sign and not cpu.zero:
+            return target
+        return nextpc
+    return run
+
+def thread_blt_l(cpu, line, pc):
+    # BLT <label>
+    target = line[1]
+    nextpc = pc + 1
+    def run():
+        if cpu.sign:
+            return target
+        return nextpc
+    return run
+
+def thread_and_d(cpu, line, pc):
+    # AND Rd, Rn, <operand3 [decimal overload]>
+    reg = cpu.reg
+    d, n, v = line[1], line[2], line[3]
+    nextpc = pc + 1
+    def run():
+        reg[d] = reg[n] & v
+        return nextpc
+    return run
+
+def thread_and_r(cpu, line, pc):
+    # AND Rd, Rn, <operand3 [register overload]>
+    reg = cpu.reg
+    d, n, m = line[1], line[2], line[3]
+    nextpc = pc + 1
+    def run():
+        reg[d] = reg[n] & reg[m]
+        return nextpc
+    return run
+
+def thread_orr_d(cpu, line, pc):
+    # ORR Rd, Rn, <operand3 [decimal overload]>
+    reg = cpu.reg
+    d, n, v = line[1], line[2], line[3]
+    nextpc = pc + 1
+    def run():
+        reg[d] = reg[n] | v
+        return nextpc
+    return run
+
+def thread_orr_r(cpu, line, pc):
+    # ORR Rd, Rn, <operand3 [register overload]>
+    reg = cpu.reg
+    d, n, m = line[1], line[2], line[3]
+    nextpc = pc + 1
+    def run():
+        reg[d] = reg[n] | reg[m]
+        return nextpc
+    return run
+
+def thread_eor_d(cpu, line, pc):
+    # EOR Rd, Rn, <operand3 [decimal overload]>
+    reg = cpu.reg
+    d, n, v = line[1], line[2], line[3]
+    nextpc = pc + 1
+    def run():
+        reg[d] = reg[n] ^ v
+        return nextpc
+    return run
+
+def thread_eor_r(cpu, line, pc):
+    # EOR Rd, Rn, <operand3 [register overload]>
+    reg = cpu.reg
+    d, n, m = line[1], line[2], line[3]
+    nextpc = pc + 1
+    def run():
+        reg[d] = reg[n] ^ reg[m]
+        return nextpc
+    return run
+
+def thread_halt(cpu, line, pc):
+    # HALT
+    def run():
+        cpu.halt = True
+        return THREAD_HALT
+    return run
+
+def thread_fadd_f(cpu, line, pc):
+    # FADD Rd, Rn, <operand3 [floating overload]>
+    return threadutil_float_f(cpu, line, pc, "add")
+
+def thread_fadd_r(cpu, line, pc):
+    # FADD Rd, Rn, <operand3 [register overload]>
+    return threadutil_float_r(cpu, line, pc, "add")
+
+def thread_fsub_f(cpu, line, pc):
+    # FSUB Rd, Rn, <operand3 [floating overload]>
+    # Negate the constant operand once, instead of on every run
+    return threadutil_float_f(cpu, [line[0], line[1], line[2], line[3] ^ cpu.signBitMask], pc, "add")
+
+def thread_fsub_r(cpu, line, pc):
+    # FSUB Rd, Rn, <operand3 [register overload]>
+    return threadutil_float_r(cpu, line, pc, "add", cpu.signBitMask)
+
+def thread_fmul_f(cpu, line, pc):
+    # FMUL Rd, Rn, <operand3 [floating overload]>
+    return threadutil_float_f(cpu, line, pc, "mul")
+
+def thread_fmul_r(cpu, line, pc):
+    # FMUL Rd, Rn, <operand3 [register overload]>
+    return threadutil_float_r(cpu, line, pc, "mul")
+
+def thread_fdiv_f(cpu, line, pc):
+    # FDIV Rd, Rn, <operand3 [floating overload]>
+    return threadutil_float_f(cpu, line, pc, "div")
+
+def thread_fdiv_r(cpu, line, pc):
+    # FDIV Rd, Rn, <operand3 [register overload]>
+    return threadutil_float_r(cpu, line, pc, "div")
+
+def thread_fcmp_f(cpu, line, pc):
+    # FCMP Rn, <operand2 [floating overload]>
+    reg = cpu.reg
+    n, v = line[1], line[2]
+    fcmp = cpu.float_cmp
+    nextpc = pc + 1
+    def run():
+        fcmp(cpu, reg[n], v)
+        return nextpc
+    return run
+
+def thread_fcmp_r(cpu, line, pc):
+    # FCMP Rn, <operand2 [register overload]>
+    reg = cpu.reg
+    n, m = line[1], line[2]
+    fcmp = cpu.float_cmp
+    nextpc = pc + 1
+    def run():
+        fcmp(cpu, reg[n], reg[m])
+        return nextpc
+    return run
+
+def thread_inc(cpu, line, pc):
+    # INC Rd
+    reg = cpu.reg
+    d = line[1]
+    wl = cpu.wordLength
+    add = threadutil_word(cpu, cpu.add_twos)
+    nextpc = pc + 1
+    def run():
+        reg[d] = add(cpu, reg[d], 1, wl)
+        return nextpc
+    return run
+
+def thread_dec(cpu, line, pc):
+    # DEC Rd
+    reg = cpu.reg
+    d = line[1]
+    wl = cpu.wordLength
+    sub = threadutil_word(cpu, cpu.sub_twos)
+    nextpc = pc + 1
+    def run():
+        reg[d] = sub(cpu, reg[d], 1, wl)
+        return nextpc
+    return run
+
+def thread_bl(cpu, line, pc):
+    # BL <label>
+    reg = cpu.reg
+    target = line[1]
+    nextpc = pc + 1
+    # Call sites must fit in a word, else the return address would be truncated
+    if nextpc > cpu.uintMax:
+        def run():
+            cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
+            return nextpc
+        return run
+    ret = nextpc
+    def run():
+        sp = reg[REG_SP] - 1
+        if cpu.stackBase <= sp < cpu.stackLimit:
+            cpu.memory.store(sp, ret)
+            reg[REG_SP] = sp
+            return target
+        cpu.irq.raise_irq(IRQ_STACK_FAULT)
+        return nextpc
+    return run
+
+def thread_ret(cpu, line, pc):
+    # RET
+    reg = cpu.reg
+    end = len(cpu.compiled)
+    nextpc = pc + 1
+    def run():
+        sp = reg[REG_SP]
+        if cpu.stackBase <= sp < cpu.stackLimit:
+            reg[REG_SP] = sp + 1
+            ret = cpu.memory.load(sp)
+            if ret <= end:
+                return ret
+            cpu.irq.raise_irq(IRQ_GENERAL_PROTECTION_FAULT)
+        else:
+            cpu.irq.raise_irq(IRQ_STACK_FAULT)
+        return nextpc
+    return run
+
+def thread_push(cpu, line, pc):
+    # PUSH Rn{, Rm}
+    reg = cpu.reg
+    regs = line[1:]
+    nextpc = pc + 1
+    def run():
+        oputil_push(cpu, [reg[r] for r in regs])
+        return nextpc
+    return run
+
+def thread_pop(cpu, line, pc):
+    # POP Rd{, Re}
+    reg = cpu.reg
+    regs = line[1:]
+    nextpc = pc + 1
+    def run():
+        values = oputil_pop(cpu, len(regs))
+        if values != None:
+            for r, val in zip(regs, values):
+                reg[r] = val
+        return nextpc
+    return run
+
+def threadutil_cbranch_d(cpu, line, pc, taken):
+    # CMP Rn, <operand2 [decimal overload]> and branch to <label> if
+    # taken(zero, sign), else to the fall through line
+    reg = cpu.reg
+    n, v, target, fallthrough = line[1], line[2], line[3], line[4]
+    wl = cpu.wordLength
+    intMax = cpu.intMax
+    sub = threadutil_word(cpu, cpu.sub_twos)
+    def run():
+        temp = sub(cpu, reg[n], v, wl)
+        cpu.zero = zero = (temp == 0)
+        cpu.sign = sign = (temp > intMax)
+        if taken(zero, sign):
+            return target
+        return fallthrough
+    return run
+
+def threadutil_cbranch_r(cpu, line, pc, taken):
+    # CMP Rn, <operand2 [register overload]> and branch to <label> if
+    # taken(zero, sign), else to the fall through line
+    reg = cpu.reg
+    n, m, target, fallthrough = line[1], line[2], line[3], line[4]
+    wl = cpu.wordLength
+    intMax = cpu.intMax
+    sub = threadutil_word(cpu, cpu.sub_twos)
+    def run():
+        temp = sub(cpu, reg[n], reg[m], wl)
+        cpu.zero = zero = (temp == 0)
+        cpu.sign = sign = (temp > intMax)
+        if taken(zero, sign):
+            return target
+        return fallthrough
+    return run
+
+# Branch conditions of the compare and branch instructions
+def threadutil_eq(zero, sign):
+    return zero
+
+def threadutil_ne(zero, sign):
+    return not zero
+
+def threadutil_lt(zero, sign):
+    return sign
+
+def threadutil_gt(zero, sign):
+    return not sign and not zero
+
+def thread_cbeq_d(cpu, line, pc):
+    # CBEQ Rn, <operand2>, <label>
+    return threadutil_cbranch_d(cpu, line, pc, threadutil_eq)
+
+def thread_cbeq_r(cpu, line, pc):
+    # CBEQ Rn, <operand2>, <label>
+    return threadutil_cbranch_r(cpu, line, pc, threadutil_eq)
+
+def thread_cbne_d(cpu, line, pc):
+    # CBNE Rn, <operand2>, <label>
+    return threadutil_cbranch_d(cpu, line, pc, threadutil_ne)
+
+def thread_cbne_r(cpu, line, pc):
+    # CBNE Rn, <operand2>, <label>
+    return threadutil_cbranch_r(cpu, line, pc, threadutil_ne)
+
+def thread_cblt_d(cpu, line, pc):
+    # CBLT Rn, <operand2>, <label>
+    return threadutil_cbranch_d(cpu, line, pc, threadutil_lt)
+
+def thread_cblt_r(cpu, line, pc):
+    # CBLT Rn, <operand2>, <label>
+    return threadutil_cbranch_r(cpu, line, pc, threadutil_lt)
+
+def thread_cbgt_d(cpu, line, pc):
+    # CBGT Rn, <operand2>, <label>
+    return threadutil_cbranch_d(cpu, line, pc, threadutil_gt)
+
+def thread_cbgt_r(cpu, line, pc):
+    # CBGT Rn, <operand2>, <label>
+    return threadutil_cbranch_r(cpu, line, pc, threadutil_gt)
+
+def thread_dbnz(cpu, line, pc):
+    # DBNZ Rn, <label>
+    reg = cpu.reg
+    n, target, fallthrough = line[1], line[2], line[3]
+    wl = cpu.wordLength
+    intMax = cpu.intMax
+    sub = threadutil_word(cpu, cpu.sub_twos)
+    def run():
+        temp = reg[n] = sub(cpu, reg[n], 1, wl)
+        cpu.zero = (temp == 0)
+        cpu.sign = (temp > intMax)
+        if temp != 0:
+            return target
+        return fallthrough
+    return run
+
+# Builder for each instruction function
+threaders = {
+    op_ldr:     thread_ldr,
+    eop_ldr_r:  thread_ldr_r,
+    op_str:     thread_str,
+    eop_str_da: thread_str_da,
+    eop_str_rr: thread_str_rr,
+    eop_str_dr: thread_str_dr,
+    eop_ldr_rd: thread_ldr_rd,
+    eop_ldr_rr: thread_ldr_rr,
+    eop_str_rrd: thread_str_rrd,
+    eop_str_rrr: thread_str_rrr,
+    eop_str_drd: thread_str_drd,
+    eop_str_drr: thread_str_drr,
+    eop_ldrp_d: thread_ldrp_d,
+    eop_ldrp_r: thread_ldrp_r,
+    eop_strp_rd: thread_strp_rd,
+    eop_strp_rr: thread_strp_rr,
+    eop_strp_dd: thread_strp_dd,
+    eop_strp_dr: thread_strp_dr,
+    op_add_d:   thread_add_d,
+    op_add_r:   thread_add_r,
+    op_sub_d:   thread_sub_d,
+    op_sub_r:   thread_sub_r,
+    eop_mul_d:  thread_mul_d,
+    eop_mul_r:  thread_mul_r,
+    eop_div_d:  thread_div_d,
+    eop_div_r:  thread_div_r,
+    eop_rem_d:  thread_rem_d,
+    eop_rem_r:  thread_rem_r,
+    eop_qadd_d: thread_qadd_d,
+    eop_qadd_r: thread_qadd_r,
+    eop_qsub_d: thread_qsub_d,
+    eop_qsub_r: thread_qsub_r,
+    eop_qmul_d: thread_qmul_d,
+    eop_qmul_r: thread_qmul_r,
+    eop_qdiv_d: thread_qdiv_d,
+    eop_qdiv_r: thread_qdiv_r,
+    op_lsl_d:   thread_lsl_d,
+    op_lsl_r:   thread_lsl_r,
+    op_lsr_d:   thread_lsr_d,
+    op_lsr_r:   thread_lsr_r,
+    op_mov_d:   thread_mov_d,
+    op_mov_r:   thread_mov_r,
+    eop_mov_f:  thread_mov_d,
+    op_cmp_d:   thread_cmp_d,
+    op_cmp_r:   thread_cmp_r,
+    op_b_l:     thread_b_l,
+    op_beq_l:   thread_beq_l,
+    op_bne_l:   thread_bne_l,
+    op_bgt_l:   thread_bgt_l,
+    op_blt_l:   thread_blt_l,
+    op_and_d:   thread_and_d,
+    op_and_r:   thread_and_r,
+    op_orr_d:   thread_orr_d,
+    op_orr_r:   thread_orr_r,
+    op_eor_d:   thread_eor_d,
+    op_eor_r:   thread_eor_r,
+    op_halt:    thread_halt,
+    eop_fadd_f: thread_fadd_f,
+    eop_fadd_r: thread_fadd_r,
+    eop_fsub_f: thread_fsub_f,
+    eop_fsub_r: thread_fsub_r,
+    eop_fmul_f: thread_fmul_f,
+    eop_fmul_r: thread_fmul_r,
+    eop_fdiv_f: thread_fdiv_f,
+    eop_fdiv_r: thread_fdiv_r,
+    eop_fcmp_f: thread_fcmp_f,
+    eop_fcmp_r: thread_fcmp_r,
+    eop_inc:    thread_inc,
+    eop_dec:    thread_dec,
+    eop_bl:     thread_bl,
+    eop_ret:    thread_ret,
+    eop_push:   thread_push,
+    eop_pop:    thread_pop,
+    eop_cbeq_d: thread_cbeq_d,
+    eop_cbeq_r: thread_cbeq_r,
+    eop_cbne_d: thread_cbne_d,
+    eop_cbne_r: thread_cbne_r,
+    eop_cblt_d: thread_cblt_d,
+    eop_cblt_r: thread_cblt_r,
+    eop_cbgt_d: thread_cbgt_d,
+    eop_cbgt_r: thread_cbgt_r,
+    eop_dbnz:   thread_dbnz
+}
+
+## Run results
+# Reasons for aqasm.run() to stop
+RUN_STEPS      = "steps"
+RUN_HALT       = "halt"
+RUN_BREAKPOINT = "breakpoint"
+RUN_DEADLINE   = "deadline"
+
+# Number of instructions aqasm.run() runs between deadline checks
+RUN_CHUNK = 1024
+
+## Machine snapshots
+class machinestate:
+    def __init__(self, cpu):
+        # Memory snapshot, from the memory backend
+        self.memory = cpu.memory.snapshot()
+        # Registers, pending IRQs and IVT
+        self.reg = list(cpu.reg)
+        self.irq = cpu.irq.state()
+        self.ivt = list(cpu.ivt)
+        # Program counter and flags
+        self.pc = cpu.pc
+        self.zero = cpu.zero
+        self.sign = cpu.sign
+        self.halt = cpu.halt
+        self.blast = cpu.blast
+        self.intc = cpu.intc
+        self.intpc = cpu.intpc
+        self.intzero = cpu.intzero
+        self.intsign = cpu.intsign
+
+## Execution engines
+ENGINE_THREADED = "threaded"
+ENGINE_BLOCKS   = "blocks"
+ENGINE_TRACES   = "traces"
+engines = (ENGINE_THREADED, ENGINE_BLOCKS, ENGINE_TRACES)
+
+class runresult:
+    def __init__(self, steps, reason, elapsed):
+        # Number of instructions retired
+        self.steps = steps
+        # Why the run stopped. One of the RUN_* values
+        self.reason = reason
+        # Wall clock time taken, in seconds
+        self.elapsed = elapsed
+
+# Largest word size, in bytes
+BYTES_PER_WORD_MAX = 8
+
+# Largest memory size, in words, used when no memory size is given. Bigger word
+# sizes can address far more memory than can be allocated
+MEM_WORDS_DEFAULT_MAX = 2 ** 24
+
 ## Interpreter class for emulating a cpu running AQA assembly
 class aqasm:
-    def __init__(self, code = "", extensions = False, bytesPerWord = 1, memWords = None):
+    def __init__(self, code = "", extensions = False, bytesPerWord = 1, memWords = None, alu = "native", engine = "threaded", memory = "flat", memoryFile = None, floatTables = True, fpu = "native", fuse = False, fixedFraction = None):
         self.ioReset()
-        self.compile_code(code, extensions, bytesPerWord, memWords)
+        self.compiled = []
+        # Interrupt controller
+        self.irq = interrupts.interruptcontroller()
+        # Stack region, as a (base, limit) tuple, or None for the default
+        self.stackRegion = None
+        # Set by compile_code
+        self.bytesPerWord = None
+        self.wordOps = {}
+        self.fpuSelect(fpu)
+        # Whether float lookup tables are used for the word sizes that have them
+        self.floatTables = floatTables
+        self.memory = None
+        self.memorySelect(memory, memoryFile)
+        self.engineSelect(engine)
+        self.aluSelect(alu)
+        self.compile_code(code, extensions, bytesPerWord, memWords, fuse, fixedFraction)
+
+    def aluSelect(self, alu):
+        # Select the ALU backend used for integer arithmetic. Also used by the
+        # floating point utilities for their mantissa arithmetic
+        if alu not in alus:
+            raise ValueError("Hardware error: Unknown ALU backend '{:s}'".format(alu))
+        self.alu = alu
+        for name, func in alus[alu].items():
+            setattr(self, name, func)
+        # Threaded code captures the ALU utilities, so it needs rebuilding
+        self.threadCode()
+
+    def memorySelect(self, backend, filename = None):
+        # Select the memory backend. "flat" allocates all memory up front,
+        # "paged" allocates pages on the first write to them and "mapped" maps
+        # the file with the given name, whose contents become the initial
+        # memory contents. Memory is reallocated with the new backend on the
+        # next reset
+        if backend not in memory.memories:
+            raise ValueError("Hardware error: Unknown memory backend '{:s}'".format(backend))
+        if backend == "mapped" and filename == None:
+            raise ValueError("Hardware error: Memory mapped backend needs a file")
+        self.memoryBackend = backend
+        self.memoryFile = filename
+
+    def fpuSelect(self, fpu):
+        # Select the FPU backend used for float arithmetic
+        if fpu not in fpus:
+            raise ValueError("Hardware error: Unknown FPU backend '{:s}'".format(fpu))
+        self.fpu = fpu
+        # Float utilities depend on the word size, so they are only selected
+        # once there is one. Threaded code captures them, so it needs rebuilding
+        if self.bytesPerWord != None:
+            self.floatSelect()
+            self.threadCode()
+
+    def floatSelect(self):
+        # Select the float utilities for the FPU backend and word size. Word
+        # sizes with float lookup tables use them, unless disabled
+        if self.floatTables:
+            self.floatTable = floattables.float_table(self.bytesPerWord)
+        else:
+            self.floatTable = None
+        for name, func in fpus[self.fpu].items():
+            setattr(self, name, func)
+        if self.floatTable != None and self.floatTable.add != None:
+            self.float_add = oputil_float_add_table
+            self.float_mul = oputil_float_mul_table
+            self.float_div = oputil_float_div_table
+            self.float_cmp = oputil_float_cmp_table
+
+    def engineSelect(self, engine):
+        # Select the execution engine used by run(). "threaded" runs one
+        # threaded closure per instruction, "blocks" runs basic blocks
+        # compiled to python functions and "traces" also compiles hot loops
+        # into traces. step() always runs a single threaded closure
+        if engine not in engines:
+            raise ValueError("Hardware error: Unknown execution engine '{:s}'".format(engine))
+        self.engine = engine
+        # The block table depends on the engine
+        self.threadCode()
+
+    def threadCode(self):
+        # Build the threaded closure for each compiled line
+        self.threaded = [None] * len(self.compiled)
+        for pc in range(len(self.compiled)):
+            line = self.compiled[pc]
+            if line == None:
+                builder = thread_noop
+            else:
+                builder = threaders.get(line[0], thread_generic)
+            self.threaded[pc] = builder(self, line, pc)
+
+        # Block table. Each entry is a tuple with the block function starting at
+        # that line and its number of instructions, or None if not compiled yet
+        if self.engine == ENGINE_BLOCKS or self.engine == ENGINE_TRACES:
+            self.blocks = [None] * len(self.compiled)
+            self.blockLeaders = blockcompiler.block_leaders(self.compiled)
+        else:
+            self.blocks = None
 
-    def compile_code(self, code, extensions = False, bytesPerWord = 1, memWords = None):
+        # Trace table, indexed by loop header line, and backward branch counts
+        if self.engine == ENGINE_TRACES:
+            self.traces = [None] * len(self.compiled)
+            self.traceCounts = [0] * len(self.compiled)
+        else:
+            self.traces = None
+        # Path being recorded, or None if not recording
+        self.traceRecording = None
+        # Trace statistics: number of traces compiled, number of guard exits
+        # and wall clock time spent running traces, in seconds
+        self.traceCompiles = 0
+        self.traceExits = 0
+        self.traceTime = 0
+
+    def compile_code(self, code, extensions = False, bytesPerWord = 1, memWords = None, fuse = False, fixedFraction = None):
+        if bytesPerWord < 1 or bytesPerWord > BYTES_PER_WORD_MAX:
+            raise ValueError("Word size must be between 1 and {:d} bytes".format(BYTES_PER_WORD_MAX))
         if memWords == None:
-            memWords = 2 ** (bytesPerWord * 8)
+            # Every address, unless that is too much memory to allocate
+            memWords = min(2 ** (bytesPerWord * 8), MEM_WORDS_DEFAULT_MAX)
         else:
             if memWords < 0:
                 raise ValueError("Memory size cannot be negative")
             if memWords > 2 ** (bytesPerWord * 8):
                 raise ValueError("Memory size cannot be greater than 2 ^ wordLength, since it becomes unaddressable")
+        # Half the word is fraction bits by default
+        if fixedFraction == None:
+            fixedFraction = bytesPerWord * 4
+        elif fixedFraction < 0 or fixedFraction >= bytesPerWord * 8:
+            raise ValueError("Fixed point fraction bits must be between 0 and {:d}".format(bytesPerWord * 8 - 1))
         # self.extensions has no effect, it is just so that outer code can check
         # whether the code was compiled with extensions or not
         self.extensions = extensions
+        # Whether branch idioms were fused into compare and branch instructions.
+        # Fused code retires less instructions for the same work
+        self.fuse = fuse
         # Number of bytes and bits per word
         self.bytesPerWord = bytesPerWord
         self.wordLength = bytesPerWord * 8
@@ -1574,6 +4018,8 @@ class aqasm:
         self.uintMax = 2 ** self.wordLength - 1
         self.intMin = -(2 ** (self.wordLength - 1))
         self.intMax = 2 ** (self.wordLength - 1) - 1
+        # ALU utilities specialized for the word size
+        self.wordOps = word_ops(bytesPerWord)
         # Floating point helper values
         self.exponentLen = 3 * bytesPerWord
         self.fractionLen = 5 * bytesPerWord - 1
@@ -1588,15 +4034,19 @@ class aqasm:
         self.posInf = self.exponentMask
         self.negInf = self.posInf | self.signBitMask
         self.defaultNan = 2 ** (self.exponentLen + self.fractionLen) - 1
-        self.lntwo = aqasmutil_num2float(0.6931471806, self.exponentLen, self.fractionLen)
-        self.lntwo_rec = aqasmutil_num2float(1.442695041, self.exponentLen, self.fractionLen)
+        # Fixed point fraction bits
+        self.fixedFraction = fixedFraction
+        # Series constants for FEXP and FLOG
+        self.floatSeries = floattables.float_series(self.exponentLen, self.fractionLen)
+        # Float utilities for the float format
+        self.floatSelect()
         # Number of words and bytes available for memory
         self.memWords = memWords
         self.memBytes = memWords * bytesPerWord
         # Passed source code split into lines
         self.code = code.splitlines()
         # Code passed to compiler
-        self.compiled, times = compiler.compile_asm(self.code, extensions, self.intMin, self.intMax, self.memWords - 1, self.bytesPerWord)
+        self.compiled, times = compiler.compile_asm(self.code, extensions, self.intMin, self.intMax, self.memWords - 1, self.bytesPerWord, fuse, fixedFraction)
         # Reset all flags and memory
         self.reset()
         # Halt if no instructions or NOOPs
@@ -1605,12 +4055,25 @@ class aqasm:
         return times
 
     def reset(self):
-        # Memory
-        self.mem = zeros(self.memBytes, dtype=uint8)
-        # Registers
-        self.reg = [0] * 13
-        # IRQ
-        self.irq = deque()
+        # Memory. mem is the memory backend's byte view, used by the memory
+        # viewer. Memory is only reallocated if its configuration changed, else
+        # only the pages written to are cleared. Memory mapped backends clear
+        # to their file's image. Memory being replaced is cleared first, so
+        # the image is kept whatever the new configuration is
+        if memory.memutil_reusable(self.memory, self.memoryBackend, self.memWords, self.bytesPerWord, self.memoryFile):
+            self.memory.clear()
+        else:
+            if self.memory != None:
+                self.memory.clear()
+                self.memory.flush()
+            self.memory = memory.memories[self.memoryBackend](self.memWords, self.bytesPerWord, self.memoryFile)
+        self.mem = self.memory.mem
+        # Registers, with the stack pointer (R13) at the top of the stack
+        self.reg = [0] * 14
+        self.stackReset()
+        # IRQ. The interrupt controller is kept, since device threads may
+        # hold it, and only its pending IRQs are dropped
+        self.irq.clear()
         # IVT. Reset to default interrupt vector table. A none value represents
         # the default action for that IRQ number. For division by 0 and faults,
         # the CPU halts and throws an exception, and for all other IRQ numbers,
@@ -1632,70 +4095,264 @@ class aqasm:
         self.intpc = 0
         self.intzero = False
         self.intsign = False
+        # Threaded code, bound to the new registers
+        self.threadCode()
 
     def step(self):
         # Do nothing if CPU halted or if there are no instructions
         if self.halt or len(self.compiled) == 0:
             return
 
-        # Run instruction if not a NOOP (empty line)
-        if self.compiled[self.pc] != None:
-            self.compiled[self.pc][0](self)
+        # Run instruction. Its closure returns the next pc, so there is no need
+        # to increment the program counter or check the branch last flag
+        pc = self.threaded[self.pc]()
 
-            # "Short" CPU to preserve flags
-            if self.halt:
-                return
+        # "Short" CPU to preserve flags
+        if pc == THREAD_HALT:
+            return
+        self.pc = pc
 
-        # Increment program counter if branch last flag wasn't set
-        if not self.blast:
-            self.pc += 1
-
-        # Clear branch last flag
-        self.blast = False
-        
-        # If there are interrupts available, start the interrupt service routine
-        # by preparing all flags for the next cycle, if there is a handler.
-        # Don't do this if already in an ISR cycle
-        if not self.intc and len(self.irq) > 0:
-            # Pop IRQ
-            irq = self.irq.popleft()
-            isr_pc = self.ivt[irq]
-
-            # Check if the default handler should be run
-            if isr_pc == None:
-                # If the IRQ is a fault, then throw the corresponding exception
-                # and halt, else, NOP
-                if irq == IRQ_DIVISION_BY_ZERO:
-                    self.halt = True
-                    raise ValueError("Division by 0: Default handler for IRQ {:d} called. Halting".format(IRQ_DIVISION_BY_ZERO))
-                elif irq == IRQ_PAGE_FAULT:
-                    self.halt = True
-                    raise ValueError("Page fault: Default handler for IRQ {:d} called. Halting".format(IRQ_PAGE_FAULT))
-                elif irq == IRQ_GENERAL_PROTECTION_FAULT:
-                    self.halt = True
-                    raise ValueError("General protection fault: Default handler for IRQ {:d} called. Halting".format(IRQ_GENERAL_PROTECTION_FAULT))
-                elif irq == IRQ_INVALID_ARITHMETIC:
-                    self.halt = True
-                    raise ValueError("Invalid arithmetic operand: Default handler for IRQ {:d} called. Halting".format(IRQ_INVALID_ARITHMETIC))
-            else:
-                self.intc = True
-                self.intpc = self.pc
-                self.pc = isr_pc
-                self.intzero = self.zero
-                self.intsign = self.sign
+        # Start the interrupt service routine if there are interrupts available
+        if self.irq.flag and not self.intc:
+            self.irqService()
 
         # If past all code, halt CPU
         if self.pc >= len(self.compiled):
             self.halt = True
 
+    def run(self, maxSteps = None, until = None, breakpoints = None):
+        # Run instructions until the CPU halts, maxSteps instructions have run,
+        # the wall clock time passes until (a time() value), or the pc reaches
+        # a line in the breakpoints set. The line the run starts at is not
+        # checked, so that a run stopped at a breakpoint can be resumed.
+        # Returns a runresult
+        start = time()
+        if self.halt or len(self.compiled) == 0:
+            return runresult(0, RUN_HALT, 0)
+
+        # Keep everything the inner loop needs in locals. The pc is only
+        # written back on IRQ entry and on exit
+        threaded = self.threaded
+        end = len(threaded)
+        irq = self.irq
+        checkBreakpoints = bool(breakpoints)
+        # Breakpoints can be in the middle of a block, so runs with breakpoints
+        # always step through the threaded code
+        blocks = None if checkBreakpoints else self.blocks
+        traces = self.traces
+        pc = self.pc
+        steps = 0
+        reason = None
+        try:
+            while reason == None:
+                # Run in chunks, checking the step limit and deadline between
+                # chunks instead of after every instruction
+                chunkEnd = steps + RUN_CHUNK
+                if maxSteps != None and chunkEnd > maxSteps:
+                    chunkEnd = maxSteps
+                while blocks != None and steps < chunkEnd:
+                    retired = 0
+                    if traces != None and traces[pc] != None:
+                        traceStart = time()
+                        nextpc, retired = traces[pc](chunkEnd - steps)
+                        self.traceTime += time() - traceStart
+                    if retired == 0:
+                        block = blocks[pc]
+                        if block == None:
+                            block = blocks[pc] = blockcompiler.block_compile(self, pc)
+                        if steps + block[1] > chunkEnd:
+                            # Block doesn't fit in the chunk. Step the rest of
+                            # the chunk so that the step limit is exact
+                            break
+                        nextpc, retired = block[0]()
+                        # Only backward branches and recordings are profiled
+                        if traces != None and (nextpc < pc + retired or self.traceRecording != None):
+                            tracecompiler.trace_profile(self, pc, nextpc, retired)
+                    steps += retired
+                    if nextpc == THREAD_HALT:
+                        pc = self.pc
+                        reason = RUN_HALT
+                        break
+                    pc = nextpc
+                    if irq.flag and not self.intc:
+                        self.pc = pc
+                        self.irqService()
+                        pc = self.pc
+                    if pc >= end:
+                        self.halt = True
+                        reason = RUN_HALT
+                        break
+                while reason == None and steps < chunkEnd:
+                    nextpc = threaded[pc]()
+                    steps += 1
+                    if nextpc == THREAD_HALT:
+                        reason = RUN_HALT
+                        break
+                    pc = nextpc
+                    if irq.flag and not self.intc:
+                        self.pc = pc
+                        self.irqService()
+                        pc = self.pc
+                    if pc >= end:
+                        self.halt = True
+                        reason = RUN_HALT
+                        break
+                    if checkBreakpoints and pc in breakpoints:
+                        reason = RUN_BREAKPOINT
+                        break
+
+                if reason == None:
+                    if steps == maxSteps:
+                        reason = RUN_STEPS
+                    elif until != None and time() >= until:
+                        reason = RUN_DEADLINE
+        finally:
+            self.pc = pc
+            # Deliver buffered output, so that devices are up to date
+            if self.ioBuffered:
+                self.ioFlush()
+        return runresult(steps, reason, time() - start)
+
+    def read_words(self, addr, n):
+        # Returns a numpy uint64 array with the n words starting at word address
+        # addr
+        if addr < 0 or n < 0 or addr + n > self.memWords:
+            raise ValueError("Memory error: Cannot read {:d} words at address {:d}".format(n, addr))
+        return self.memory.read_words(addr, n)
+
+    def write_words(self, addr, array):
+        # Writes the words of a numpy array (or any sequence of integers) to
+        # memory, starting at word address addr. Words are truncated to the word
+        # length
+        values = memory.memutil_values(array)
+        if addr < 0 or addr + len(values) > self.memWords:
+            raise ValueError("Memory error: Cannot write {:d} words at address {:d}".format(len(values), addr))
+        self.memory.write_words(addr, values & self.uintMax)
+
+    def snapshot(self):
+        # Returns a machinestate with the registers, flags, IVT, pending IRQs and
+        # memory. Only the memory pages written since the previous snapshot are
+        # copied
+        return machinestate(self)
+
+    def restore(self, state):
+        # Restores a machinestate returned by snapshot(). Registers are restored
+        # in place, since threaded code is bound to them
+        self.memory.restore(state.memory)
+        self.reg[:] = state.reg
+        self.irq.restore(state.irq)
+        self.ivt[:] = state.ivt
+        self.pc = state.pc
+        self.zero = state.zero
+        self.sign = state.sign
+        self.halt = state.halt
+        self.blast = state.blast
+        self.intc = state.intc
+        self.intpc = state.intpc
+        self.intzero = state.intzero
+        self.intsign = state.intsign
+
+    def residentPages(self):
+        # Number of memory pages allocated by the memory backend
+        return self.memory.resident_pages()
+
+    def memoryFlush(self):
+        # Write memory to its backing file, for memory mapped backends. The
+        # flushed contents become the image that reset() restores
+        self.memory.flush()
+
+    def memoryClear(self):
+        # Zero all memory. Unlike reset(), this also zeroes the image of memory
+        # mapped backends, and with it their file
+        self.memory.wipe()
+
+    def stackConfigure(self, base = None, limit = None):
+        # Set the stack region to the words from base up to, but excluding,
+        # limit, and reset SP to the top of it. Without a region, the stack is
+        # all of memory, up to the last word (excluded) if memory is the whole
+        # address space, since SP can't hold the address after it
+        if base == None and limit == None:
+            self.stackRegion = None
+        else:
+            if base == None or limit == None:
+                raise ValueError("Hardware error: Stack region needs both a base and a limit")
+            if base < 0 or limit < base or limit > min(self.memWords, self.uintMax):
+                raise ValueError("Hardware error: Stack region {:d} to {:d} outside of memory".format(base, limit))
+            self.stackRegion = (base, limit)
+        self.stackReset()
+
+    def stackReset(self):
+        # Apply the stack region and empty the stack. A region which no longer
+        # fits in memory, after recompiling with less memory, falls back to the
+        # default
+        limit = min(self.memWords, self.uintMax)
+        if self.stackRegion == None or self.stackRegion[1] > limit:
+            self.stackBase = 0
+            self.stackLimit = limit
+        else:
+            self.stackBase, self.stackLimit = self.stackRegion
+        self.reg[REG_SP] = self.stackLimit
+
+    def raise_irq(self, irq):
+        # Raise an IRQ from outside the cpu, such as from a device thread. Safe
+        # to call from any thread, even while the cpu is running
+        if irq > 127 or irq < 0:
+            raise ValueError("Hardware error: IRQ {:d} out of range".format(irq))
+        self.irq.raise_irq(irq)
+
+    def irqConfigure(self, priority = None, coalesce = False):
+        # Configure the interrupt controller's priority order (every IRQ
+        # number, from first serviced to last) and whether repeated IRQs are
+        # coalesced. Clears pending IRQs
+        self.irq.configure(priority, coalesce)
+
+    def irqService(self):
+        # Start the interrupt service routine by preparing all flags for the
+        # next cycle, if there is a handler. Must not be called if already in
+        # an ISR cycle
+        # Take the pending IRQ with the highest priority
+        irq = self.irq.take()
+        if irq == None:
+            return
+        isr_pc = self.ivt[irq]
+
+        # Check if the default handler should be run
+        if isr_pc == None:
+            # If the IRQ is a fault, then throw the corresponding exception
+            # and halt, else, NOP
+            if irq == IRQ_DIVISION_BY_ZERO:
+                self.halt = True
+                raise ValueError("Division by 0: Default handler for IRQ {:d} called. Halting".format(IRQ_DIVISION_BY_ZERO))
+            elif irq == IRQ_PAGE_FAULT:
+                self.halt = True
+                raise ValueError("Page fault: Default handler for IRQ {:d} called. Halting".format(IRQ_PAGE_FAULT))
+            elif irq == IRQ_GENERAL_PROTECTION_FAULT:
+                self.halt = True
+                raise ValueError("General protection fault: Default handler for IRQ {:d} called. Halting".format(IRQ_GENERAL_PROTECTION_FAULT))
+            elif irq == IRQ_INVALID_ARITHMETIC:
+                self.halt = True
+                raise ValueError("Invalid arithmetic operand: Default handler for IRQ {:d} called. Halting".format(IRQ_INVALID_ARITHMETIC))
+            elif irq == IRQ_STACK_FAULT:
+                self.halt = True
+                raise ValueError("Stack fault: Default handler for IRQ {:d} called. Halting".format(IRQ_STACK_FAULT))
+        else:
+            self.intc = True
+            self.intpc = self.pc
+            self.pc = isr_pc
+            self.intzero = self.zero
+            self.intsign = self.sign
+
     def ioReset(self):
-        # Reset I/O configuration table
+        # Reset I/O configuration table, input queues and output buffers
         self.ioConfig = [None] * 128
         self.ioInput = [None] * 128
+        # Output buffers of buffered ports, by port, and a list of them all
+        self.ioBuffers = [None] * 128
+        self.ioBuffered = []
 
         for i in range(0, 128):
             self.ioConfig[i] = (None, False)
-            self.ioInput[i] = []
+            self.ioInput[i] = ioports.inputqueue()
 
     def ioRegister(self, port, callback):
         # Add callback to I/O output at port, unless port already taken
@@ -1703,16 +4360,70 @@ class aqasm:
             raise ValueError("Hardware error: Invalid port number or already taken")
         self.ioConfig[port] = (callback, True)
 
-    def ioInputPush(self, port, data):
-        # Add input data at port
+    def ioRegisterBuffered(self, port, callback, batchSize = 256, capture = None):
+        # Add callback to I/O output at port in buffered mode, unless port
+        # already taken. The callback is called with a list of output values
+        # (see ioports.outputbuffer). Ports without a callback have nothing to
+        # deliver to, so they aren't buffered and output is dropped like with
+        # ioRegister
+        self.ioRegister(port, callback)
+        if callback == None:
+            return
+        self.ioBuffers[port] = ioports.outputbuffer(callback, batchSize, capture)
+        self.ioBuffered.append(self.ioBuffers[port])
+
+    def ioFlush(self, port = None):
+        # Deliver the buffered output of a port, or of all buffered ports
+        if port == None:
+            for buffer in self.ioBuffered:
+                buffer.flush()
+        elif port < 0 or port > 127 or self.ioConfig[port][1] == False:
+            raise ValueError("Hardware error: Invalid port number or not registered")
+        elif self.ioBuffers[port] != None:
+            self.ioBuffers[port].flush()
+
+    def ioInputPush(self, port, data, block = False, timeout = None):
+        # Add input data at port. Returns whether it was added, which is only
+        # false if the port's input queue is full (see ioInputConfigure)
+        if port < 0 or port > 127 or self.ioConfig[port][1] == False:
+            raise ValueError("Hardware error: Invalid port number or not registered")
+        return self.ioInput[port].push(data, block, timeout)
+
+    def ioInputPushMany(self, port, values, block = False, timeout = None):
+        # Add input data at port from an iterable, numpy array or byte buffer
+        # (one value per byte). Returns the number of values added. If the
+        # port's input queue fills up, stops, or waits for IN to make space if
+        # blocking. Safe to call from device threads
+        if port < 0 or port > 127 or self.ioConfig[port][1] == False:
+            raise ValueError("Hardware error: Invalid port number or not registered")
+        return self.ioInput[port].push_many(values, block, timeout)
+
+    def ioInputConfigure(self, port, capacity = None, low = None, high = None, onLow = None, onHigh = None):
+        # Set the capacity of a port's input queue (None for unbounded) and its
+        # low and high watermarks. onHigh is called when pushes fill the queue
+        # up to the high watermark and onLow when IN drains it down to the low
+        # watermark, with the number of queued values
         if port < 0 or port > 127 or self.ioConfig[port][1] == False:
             raise ValueError("Hardware error: Invalid port number or not registered")
-        self.ioInput[port].append(data)
+        self.ioInput[port].configure(capacity, low, high, onLow, onHigh)
 
     def ioOutput(self, port, data):
-        # Call callback with output data, unless I/O is registered but doesn't
-        # have a callback
+        # Call callback with output data, or buffer it if the port is
+        # buffered, unless I/O is registered but doesn't have a callback
         if port < 0 or port > 127 or self.ioConfig[port][1] == False:
             raise ValueError("Hardware error: Invalid port number or not registered")
-        if self.ioConfig[port][0] != None:
+        if self.ioBuffers[port] != None:
+            self.ioBuffers[port].append(data)
+        elif self.ioConfig[port][0] != None:
             self.ioConfig[port][0](data)
+
+    def ioOutputBlock(self, port, values):
+        # Send a numpy array of output values to port in one call. Unbuffered
+        # callbacks are called with the array. Buffered ports deliver what
+        # they buffered first, so that order is kept
+        if port < 0 or port > 127 or self.ioConfig[port][1] == False:
+            raise ValueError("Hardware error: Invalid port number or not registered")
+        if self.ioBuffers[port] != None:
+            self.ioBuffers[port].extend(values)
+        elif self.ioConfig[port][0] != None:
+            self.ioConfig[port][0](values)
@@ -0,0 +1,93 @@
+from threading import Lock
+
+## Interrupt controller
+# Keeps the pending IRQs of a cpu in a 128-bit bitmap, with one bit per IRQ
+# number. Bits are ordered by priority instead of by IRQ number, so the IRQ to
+# service next is always the lowest set bit. The flag attribute is true while
+# any IRQ is pending, and is what run loops test after every instruction, so
+# they only take the slow path (irqService) when it is set.
+# Without coalescing, every time an IRQ is raised it is serviced once, like a
+# queue. With coalescing, raising an IRQ which is already pending does nothing.
+# IRQs can be raised from other threads (device threads, GUI) with raise_irq
+
+# Number of IRQs
+IRQ_COUNT = 128
+
+class interruptcontroller:
+    def __init__(self, priority = None, coalesce = False):
+        # Guards every change to the pending IRQs
+        self.lock = Lock()
+        self.configure(priority, coalesce)
+
+    def configure(self, priority = None, coalesce = False):
+        # Set the priority order, a sequence with every IRQ number from the
+        # first to be serviced to the last (lowest numbers first by default),
+        # and whether repeated IRQs are coalesced. Clears pending IRQs
+        if priority == None:
+            priority = range(IRQ_COUNT)
+        priority = list(priority)
+        if sorted(priority) != list(range(IRQ_COUNT)):
+            raise ValueError("Hardware error: IRQ priority order must have every IRQ number from 0 to {:d} once".format(IRQ_COUNT - 1))
+        with self.lock:
+            # IRQ number at each bitmap position, and bitmap position of each
+            # IRQ number
+            self.order = priority
+            self.rank = [0] * IRQ_COUNT
+            for position, irq in enumerate(priority):
+                self.rank[irq] = position
+            self.coalesce = coalesce
+        self.clear()
+
+    def clear(self):
+        # Drop all pending IRQs
+        with self.lock:
+            self.pending = 0
+            # Number of times each pending IRQ was raised, without coalescing
+            self.counts = [0] * IRQ_COUNT
+            self.flag = False
+
+    def raise_irq(self, irq):
+        # Mark an IRQ as pending. Safe to call from any thread
+        with self.lock:
+            self.pending |= 1 << self.rank[irq]
+            if not self.coalesce:
+                self.counts[irq] += 1
+            self.flag = True
+
+    def take(self):
+        # Remove one occurrence of the pending IRQ with the highest priority
+        # and return its number, or None if no IRQ is pending
+        with self.lock:
+            if self.pending == 0:
+                return None
+            position = (self.pending & -self.pending).bit_length() - 1
+            irq = self.order[position]
+            if not self.coalesce:
+                self.counts[irq] -= 1
+                if self.counts[irq] > 0:
+                    return irq
+            self.pending &= ~(1 << position)
+            self.flag = self.pending != 0
+            return irq
+
+    def pending_irqs(self):
+        # List of pending IRQ numbers in service order, with repeats
+        with self.lock:
+            irqs = []
+            for position, irq in enumerate(self.order):
+                if (self.pending >> position) & 1:
+                    irqs.extend([irq] * max(self.counts[irq], 1))
+            return irqs
+
+    def state(self):
+        # Pending IRQs as a tuple, for machine snapshots
+        with self.lock:
+            return self.pending, list(self.counts)
+
+    def restore(self, state):
+        # Restore pending IRQs from a tuple returned by state(). The priority
+        # order and coalescing must not have changed
+        with self.lock:
+            self.pending = state[0]
+            self.counts[:] = state[1]
+            self.flag = self.pending != 0
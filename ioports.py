@@ -0,0 +1,169 @@
+from collections import deque
+from itertools import islice
+from threading import Condition
+from numpy import ndarray
+
+## Port input queues
+# Each port has a queue of input values, consumed in order by IN. Values are
+# pushed by devices, possibly from other threads, one at a time or in bulk from
+# any iterable, numpy array or byte buffer (one value per byte).
+# A queue can have a capacity. Pushes stop when the queue is full, returning
+# the number of values queued, or wait for IN to make space if blocking, which
+# lets device threads feed long input streams without queueing all of it.
+# A queue can also have watermarks. The high watermark callback is called when
+# a push makes the number of queued values reach the high watermark, and the
+# low watermark callback when IN makes it drop to the low watermark. Both are
+# called with the number of queued values
+
+# Marks the end of the values being pushed
+PUSH_END = object()
+
+class inputqueue:
+    def __init__(self):
+        self.values = deque()
+        # Guards the values. Notified when IN makes space
+        self.condition = Condition()
+        self.configure()
+
+    def __len__(self):
+        return len(self.values)
+
+    def configure(self, capacity = None, low = None, high = None, onLow = None, onHigh = None):
+        # Set the capacity (None for unbounded) and the watermarks with their
+        # callbacks (None to disable)
+        if capacity != None and capacity < 1:
+            raise ValueError("Hardware error: Input queue capacity must be at least 1")
+        with self.condition:
+            self.capacity = capacity
+            self.low = low
+            self.high = high
+            self.onLow = onLow
+            self.onHigh = onHigh
+            self.condition.notify_all()
+
+    def push_many(self, values, block = False, timeout = None):
+        # Queue values in order. Returns the number of values queued, which is
+        # less than the number of values if the queue filled up, or if blocking
+        # and timeout seconds passed without space being made
+        if isinstance(values, ndarray):
+            values = values.ravel().tolist()
+        values = iter(values)
+        count = 0
+        with self.condition:
+            if self.capacity == None:
+                queued = len(self.values)
+                self.values.extend(values)
+                count = len(self.values) - queued
+                self.check_high(queued)
+            else:
+                while True:
+                    free = self.capacity - len(self.values)
+                    if free > 0:
+                        queued = len(self.values)
+                        self.values.extend(islice(values, free))
+                        count += len(self.values) - queued
+                        self.check_high(queued)
+                        # Out of values
+                        if len(self.values) - queued < free:
+                            break
+                    else:
+                        # Full. Done if out of values, else wait for space
+                        value = next(values, PUSH_END)
+                        if value is PUSH_END:
+                            break
+                        if not block or not self.condition.wait_for(self.has_space, timeout):
+                            break
+                        self.values.append(value)
+                        count += 1
+                        self.check_high(len(self.values) - 1)
+        return count
+
+    def push(self, value, block = False, timeout = None):
+        # Queue one value. Returns whether it was queued
+        return self.push_many((value,), block, timeout) == 1
+
+    def pop(self):
+        # Dequeue the oldest value. The queue must not be empty
+        with self.condition:
+            value = self.values.popleft()
+            if self.capacity != None:
+                self.condition.notify_all()
+            if self.low != None and self.onLow != None and len(self.values) == self.low:
+                self.onLow(self.low)
+        return value
+
+    def check_high(self, queued):
+        # Call the high watermark callback if the number of queued values went
+        # from queued up to the high watermark or above
+        if self.high != None and self.onHigh != None and queued < self.high <= len(self.values):
+            self.onHigh(len(self.values))
+
+    def pop_many(self, n):
+        # Dequeue the n oldest values as a list, or None (dequeuing nothing) if
+        # there are less than n values
+        with self.condition:
+            before = len(self.values)
+            if before < n:
+                return None
+            values = [self.values.popleft() for i in range(n)]
+            if self.capacity != None:
+                self.condition.notify_all()
+            if self.low != None and self.onLow != None and before > self.low >= len(self.values):
+                self.onLow(len(self.values))
+        return values
+
+    def has_space(self):
+        return self.capacity == None or len(self.values) < self.capacity
+
+    def clear(self):
+        # Drop all queued values
+        with self.condition:
+            self.values.clear()
+            self.condition.notify_all()
+
+## Port output buffers
+# Ports registered in buffered mode don't call their device for every OUT.
+# Output values are kept in the port's buffer and delivered to the device's
+# callback as a list, once batchSize values are buffered, when aqasm.run()
+# returns, or when the buffer is flushed with aqasm.ioFlush(). Devices which
+# need the machine's state at the time of the OUT (like memory the value
+# points to) can pass a capture function, which is called with each value
+# during the OUT and returns what is buffered instead, or None to buffer
+# nothing
+
+class outputbuffer:
+    def __init__(self, callback, batchSize, capture = None):
+        if batchSize < 1:
+            raise ValueError("Hardware error: Output batch size must be at least 1")
+        self.callback = callback
+        self.batchSize = batchSize
+        self.capture = capture
+        self.values = []
+
+    def append(self, value):
+        # Buffer an output value, delivering the batch if it is full
+        if self.capture != None:
+            value = self.capture(value)
+            if value == None:
+                return
+        self.values.append(value)
+        if len(self.values) >= self.batchSize:
+            self.flush()
+
+    def extend(self, values):
+        # Buffer a numpy array of output values. Without a capture function,
+        # the buffered values are delivered and the array is delivered as its
+        # own batch
+        if self.capture != None:
+            for value in values.tolist():
+                self.append(value)
+        else:
+            self.flush()
+            self.callback(values)
+
+    def flush(self):
+        # Deliver the buffered values, if any
+        if len(self.values) > 0:
+            values = self.values
+            self.values = []
+            self.callback(values)
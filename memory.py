@@ -0,0 +1,372 @@
+from numpy import zeros, uint8, uint64, arange, asarray, frombuffer, bitwise_or, memmap, ndarray
+
+## Memory backends
+# A backend stores memWords words of bytesPerWord bytes each. Addresses passed
+# to a backend are word addresses which have already been checked to be in
+# range, and stored values have already been truncated to the word length.
+# Every backend has the following members:
+# load(addr)               - Returns the word at addr
+# store(addr, val)         - Stores a word at addr
+# read_words(addr, n)      - Returns a native uint64 numpy array with n words
+#                            starting at addr, whatever the backend
+# write_words(addr, array) - Writes a numpy array of words starting at addr
+# copy_words(dst, src, n)  - Copies n words from src to dst. Overlapping ranges
+#                            are copied as if through a temporary buffer
+# fill_words(addr, val, n) - Stores val in the n words starting at addr
+# resident_pages()         - Number of pages of PAGE_WORDS words allocated
+# clear()                  - Returns memory to its reset state, which is all
+#                            zeroes unless the backend has a backing file
+# wipe()                   - Zeroes all memory, including the reset state
+# snapshot()               - Returns a memsnapshot of the memory's contents
+# restore(snapshot)        - Restores the contents saved in a memsnapshot
+# flush()                  - Writes memory to its backing file, if any
+# mem                      - Byte view, indexable by byte offset. Used by the
+#                            memory viewer. Writes through it are not tracked,
+#                            so it must be treated as read only
+# Backends are created with the number of words, bytes per word and the name of
+# the backing file, which is None for backends without one
+
+# Stores (and writes) mark the pages they touch as dirty. Clearing memory only
+# zeroes pages touched since the previous clear, and snapshots only copy the
+# pages written since the previous snapshot, sharing the copies of all other
+# pages with it. Restoring the latest snapshot only rewrites the pages written
+# since it was taken
+
+# Numpy dtypes of big endian words, by number of bytes per word
+word_dtypes = {1: ">u1", 2: ">u2", 4: ">u4", 8: ">u8"}
+
+# Number of words per page. Must be a power of 2
+PAGE_SHIFT = 12
+PAGE_WORDS = 2 ** PAGE_SHIFT
+PAGE_MASK = PAGE_WORDS - 1
+
+def memutil_shifts(bytesPerWord):
+    # Returns the shift of each byte in a big endian word, most significant
+    # first
+    return arange(bytesPerWord - 1, -1, -1, dtype=uint64) * 8
+
+def memutil_join_words(wordBytes, bytesPerWord):
+    # Combines a flat uint8 array of big endian words into a uint64 array
+    wordBytes = wordBytes.reshape(-1, bytesPerWord).astype(uint64)
+    return bitwise_or.reduce(wordBytes << memutil_shifts(bytesPerWord), axis=1)
+
+def memutil_split_words(values, bytesPerWord):
+    # Splits a uint64 array of words into a flat uint8 array of big endian words
+    wordBytes = (values.reshape(-1, 1) >> memutil_shifts(bytesPerWord)) & 0xff
+    return wordBytes.astype(uint8).reshape(-1)
+
+class memsnapshot:
+    def __init__(self, memWords, bytesPerWord, pages):
+        # Memory configuration, which must match when restoring
+        self.memWords = memWords
+        self.bytesPerWord = bytesPerWord
+        # Copies of the pages which may be non-zero, by page number. Page
+        # copies are never modified, so snapshots can share them
+        self.pages = pages
+
+class trackedmemory:
+    # Dirty page tracking shared by the memory backends. Backends implement:
+    # page_copy(page)       - Returns a copy of a page
+    # page_write(page, src) - Writes a page copy back to a page
+    # page_zero(page)       - Zeroes a page
+    # And keep the following sets of page numbers:
+    # dirty   - Pages written since the last clear, snapshot or restore
+    # touched - Pages which may be non-zero, not counting dirty pages
+    def track_reset(self):
+        self.dirty = set()
+        self.touched = set()
+        # Latest snapshot taken or restored, or None if memory was cleared
+        # since then
+        self.latest = None
+
+    def track_words(self, addr, n):
+        # Mark the pages of n words starting at addr as dirty
+        if n > 0:
+            self.dirty.update(range(addr >> PAGE_SHIFT, ((addr + n - 1) >> PAGE_SHIFT) + 1))
+
+    def copy_words(self, dst, src, n):
+        # Reading everything first gives overlapping copies memmove semantics
+        self.write_words(dst, self.read_words(src, n))
+
+    def clear(self):
+        for page in self.touched | self.dirty:
+            self.page_zero(page)
+        self.track_reset()
+
+    def wipe(self):
+        self.clear()
+
+    def snapshot(self):
+        self.touched |= self.dirty
+        if self.latest != None:
+            # Share the pages not written since the latest snapshot
+            pages = dict(self.latest.pages)
+            for page in self.dirty:
+                pages[page] = self.page_copy(page)
+        else:
+            pages = {page: self.page_copy(page) for page in self.touched}
+        self.dirty = set()
+        self.latest = memsnapshot(self.memWords, self.bytesPerWord, pages)
+        return self.latest
+
+    def restore(self, snapshot):
+        if snapshot.memWords != self.memWords or snapshot.bytesPerWord != self.bytesPerWord:
+            raise ValueError("Memory error: Snapshot memory configuration does not match")
+        if snapshot is self.latest:
+            # Only pages written since the snapshot can differ from it
+            pages = self.dirty
+        else:
+            pages = self.touched | self.dirty | set(snapshot.pages)
+            self.touched = set(snapshot.pages)
+            self.latest = snapshot
+        for page in pages:
+            if page in snapshot.pages:
+                self.page_write(page, snapshot.pages[page])
+            else:
+                self.page_zero(page)
+        self.dirty = set()
+
+class flatmemory(trackedmemory):
+    # Contiguous memory, allocated up front. The word view is a big endian
+    # view over the same buffer as the byte view, so a load or store is a
+    # single indexed access. Word sizes without a numpy dtype convert the
+    # word's bytes instead
+    def __init__(self, memWords, bytesPerWord, filename = None):
+        self.memWords = memWords
+        self.bytesPerWord = bytesPerWord
+        self.filename = filename
+        self.mem = zeros(memWords * bytesPerWord, dtype=uint8)
+        self.make_views()
+
+    def make_views(self):
+        # Bytes per page
+        self.pageBytes = PAGE_WORDS * self.bytesPerWord
+        bytesPerWord = self.bytesPerWord
+        if bytesPerWord in word_dtypes:
+            self.words = self.mem.view(word_dtypes[bytesPerWord])
+            self.load = self.words.item
+            self.store = self.store_word
+        else:
+            self.words = None
+            self.load = self.load_bytes
+            self.store = self.store_bytes
+        self.track_reset()
+
+    def load_bytes(self, addr):
+        return int.from_bytes(self.mem[addr * self.bytesPerWord:(addr + 1) * self.bytesPerWord].tobytes(), "big")
+
+    def store_word(self, addr, val):
+        self.words[addr] = val
+        self.dirty.add(addr >> PAGE_SHIFT)
+
+    def store_bytes(self, addr, val):
+        self.mem[addr * self.bytesPerWord:(addr + 1) * self.bytesPerWord] = frombuffer(val.to_bytes(self.bytesPerWord, "big"), dtype=uint8)
+        self.dirty.add(addr >> PAGE_SHIFT)
+
+    def read_words(self, addr, n):
+        if self.words is not None:
+            return self.words[addr:addr + n].astype(uint64)
+        return memutil_join_words(self.mem[addr * self.bytesPerWord:(addr + n) * self.bytesPerWord], self.bytesPerWord)
+
+    def write_words(self, addr, values):
+        if self.words is not None:
+            self.words[addr:addr + len(values)] = values
+        else:
+            self.mem[addr * self.bytesPerWord:(addr + len(values)) * self.bytesPerWord] = memutil_split_words(values, self.bytesPerWord)
+        self.track_words(addr, len(values))
+
+    def copy_words(self, dst, src, n):
+        # Copy the bytes. Numpy copies overlapping slices through a temporary
+        # buffer
+        bytesPerWord = self.bytesPerWord
+        self.mem[dst * bytesPerWord:(dst + n) * bytesPerWord] = self.mem[src * bytesPerWord:(src + n) * bytesPerWord]
+        self.track_words(dst, n)
+
+    def fill_words(self, addr, val, n):
+        if self.words is not None:
+            self.words[addr:addr + n] = val
+        else:
+            # Broadcast the word's bytes to every word
+            self.mem[addr * self.bytesPerWord:(addr + n) * self.bytesPerWord].reshape(-1, self.bytesPerWord)[:] = frombuffer(val.to_bytes(self.bytesPerWord, "big"), dtype=uint8)
+        self.track_words(addr, n)
+
+    def resident_pages(self):
+        return (self.memWords + PAGE_MASK) >> PAGE_SHIFT
+
+    def flush(self):
+        pass
+
+    def page_copy(self, page):
+        return self.mem[page * self.pageBytes:(page + 1) * self.pageBytes].copy()
+
+    def page_write(self, page, src):
+        self.mem[page * self.pageBytes:(page + 1) * self.pageBytes] = src
+
+    def page_zero(self, page):
+        self.mem[page * self.pageBytes:(page + 1) * self.pageBytes] = 0
+
+class pagedmemory(trackedmemory):
+    # Sparse memory made of pages of PAGE_WORDS words, allocated on the first
+    # non-zero store to them. Loads from pages which were never allocated
+    # return 0. Pages are native uint64 arrays, so any word size works
+    def __init__(self, memWords, bytesPerWord, filename = None):
+        self.memWords = memWords
+        self.bytesPerWord = bytesPerWord
+        self.filename = filename
+        # Allocated pages, by page number
+        self.pages = {}
+        # The memory itself is indexable by byte offset
+        self.mem = self
+        self.track_reset()
+
+    def load(self, addr):
+        page = self.pages.get(addr >> PAGE_SHIFT)
+        if page is None:
+            return 0
+        return page.item(addr & PAGE_MASK)
+
+    def store(self, addr, val):
+        page = self.pages.get(addr >> PAGE_SHIFT)
+        if page is None:
+            # Zero stores to missing pages are no-ops
+            if val == 0:
+                return
+            page = self.pages[addr >> PAGE_SHIFT] = zeros(PAGE_WORDS, dtype=uint64)
+        page[addr & PAGE_MASK] = val
+        self.dirty.add(addr >> PAGE_SHIFT)
+
+    def read_words(self, addr, n):
+        # Copy page by page
+        values = zeros(n, dtype=uint64)
+        offset = 0
+        while offset < n:
+            pageAddr = (addr + offset) & PAGE_MASK
+            count = min(PAGE_WORDS - pageAddr, n - offset)
+            page = self.pages.get((addr + offset) >> PAGE_SHIFT)
+            if page is not None:
+                values[offset:offset + count] = page[pageAddr:pageAddr + count]
+            offset += count
+        return values
+
+    def write_words(self, addr, values):
+        # Copy page by page, skipping all zero chunks of missing pages
+        n = len(values)
+        offset = 0
+        while offset < n:
+            pageAddr = (addr + offset) & PAGE_MASK
+            count = min(PAGE_WORDS - pageAddr, n - offset)
+            chunk = values[offset:offset + count]
+            page = self.pages.get((addr + offset) >> PAGE_SHIFT)
+            if page is None and chunk.any():
+                page = self.pages[(addr + offset) >> PAGE_SHIFT] = zeros(PAGE_WORDS, dtype=uint64)
+            if page is not None:
+                page[pageAddr:pageAddr + count] = chunk
+                self.dirty.add((addr + offset) >> PAGE_SHIFT)
+            offset += count
+
+    def fill_words(self, addr, val, n):
+        # Fill page by page. Zero fills of missing pages are no-ops
+        offset = 0
+        while offset < n:
+            pageAddr = (addr + offset) & PAGE_MASK
+            count = min(PAGE_WORDS - pageAddr, n - offset)
+            page = self.pages.get((addr + offset) >> PAGE_SHIFT)
+            if page is None and val != 0:
+                page = self.pages[(addr + offset) >> PAGE_SHIFT] = zeros(PAGE_WORDS, dtype=uint64)
+            if page is not None:
+                page[pageAddr:pageAddr + count] = val
+                self.dirty.add((addr + offset) >> PAGE_SHIFT)
+            offset += count
+
+    def resident_pages(self):
+        return len(self.pages)
+
+    def flush(self):
+        pass
+
+    def page_copy(self, page):
+        if page in self.pages:
+            return self.pages[page].copy()
+        return None
+
+    def page_write(self, page, src):
+        if src is None:
+            self.page_zero(page)
+        else:
+            self.pages[page] = src.copy()
+
+    def page_zero(self, page):
+        # Missing pages are zero, so free the page instead
+        self.pages.pop(page, None)
+
+    def __len__(self):
+        return self.memWords * self.bytesPerWord
+
+    def __getitem__(self, offset):
+        # Byte at a byte offset
+        word = self.load(offset // self.bytesPerWord)
+        return (word >> ((self.bytesPerWord - 1 - offset % self.bytesPerWord) * 8)) & 0xff
+
+    def __setitem__(self, offset, val):
+        # Store a byte at a byte offset
+        addr = offset // self.bytesPerWord
+        shift = (self.bytesPerWord - 1 - offset % self.bytesPerWord) * 8
+        self.store(addr, (self.load(addr) & ~(0xff << shift)) | ((val & 0xff) << shift))
+
+class mappedmemory(flatmemory):
+    # Flat memory backed by a memory mapped file, which holds the memory's
+    # bytes. The file is created or extended with zeroes if it is too small,
+    # and its contents (the image) are the memory's reset state, so clearing
+    # memory restores the image instead of zeroing the file. A copy of the
+    # image's non-zero pages is kept to restore it from. Flushing makes the
+    # current contents the new image, which checkpoints memory, and wiping
+    # zeroes the file and the image. Other processes can map the same file to
+    # inspect memory. Writes reach the file when flushed, or when the
+    # operating system decides to
+    def __init__(self, memWords, bytesPerWord, filename = None):
+        if filename == None:
+            raise ValueError("Memory error: Memory mapped backend needs a file")
+        self.memWords = memWords
+        self.bytesPerWord = bytesPerWord
+        self.filename = filename
+        memBytes = memWords * bytesPerWord
+        with open(filename, "ab") as f:
+            if f.tell() < memBytes:
+                f.truncate(memBytes)
+        self.mem = memmap(filename, dtype=uint8, mode="r+", shape=(memBytes,))
+        self.make_views()
+        # Only the image's non-zero pages may be non-zero
+        self.touched = {page for page in range(self.resident_pages()) if self.mem[page * self.pageBytes:(page + 1) * self.pageBytes].any()}
+        self.imageSnapshot = flatmemory.snapshot(self)
+
+    def clear(self):
+        flatmemory.restore(self, self.imageSnapshot)
+
+    def wipe(self):
+        self.mem[:] = 0
+        self.track_reset()
+        self.imageSnapshot = flatmemory.snapshot(self)
+
+    def flush(self):
+        self.mem.flush()
+        self.imageSnapshot = flatmemory.snapshot(self)
+
+# Memory backends, by name
+memories = {
+    "flat":   flatmemory,
+    "paged":  pagedmemory,
+    "mapped": mappedmemory
+}
+
+def memutil_reusable(mem, backend, memWords, bytesPerWord, filename):
+    # Whether an existing backend has the given configuration, so that it can
+    # be cleared instead of created again
+    return mem != None and type(mem) is memories[backend] and mem.memWords == memWords and mem.bytesPerWord == bytesPerWord and mem.filename == filename
+
+def memutil_values(array):
+    # Converts a numpy array or sequence of integers to a uint64 array.
+    # Sequences are converted through python integers, since numpy converts
+    # sequences with integers above 2 ^ 63 to floats
+    if isinstance(array, ndarray):
+        return array.astype(uint64)
+    return asarray([value & 0xffffffffffffffff for value in array], dtype=uint64)
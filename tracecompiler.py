@@ -0,0 +1,144 @@
+import blockcompiler
+
+## Trace compiler
+# Optional execution engine built on top of the basic block engine. Backward
+# branches taken by blocks are counted per target line. Once a target (a loop
+# header) has been branched to TRACE_THRESHOLD times, the blocks executed from
+# it are recorded until the pc gets back to it, and the recorded path is
+# compiled into a single python function which keeps looping through it.
+# Conditional branches in the path become guards which exit the trace if the
+# branch goes the other way. Traces also exit when an IRQ is pending and after
+# port I/O. Traces are stored in the cpu's trace table (cpu.traces), indexed by
+# loop header line.
+
+# A trace function takes the maximum number of instructions it can retire and
+# returns a tuple with the next pc and the number of instructions retired. It
+# only retires whole iterations of the loop unless it exits through a guard.
+# If the budget doesn't fit a single iteration it retires nothing
+
+# Number of backward branches to a line before its loop is recorded
+TRACE_THRESHOLD = 32
+
+# Maximum number of lines in a trace. Longer paths are not compiled
+TRACE_MAX = 1024
+
+# Conditions of the conditional branch instructions, in template syntax
+branch_conditions = {
+    "op_beq_l": "{zero}",
+    "op_bne_l": "not {zero}",
+    "op_bgt_l": "not {sign} and not {zero}",
+    "op_blt_l": "{sign}"
+}
+
+# Instruction functions doing port I/O. Traces exit after them
+io_operations = {"eop_in_d", "eop_in_r", "eop_out_rd", "eop_out_rr", "eop_out_dd", "eop_out_dr", "eop_inb_d", "eop_inb_r", "eop_outb_d", "eop_outb_r"}
+
+# Source of a guard exit
+guard_exit = "cpu.traceExits += 1\nreturn ({0}, k + {1:d})"
+
+def trace_profile(cpu, start, nextpc, retired):
+    # Called by the run loop after each block ran, with the block's first line,
+    # the next pc it returned and the number of instructions it retired
+    if cpu.traceRecording != None:
+        path = cpu.traceRecording
+        # Abort on jumps out of the recorded path (IRQs), early block exits
+        # and paths too long to be worth compiling
+        if (path and start != path[-1][2]) or retired != cpu.blocks[start][1] or nextpc < 0 or len(path) >= TRACE_MAX:
+            cpu.traceRecording = None
+            return
+        path.append((start, retired, nextpc))
+        # Loop closed
+        if nextpc == path[0][0]:
+            cpu.traceRecording = None
+            trace_compile(cpu, path)
+    elif 0 <= nextpc < start + retired and cpu.traces[nextpc] == None:
+        # Backward branch
+        cpu.traceCounts[nextpc] += 1
+        if cpu.traceCounts[nextpc] == TRACE_THRESHOLD:
+            cpu.traceCounts[nextpc] = 0
+            # Start recording at the loop header. The first block recorded must
+            # start at it, so a dummy entry is used as the previous block
+            cpu.traceRecording = [(nextpc, 0, nextpc)]
+
+def trace_compile(cpu, path):
+    # Compiles a recorded path into a trace function and stores it in the
+    # trace table. The first entry of the path is the dummy entry
+    header = path[0][0]
+    fields = blockcompiler.block_fields(cpu)
+    body = []
+    lines = []
+    flagsLocal = False
+    k = 0
+    for start, retired, nextpc in path[1:]:
+        for pc in range(start, start + retired):
+            lines.append(pc)
+            line = cpu.compiled[pc]
+            # Expected next line in the path
+            expected = pc + 1 if pc < start + retired - 1 else nextpc
+            k += 1
+            fields["next"] = pc + 1
+            fields["pc"] = pc
+            fields["zero"] = "z" if flagsLocal else "cpu.zero"
+            fields["sign"] = "s" if flagsLocal else "cpu.sign"
+            if line == None:
+                continue
+
+            name = line[0].__name__
+            if name in branch_conditions:
+                # Guard on the branch going the same way as when recorded
+                condition = branch_conditions[name].format(**fields)
+                if expected == line[1]:
+                    body.append("if not ({:s}):".format(condition))
+                    body.append("    " + guard_exit.format(pc + 1, k).replace("\n", "\n    "))
+                else:
+                    body.append("if {:s}:".format(condition))
+                    body.append("    " + guard_exit.format(line[1], k).replace("\n", "\n    "))
+            elif name == "op_b_l":
+                pass
+            elif name in blockcompiler.compare_conditions:
+                # Compare, then guard on the branch going the same way
+                source, kind = blockcompiler.block_template(cpu, name)
+                body.append(source.format(*line, **fields))
+                flagsLocal = True
+                condition = blockcompiler.compare_conditions[name].format(zero = "z", sign = "s")
+                if expected == line[-2]:
+                    body.append("if not ({:s}):".format(condition))
+                    body.append("    " + guard_exit.format(line[-1], k).replace("\n", "\n    "))
+                else:
+                    body.append("if {:s}:".format(condition))
+                    body.append("    " + guard_exit.format(line[-2], k).replace("\n", "\n    "))
+            elif name in blockcompiler.templates:
+                source, kind = blockcompiler.block_template(cpu, name)
+                body.append(source.format(*line, **fields))
+                if kind == blockcompiler.RAISES or kind == blockcompiler.FCOMPARE:
+                    body.append("if irq.flag and not cpu.intc:")
+                    body.append("    " + guard_exit.format(pc + 1, k).replace("\n", "\n    "))
+                if kind == blockcompiler.COMPARE:
+                    flagsLocal = True
+                elif kind == blockcompiler.FCOMPARE:
+                    flagsLocal = False
+            else:
+                body.append("n = t{:d}()".format(pc))
+                if name in io_operations:
+                    # Let the outside world see the I/O before continuing
+                    body.append(guard_exit.format("n", k))
+                else:
+                    body.append("if n != {:d} or (irq.flag and not cpu.intc):".format(expected))
+                    body.append("    " + guard_exit.format("n", k).replace("\n", "\n    "))
+                flagsLocal = False
+
+    # Keep looping while a whole iteration fits in the budget
+    source = [
+        "k = 0",
+        "while k + {:d} <= budget:".format(k),
+        "    if irq.flag and not cpu.intc:",
+        "        " + guard_exit.format(header, 0).replace("\n", "\n        ")
+    ]
+    for statement in body:
+        source.append("    " + statement.replace("\n", "\n    "))
+    source.append("    k += {:d}".format(k))
+    source.append("return ({:d}, k)".format(header))
+
+    namespace = blockcompiler.block_namespace(cpu, lines)
+    cpu.traces[header] = blockcompiler.block_function("trace", ["budget"], source, namespace, "<trace {:d}>".format(header))
+    cpu.traceCompiles += 1